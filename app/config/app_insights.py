@@ -1,9 +1,30 @@
 import os
-from azure.monitor.opentelemetry import configure_azure_monitor
+from dotenv import load_dotenv
+
+load_dotenv()
 
 instrumentation_key = os.getenv("APPINSIGHTS_INSTRUMENTATIONKEY")
 
-if not instrumentation_key:
-    raise ValueError("Please set the APPINSIGHTS_INSTRUMENTATIONKEY environment variable.")
+_configured = False
+
+def configure_telemetry() -> bool:
+    """
+    Export traces, metrics and logs to Application Insights and instrument the HTTP clients
+    and the logging module. Called once, from the application lifespan: the exporters start
+    background threads and the resource detectors query the host, which must not happen on import.
+    Returns False, leaving telemetry disabled, when APPINSIGHTS_INSTRUMENTATIONKEY is not set.
+    """
+    global _configured
+    if _configured:
+        return True
+    if not instrumentation_key:
+        print("APPINSIGHTS_INSTRUMENTATIONKEY is not set, telemetry is disabled.")
+        return False
+    from azure.monitor.opentelemetry import configure_azure_monitor
+    from opentelemetry.instrumentation.logging import LoggingInstrumentor
 
-configure_azure_monitor(connection_string=instrumentation_key)
+    # The FastAPI app is instrumented by app.main, without the spans of every ASGI send/receive
+    configure_azure_monitor(connection_string=instrumentation_key, instrumentation_options={"fastapi": {"enabled": False}})
+    LoggingInstrumentor().instrument()
+    _configured = True
+    return True
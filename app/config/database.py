@@ -1,6 +1,9 @@
 import os
-from azure.cosmos import CosmosClient, PartitionKey
+from typing import Dict
+from azure.cosmos import CosmosClient
+from azure.cosmos.documents import ConnectionPolicy, RetryOptions
 from azure.identity import DefaultAzureCredential
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
 # Load the environment variables from the .env file
@@ -10,67 +13,187 @@ load_dotenv()
 COSMOS_DB_ENDPOINT = os.getenv("COSMOS_DB_ENDPOINT")
 COSMOS_DB_KEY = os.getenv("COSMOS_DB_KEY")
 COSMOS_DB_DATABASE = os.getenv("COSMOS_DB_DATABASE")
-COSMOS_CONTAINER_USERS = os.getenv("COSMOS_CONTAINERS_USERS")
-COSMOS_CONTAINER_TRAININGS = os.getenv("COSMOS_CONTAINERS_TRAININGS")
-COSMOS_CONTAINER_AVAILABILITIES = os.getenv("COSMOS_CONTAINERS_AVAILABILITIES")
-COSMOS_CONTAINER_NOTIFICATIONS = os.getenv("COSMOS_CONTAINERS_NOTIFICATIONS")
+# "sync" runs the blocking CosmosClient on the threadpool, "async" uses azure.cosmos.aio
+COSMOS_CLIENT_MODE = os.getenv("COSMOS_CLIENT_MODE", "sync").lower()
 
-# Create a DefaultAzureCredential object
-credential = DefaultAzureCredential()
+# 429 retries done by the SDK itself. Throttled calls are retried by app.repositories.resilient,
+# which honours the delay asked by the service and opens the circuit breaker of the container.
+COSMOS_SDK_THROTTLE_RETRIES = int(os.getenv("COSMOS_SDK_THROTTLE_RETRIES", "0"))
 
-# Validate that the required environment variables are set
-if not COSMOS_DB_ENDPOINT or not COSMOS_DB_DATABASE:
-    raise ValueError("Please set the COSMOS_DB_ENDPOINT and COSMOS_DB_DATABASE environment variables.")
+if COSMOS_CLIENT_MODE not in ("sync", "async"):
+    raise ValueError("COSMOS_CLIENT_MODE must be either 'sync' or 'async'.")
 
-# First, try authentication using the key
-try:
-    client = CosmosClient(COSMOS_DB_ENDPOINT, COSMOS_DB_KEY)
-    database = client.get_database_client(COSMOS_DB_DATABASE)
-except Exception as e:
-    print("Key-based authentication failed, trying with DefaultAzureCredential:", e)
-    try:
-        # If key-based authentication fails, try using DefaultAzureCredential
-        client = CosmosClient(COSMOS_DB_ENDPOINT, credential=credential)
-        database = client.get_database_client(COSMOS_DB_DATABASE)
-    except Exception as e:
-        raise ConnectionError(f"Failed to connect to CosmosDB using DefaultAzureCredential: {e}")
+def _connection_policy() -> ConnectionPolicy:
+    # Passed as a policy: the SDK ignores retry_total=0
+    policy = ConnectionPolicy()
+    policy.RetryOptions = RetryOptions(max_retry_attempt_count=COSMOS_SDK_THROTTLE_RETRIES)
+    return policy
 
-# Ensure the notifications container exists
-notifications_container_name = COSMOS_CONTAINER_NOTIFICATIONS
-if notifications_container_name:
-    try:
-        database.create_container_if_not_exists(id=notifications_container_name, partition_key=PartitionKey(path="/user_id"))
-    except Exception as e:
-        raise ConnectionError(f"Failed to create or access the container: {e}")
-else:
-    raise ValueError("COSMOS_CONTAINER_NOTIFICATIONS environment variable is not set")
+def _check_settings() -> None:
+    # Validate that the required environment variables are set
+    if not COSMOS_DB_ENDPOINT or not COSMOS_DB_DATABASE:
+        raise ValueError("Please set the COSMOS_DB_ENDPOINT and COSMOS_DB_DATABASE environment variables.")
 
-# Ensure the users container exists
-user_container_name = COSMOS_CONTAINER_USERS
-if user_container_name:
-    try:
-        database.create_container_if_not_exists(id=user_container_name, partition_key=PartitionKey(path="/id"))
-    except Exception as e:
-        raise ConnectionError(f"Failed to create or access the container: {e}")
-else:
-    raise ValueError("COSMOS_CONTAINER_USERS environment variable is not set")
+client = None
+database = None
 
-# Ensure the trainings container exists
-training_container_name = COSMOS_CONTAINER_TRAININGS
-if training_container_name:
-    try:
-        database.create_container_if_not_exists(id=training_container_name, partition_key=PartitionKey(path="/id"))
-    except Exception as e:
-        raise ConnectionError(f"Failed to create or access the container: {e}")
-else:
-    raise ValueError("COSMOS_CONTAINER_TRAININGS environment variable is not set")
+def open_client():
+    """
+    Create the shared blocking client and return the database client. Creating the client
+    reads the account over the network: it is called from the application lifespan
+    (open_storage) or, in scripts, on first use.
 
-# Ensure the availabilities container exists
-availability_container_name = COSMOS_CONTAINER_AVAILABILITIES
-if availability_container_name:
+    :raises ValueError: If COSMOS_DB_ENDPOINT or COSMOS_DB_DATABASE is not set.
+    :raises ConnectionError: If neither the key nor DefaultAzureCredential can connect.
+    """
+    global client, database
+    if database is not None:
+        return database
+    _check_settings()
+
+    # First, try authentication using the key
     try:
-        database.create_container_if_not_exists(id=availability_container_name, partition_key=PartitionKey(path="/id"))
+        client = CosmosClient(COSMOS_DB_ENDPOINT, COSMOS_DB_KEY, connection_policy=_connection_policy())
     except Exception as e:
-        raise ConnectionError(f"Failed to create or access the container: {e}")
-else:
-    raise ValueError("COSMOS_CONTAINER_AVAILABILITIES environment variable is not set")
+        print("Key-based authentication failed, trying with DefaultAzureCredential:", e)
+        try:
+            # If key-based authentication fails, try using DefaultAzureCredential
+            client = CosmosClient(COSMOS_DB_ENDPOINT, credential=DefaultAzureCredential(), connection_policy=_connection_policy())
+        except Exception as e:
+            raise ConnectionError(f"Failed to connect to CosmosDB using DefaultAzureCredential: {e}")
+    database = client.get_database_client(COSMOS_DB_DATABASE)
+    return database
+
+class SyncContainerProxy:
+    """
+    Exposes a blocking container client with the same awaitable interface as
+    azure.cosmos.aio.ContainerProxy. Every call runs on the threadpool.
+    """
+
+    def __init__(self, container):
+        self.container = container
+        self.id = container.id
+
+    async def read_item(self, item, partition_key, **kwargs):
+        return await run_in_threadpool(self.container.read_item, item=item, partition_key=partition_key, **kwargs)
+
+    async def create_item(self, body, **kwargs):
+        return await run_in_threadpool(self.container.create_item, body=body, **kwargs)
+
+    async def upsert_item(self, body, **kwargs):
+        return await run_in_threadpool(self.container.upsert_item, body=body, **kwargs)
+
+    async def replace_item(self, item, body, **kwargs):
+        return await run_in_threadpool(self.container.replace_item, item=item, body=body, **kwargs)
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        return await run_in_threadpool(self.container.execute_item_batch, batch_operations=batch_operations, partition_key=partition_key, **kwargs)
+
+    async def patch_item(self, item, partition_key, patch_operations, **kwargs):
+        return await run_in_threadpool(self.container.patch_item, item=item, partition_key=partition_key, patch_operations=patch_operations, **kwargs)
+
+    async def delete_item(self, item, partition_key, **kwargs):
+        return await run_in_threadpool(self.container.delete_item, item=item, partition_key=partition_key, **kwargs)
+
+    async def query_items(self, query, **kwargs):
+        # The async client fans out across partitions by default, the sync one needs to be told
+        if kwargs.get("partition_key") is None:
+            kwargs.setdefault("enable_cross_partition_query", True)
+        pager = self.container.query_items(query, **kwargs).by_page()
+
+        def fetch_next_page():
+            page = next(pager, None)
+            return None if page is None else list(page)
+
+        # Fetch one page at a time so that large results are not materialized at once
+        while True:
+            page = await run_in_threadpool(fetch_next_page)
+            if page is None:
+                return
+            for item in page:
+                yield item
+
+    async def query_page(self, query, page_size, continuation=None, **kwargs):
+        """
+        Fetch a single page of query results, returning the items and the continuation token.
+        """
+        if kwargs.get("partition_key") is None:
+            kwargs.setdefault("enable_cross_partition_query", True)
+
+        def fetch_page():
+            pager = self.container.query_items(query, max_item_count=page_size, **kwargs).by_page(continuation)
+            page = next(pager, None)
+            return (list(page) if page is not None else []), pager.continuation_token
+
+        return await run_in_threadpool(fetch_page)
+
+    async def read_change_feed(self, page_size, continuation=None, **kwargs):
+        """
+        Fetch a single page of the change feed, returning the items and the continuation token.
+        """
+        if continuation:
+            kwargs["continuation"] = continuation
+        else:
+            kwargs["start_time"] = "Beginning"
+
+        def fetch_page():
+            pager = self.container.query_items_change_feed(max_item_count=page_size, **kwargs).by_page()
+            page = next(pager, None)
+            return (list(page) if page is not None else []), pager.continuation_token
+
+        return await run_in_threadpool(fetch_page)
+
+async_client = None
+async_database = None
+_containers: Dict[str, object] = {}
+
+async def open_async_client() -> None:
+    """
+    Create the shared azure.cosmos.aio client. Called from the application lifespan.
+    """
+    global async_client, async_database
+    from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+
+    _check_settings()
+
+    if COSMOS_DB_KEY:
+        async_client = AsyncCosmosClient(COSMOS_DB_ENDPOINT, COSMOS_DB_KEY, connection_policy=_connection_policy())
+    else:
+        from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+        async_client = AsyncCosmosClient(COSMOS_DB_ENDPOINT, credential=AsyncDefaultAzureCredential(), connection_policy=_connection_policy())
+    async_database = async_client.get_database_client(COSMOS_DB_DATABASE)
+    _containers.clear()
+
+async def ping() -> None:
+    """
+    Read the database properties, used by the readiness probe.
+    """
+    if COSMOS_CLIENT_MODE == "async":
+        if async_database is None:
+            raise RuntimeError("The async Cosmos client is not open")
+        await async_database.read()
+    else:
+        await run_in_threadpool(lambda: open_client().read())
+
+async def close_async_client() -> None:
+    global async_client, async_database
+    if async_client is not None:
+        await async_client.close()
+    async_client = None
+    async_database = None
+    _containers.clear()
+
+def get_container(name: str):
+    """
+    Return an awaitable container client for the configured COSMOS_CLIENT_MODE.
+    """
+    container = _containers.get(name)
+    if container is None:
+        if COSMOS_CLIENT_MODE == "async":
+            if async_database is None:
+                raise RuntimeError("The async Cosmos client is not open, it is created in the application lifespan.")
+            container = async_database.get_container_client(name)
+        else:
+            container = SyncContainerProxy(open_client().get_container_client(name))
+        _containers[name] = container
+    return container
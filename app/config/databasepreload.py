@@ -55,6 +55,11 @@ user_container.upsert_item({
     "roles": ["admin"]
 })
 
+# Add the username index entries for the test users
+username_container = database.create_container_if_not_exists(id=os.getenv("COSMOS_CONTAINERS_USERNAMES", "usernames"), partition_key=PartitionKey(path="/id"))
+for user_id, username in [("1", "user1"), ("2", "trainer1"), ("3", "admin1")]:
+    username_container.upsert_item({"id": username, "username": username, "user_id": user_id})
+
 # Add test data for trainings
 training_container = database.get_container_client(containers["trainings"])
 training_container.upsert_item({
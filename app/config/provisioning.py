@@ -0,0 +1,134 @@
+"""
+Create the Cosmos DB database and the containers of the application, with their partition
+key, indexing policy and time-to-live. The application does not create them when it starts:
+run this once per environment, and again after a release that adds a container.
+
+Usage: python -m app.config.provisioning
+"""
+import os
+from azure.cosmos import PartitionKey
+from app.config import database
+from app.config.storage import PARTITION_KEYS
+from dotenv import load_dotenv
+
+load_dotenv()
+
+COSMOS_CONTAINER_USERS = os.getenv("COSMOS_CONTAINERS_USERS")
+COSMOS_CONTAINER_TRAININGS = os.getenv("COSMOS_CONTAINERS_TRAININGS")
+COSMOS_CONTAINER_AVAILABILITIES = os.getenv("COSMOS_CONTAINERS_AVAILABILITIES")
+COSMOS_CONTAINER_NOTIFICATIONS = os.getenv("COSMOS_CONTAINERS_NOTIFICATIONS")
+COSMOS_CONTAINER_USERNAMES = os.getenv("COSMOS_CONTAINERS_USERNAMES", "usernames")
+COSMOS_CONTAINER_OUTBOX = os.getenv("COSMOS_CONTAINERS_OUTBOX", "outbox")
+COSMOS_CONTAINER_RESERVATIONS = os.getenv("COSMOS_CONTAINERS_RESERVATIONS", "reservations")
+COSMOS_CONTAINER_NOTIFICATION_COUNTERS = os.getenv("COSMOS_CONTAINERS_NOTIFICATION_COUNTERS", "notification_counters")
+COSMOS_CONTAINER_TRAINER_SCHEDULES = os.getenv("COSMOS_CONTAINERS_TRAINER_SCHEDULES", "trainer_schedules")
+COSMOS_CONTAINER_MEMBER_SCHEDULES = os.getenv("COSMOS_CONTAINERS_MEMBER_SCHEDULES", "member_schedules")
+COSMOS_CONTAINER_SCHEDULE_SOURCES = os.getenv("COSMOS_CONTAINERS_SCHEDULE_SOURCES", "schedule_sources")
+COSMOS_CONTAINER_LEASES = os.getenv("COSMOS_CONTAINERS_LEASES", "leases")
+COSMOS_CONTAINER_IDEMPOTENCY_KEYS = os.getenv("COSMOS_CONTAINERS_IDEMPOTENCY_KEYS", "idempotency_keys")
+
+def _composite_index(*paths):
+    return [{"path": path, "order": order} for path, order in paths]
+
+def _indexing_policy(composite_indexes=(), excluded_paths=()):
+    return {
+        "indexingMode": "consistent",
+        "automatic": True,
+        "includedPaths": [{"path": "/*"}],
+        "excludedPaths": [{"path": '/"_etag"/?'}] + [{"path": path} for path in excluded_paths],
+        "compositeIndexes": list(composite_indexes),
+    }
+
+# Indexing policies applied when the containers are created. The composite indexes serve the
+# filters of the list endpoints (equality on the first path, range or sort on the second) and
+# properties that are never filtered on are excluded to lower the RU charge of the writes.
+# Containers that already exist keep their policy, it has to be updated from the portal or the CLI.
+INDEXING_POLICIES = {
+    "users": _indexing_policy(excluded_paths=["/hashed_password/?"]),
+    "trainings": _indexing_policy(composite_indexes=[
+        _composite_index(("/trainer_id", "ascending"), ("/start_time", "ascending")),
+        _composite_index(("/user_id", "ascending"), ("/start_time", "ascending")),
+        _composite_index(("/center_id", "ascending"), ("/start_time", "ascending")),
+        _composite_index(("/status", "ascending"), ("/start_time", "ascending")),
+    ]),
+    "availabilities": _indexing_policy(
+        composite_indexes=[_composite_index(("/trainer_id", "ascending"), ("/center_id", "ascending"))],
+        excluded_paths=["/available_times/*"],
+    ),
+    "notifications": _indexing_policy(
+        composite_indexes=[
+            _composite_index(("/user_id", "ascending"), ("/created_at", "descending")),
+            # Catch-up of the streams: ORDER BY created_at, id
+            _composite_index(("/created_at", "ascending"), ("/id", "ascending")),
+        ],
+        excluded_paths=["/message/?"],
+    ),
+    # Reservations are only read and written by id within the partition of their trainer
+    "reservations": {"indexingMode": "none", "automatic": False},
+    # Unread counters are only read and patched by id (the user id)
+    "notification_counters": {"indexingMode": "none", "automatic": False},
+    # Schedule views, their source records and the change feed leases are accessed by id; nothing
+    # is indexed but they stay queryable, the rebuild lists them to drop them
+    "trainer_schedules": {"indexingMode": "consistent", "automatic": True, "includedPaths": [], "excludedPaths": [{"path": "/*"}]},
+    "member_schedules": {"indexingMode": "consistent", "automatic": True, "includedPaths": [], "excludedPaths": [{"path": "/*"}]},
+    "schedule_sources": {"indexingMode": "consistent", "automatic": True, "includedPaths": [], "excludedPaths": [{"path": "/*"}]},
+    "leases": {"indexingMode": "none", "automatic": False},
+    # Responses of the requests sent with an Idempotency-Key, read and written by id
+    "idempotency_keys": {"indexingMode": "none", "automatic": False},
+    "outbox": _indexing_policy(
+        composite_indexes=[_composite_index(("/status", "ascending"), ("/next_attempt_at", "ascending"))],
+        excluded_paths=["/body/?", "/subject/?", "/last_error/?", "/recipients/*"],
+    ),
+}
+
+# (container, id of the Cosmos container, default time-to-live). TTL is enabled without a
+# default (-1) where documents expire individually: read notifications (see
+# NOTIFICATION_READ_TTL_SECONDS), the tombstones of the schedule view sources and the
+# idempotency records (see app.services.idempotency).
+# An existing container needs TTL enabled from the portal or the CLI.
+CONTAINERS = (
+    ("notifications", COSMOS_CONTAINER_NOTIFICATIONS, -1),
+    ("users", COSMOS_CONTAINER_USERS, None),
+    ("trainings", COSMOS_CONTAINER_TRAININGS, None),
+    ("availabilities", COSMOS_CONTAINER_AVAILABILITIES, None),
+    # Username -> user id lookup
+    ("usernames", COSMOS_CONTAINER_USERNAMES, None),
+    # Email outbox
+    ("outbox", COSMOS_CONTAINER_OUTBOX, None),
+    # Slot reservations, one partition per trainer (see TrainingService)
+    ("reservations", COSMOS_CONTAINER_RESERVATIONS, None),
+    # Unread notification counters, one document per user
+    ("notification_counters", COSMOS_CONTAINER_NOTIFICATION_COUNTERS, None),
+    # Schedule views, their sources and the change feed leases (see app.services.schedule_views)
+    ("trainer_schedules", COSMOS_CONTAINER_TRAINER_SCHEDULES, None),
+    ("member_schedules", COSMOS_CONTAINER_MEMBER_SCHEDULES, None),
+    ("schedule_sources", COSMOS_CONTAINER_SCHEDULE_SOURCES, -1),
+    ("leases", COSMOS_CONTAINER_LEASES, None),
+    ("idempotency_keys", COSMOS_CONTAINER_IDEMPOTENCY_KEYS, -1),
+)
+
+def provision() -> None:
+    """
+    Create the database and the containers that do not exist yet. Existing containers are left as they are.
+
+    :raises ValueError: If the name of a container is not set in the environment.
+    :raises ConnectionError: If a container cannot be created or accessed.
+    """
+    database.open_client()
+    cosmos_database = database.client.create_database_if_not_exists(id=database.COSMOS_DB_DATABASE)
+    for name, container_id, default_ttl in CONTAINERS:
+        if not container_id:
+            raise ValueError(f"The container name of {name} is not set in the environment")
+        try:
+            cosmos_database.create_container_if_not_exists(
+                id=container_id,
+                partition_key=PartitionKey(path=PARTITION_KEYS[name]),
+                indexing_policy=INDEXING_POLICIES.get(name),
+                default_ttl=default_ttl,
+            )
+        except Exception as e:
+            raise ConnectionError(f"Failed to create or access the container {container_id}: {e}")
+        print(f"Container {container_id} is ready.")
+
+if __name__ == "__main__":
+    provision()
@@ -0,0 +1,97 @@
+import os
+from typing import Dict
+from app.repositories.base import Repository
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "cosmos" (default), or one of the in-process backends used for local runs, benchmarks
+# and load tests without a Cosmos account: "memory" (dicts) or "sqlite" (SQLITE_PATH).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cosmos").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", ":memory:")
+# Physical partitions emulated by the in-process backends to price cross-partition queries
+EMULATED_PHYSICAL_PARTITIONS = int(os.getenv("EMULATED_PHYSICAL_PARTITIONS", "4"))
+
+# Retry throttled and transient failures and guard every container with a circuit breaker
+STORAGE_RESILIENCE = os.getenv("STORAGE_RESILIENCE", "true").lower() == "true"
+
+# Trace and meter every storage operation (request units, duration) per route
+STORAGE_INSTRUMENTATION = os.getenv("STORAGE_INSTRUMENTATION", "true").lower() == "true"
+
+if STORAGE_BACKEND not in ("cosmos", "memory", "sqlite"):
+    raise ValueError("STORAGE_BACKEND must be one of 'cosmos', 'memory' or 'sqlite'.")
+
+# Partition key path of every container used by the services
+PARTITION_KEYS = {
+    "users": "/id",
+    "usernames": "/id",
+    "trainings": "/id",
+    "availabilities": "/id",
+    "notifications": "/user_id",
+    "outbox": "/id",
+    "reservations": "/trainer_id",
+    "notification_counters": "/id",
+    "trainer_schedules": "/trainer_id",
+    "member_schedules": "/user_id",
+    "schedule_sources": "/id",
+    "leases": "/id",
+    "idempotency_keys": "/id",
+}
+
+_repositories: Dict[str, Repository] = {}
+
+def get_repository(name: str) -> Repository:
+    """
+    Return the shared repository of a container for the configured STORAGE_BACKEND.
+    """
+    repository = _repositories.get(name)
+    if repository is None:
+        partition_key_path = PARTITION_KEYS.get(name, "/id")
+        if STORAGE_BACKEND == "memory":
+            from app.repositories.memory import MemoryRepository
+            repository = MemoryRepository(name, partition_key_path, physical_partitions=EMULATED_PHYSICAL_PARTITIONS)
+        elif STORAGE_BACKEND == "sqlite":
+            from app.repositories.sqlite import SQLiteRepository
+            repository = SQLiteRepository(name, partition_key_path, path=SQLITE_PATH, physical_partitions=EMULATED_PHYSICAL_PARTITIONS)
+        else:
+            # Imported lazily: the in-process backends do not need the Cosmos SDK
+            from app.repositories.cosmos import CosmosRepository
+            repository = CosmosRepository(name, partition_key_path)
+        if STORAGE_RESILIENCE:
+            from app.repositories.resilient import ResilientRepository
+            repository = ResilientRepository(repository)
+        if STORAGE_INSTRUMENTATION:
+            from app.repositories.instrumented import InstrumentedRepository
+            repository = InstrumentedRepository(repository)
+        _repositories[name] = repository
+    return repository
+
+def get_repositories() -> Dict[str, Repository]:
+    return dict(_repositories)
+
+async def open_storage() -> None:
+    """
+    Open the clients of the storage backend. Called from the application lifespan.
+    """
+    if STORAGE_BACKEND == "cosmos":
+        from starlette.concurrency import run_in_threadpool
+        from app.config.database import COSMOS_CLIENT_MODE, open_async_client, open_client
+        if COSMOS_CLIENT_MODE == "async":
+            await open_async_client()
+        else:
+            await run_in_threadpool(open_client)
+
+async def close_storage() -> None:
+    if STORAGE_BACKEND == "cosmos":
+        from app.config.database import close_async_client
+        await close_async_client()
+
+async def check_storage() -> None:
+    """
+    Round trip to the storage backend, for the readiness probe.
+
+    :raises Exception: Whatever the backend raised.
+    """
+    if STORAGE_BACKEND == "cosmos":
+        from app.config.database import ping
+        await ping()
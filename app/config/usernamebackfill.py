@@ -0,0 +1,33 @@
+"""
+Backfill the username index for users created before it existed.
+
+Usage: python -m app.config.usernamebackfill
+"""
+import asyncio
+from app.config.storage import get_repository
+from app.services.user_service import username_index_id
+
+async def backfill_username_index() -> None:
+    user_repository = get_repository("users")
+    username_repository = get_repository("usernames")
+
+    indexed = 0
+    conflicts = []
+    seen = {}
+    async for item in user_repository.query():
+        username = item.get("username")
+        if not username:
+            continue
+        if username in seen:
+            conflicts.append((username, seen[username], item["id"]))
+            continue
+        seen[username] = item["id"]
+        await username_repository.upsert({"id": username_index_id(username), "username": username, "user_id": item["id"]})
+        indexed += 1
+
+    print(f"Indexed {indexed} usernames.")
+    for username, first_id, duplicate_id in conflicts:
+        print(f"Duplicate username '{username}': kept user {first_id}, skipped user {duplicate_id}")
+
+if __name__ == "__main__":
+    asyncio.run(backfill_username_index())
@@ -5,7 +5,10 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from app.models.user import User
+from app.repositories.base import ItemNotFoundError
 from app.services.user_service import UserService
+from app.dependencies.services import get_user_service
+from app.services.principal_cache import principal_cache
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -15,16 +18,11 @@ load_dotenv()
 SECRET_KEY = os.environ.get("AUTH_SECRET_KEY", "secret")
 ALGORITHM = os.environ.get("AUTH_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("AUTH_EXPIRATION", "30"))
+# When enabled, the user id, email and roles embedded in the token are trusted and no database read is done
+TRUST_TOKEN_CLAIMS = os.environ.get("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() == "true"
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_user_service() -> UserService:
-    """
-    Function to get the user service instance.
-    This enables dependency injection and simplifies testing.
-    """
-    return UserService()
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Create an access token (JWT) with the provided data.
@@ -39,7 +37,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), user_service: UserService = Depends(get_user_service)) -> User:
+def build_token_claims(user: User) -> dict:
+    """
+    Build the claims embedded in the access token for a user.
+
+    Besides the subject, the user id, email and roles are included so that the current user
+    can be resolved with a point read, or without any read when TRUST_TOKEN_CLAIMS is set.
+    """
+    return {"sub": user.username, "uid": user.id, "email": user.email, "roles": user.roles}
+
+async def get_current_user(token: str = Depends(oauth2_scheme), user_service: UserService = Depends(get_user_service)) -> User:
     """
     Dependency function to retrieve the current user based on the provided JWT token.
 
@@ -61,8 +68,30 @@ def get_current_user(token: str = Depends(oauth2_scheme), user_service: UserServ
     except JWTError:
         raise credentials_exception
 
-    user = user_service.get_user_by_username(username)
+    user = principal_cache.get(username)
+    if user is not None:
+        return user
+
+    generation = principal_cache.generation
+    user_id = payload.get("uid")
+    email = payload.get("email")
+    roles = payload.get("roles")
+    # Tokens issued before the email was a claim resolve the user from the database
+    if TRUST_TOKEN_CLAIMS and user_id and email is not None and roles is not None:
+        return User(_id=user_id, username=username, email=email, hashed_password="", roles=roles)
+
+    if user_id:
+        try:
+            user = await user_service.get_user(user_id)
+        except ItemNotFoundError:
+            raise credentials_exception
+        # The account was renamed after the token was issued
+        if user.username != username:
+            raise credentials_exception
+    else:
+        user = await user_service.get_user_by_username(username)
     if user is None:
         raise credentials_exception
 
+    principal_cache.set(username, user, generation)
     return user
\ No newline at end of file
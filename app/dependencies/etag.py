@@ -0,0 +1,18 @@
+from typing import Optional
+from fastapi import Header, Response
+from pydantic import BaseModel
+
+async def get_if_match(
+    if_match: Optional[str] = Header(None, description="ETag returned by a previous read. The update fails with 412 if the resource was modified since."),
+) -> Optional[str]:
+    """
+    Dependency reading the If-Match header of the update endpoints. "*" matches any existing resource.
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    return if_match.strip()
+
+def set_etag_header(response: Response, model: BaseModel) -> None:
+    etag = getattr(model, "etag", None)
+    if etag:
+        response.headers["ETag"] = etag
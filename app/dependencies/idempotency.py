@@ -0,0 +1,126 @@
+import base64
+import hashlib
+from typing import Dict, Optional
+from jose import JWTError, jwt
+from starlette.responses import JSONResponse
+from app.dependencies.auth import ALGORITHM, SECRET_KEY
+from app.models.idempotency import IdempotencyRecord
+from app.services.idempotency import IdempotencyKeyInUse, IdempotencyStore, idempotency_store
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+# Create endpoints honouring the Idempotency-Key header
+IDEMPOTENT_ROUTES = {("POST", "/trainings/"), ("POST", "/notifications/"), ("POST", "/users/")}
+# Responses that are not replayed, the request is executed again on retry
+_TRANSIENT_STATUSES = {401, 408, 429}
+
+def _scope_of(headers: Dict[bytes, bytes]) -> Optional[str]:
+    # Keys are scoped to the user of the request; requests without a valid token are not
+    # deduplicated, they are rejected by the endpoint anyway
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("uid") or payload.get("sub")
+
+class IdempotencyMiddleware:
+    """
+    ASGI middleware replaying the response of the create endpoints (IDEMPOTENT_ROUTES) to the
+    retries of a request sent with the same Idempotency-Key header, by the same user, within
+    IDEMPOTENCY_TTL_SECONDS. A retry arriving while the first request is in flight waits for
+    it. Reusing a key with a different body is rejected with 422. Server errors and
+    transient statuses are not recorded, so the retry is executed again.
+    """
+
+    def __init__(self, app, store: Optional[IdempotencyStore] = None):
+        self.app = app
+        self.store = store or idempotency_store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in IDEMPOTENT_ROUTES:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER.encode(), b"").decode("latin-1").strip()
+        user = _scope_of(headers) if idempotency_key else None
+        if not user:
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            await JSONResponse({"detail": f"The Idempotency-Key header must not exceed {MAX_KEY_LENGTH} characters"}, status_code=400)(scope, receive, send)
+            return
+
+        # The body is read up front to fingerprint it, then handed over to the endpoint
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        key = hashlib.sha256("\n".join((user, scope["method"], scope["path"], idempotency_key)).encode()).hexdigest()
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        try:
+            record = await self.store.begin(key, fingerprint)
+        except IdempotencyKeyInUse:
+            response = JSONResponse(
+                {"detail": "A request with this Idempotency-Key is still being processed"}, status_code=409, headers={"Retry-After": "1"}
+            )
+            await response(scope, receive, send)
+            return
+        if record is not None:
+            await self._replay(record, fingerprint, scope, receive, send)
+            return
+
+        body_sent = False
+
+        async def receive_body():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        start = None
+        response_chunks = []
+
+        async def send_and_record(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                response_chunks.append(message.get("body", b""))
+            await send(message)
+
+        completed = False
+        try:
+            await self.app(scope, receive_body, send_and_record)
+            if start is not None and start["status"] < 500 and start["status"] not in _TRANSIENT_STATUSES:
+                await self.store.complete(IdempotencyRecord(
+                    id=key,
+                    fingerprint=fingerprint,
+                    state="completed",
+                    status_code=start["status"],
+                    headers=[[name.decode("latin-1"), value.decode("latin-1")] for name, value in start.get("headers", [])],
+                    body=base64.b64encode(b"".join(response_chunks)).decode(),
+                ))
+                completed = True
+        finally:
+            if not completed:
+                await self.store.release(key)
+
+    async def _replay(self, record: IdempotencyRecord, fingerprint: str, scope, receive, send) -> None:
+        if record.fingerprint != fingerprint:
+            response = JSONResponse({"detail": "The Idempotency-Key was already used with a different request"}, status_code=422)
+            await response(scope, receive, send)
+            return
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record.headers]
+        await send({"type": "http.response.start", "status": record.status_code, "headers": [*headers, (b"idempotent-replayed", b"true")]})
+        await send({"type": "http.response.body", "body": base64.b64decode(record.body or "")})
@@ -0,0 +1,66 @@
+import base64
+import json
+from typing import Any, AsyncIterator, Optional, Type
+from fastapi import HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from app.dependencies.serialization import dumps, serializer_for
+
+CONTINUATION_HEADER = "X-Continuation-Token"
+STREAM_PAGE_SIZE = 100
+
+class Pagination(BaseModel):
+    limit: Optional[int] = None
+    continuation: Optional[str] = None
+    stream: bool = False
+
+async def get_pagination(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of items to return. The token of the next page is returned in the X-Continuation-Token header."),
+    continuation: Optional[str] = Query(None, description="Continuation token returned by the previous page."),
+    stream: bool = Query(False, description="Stream every item as newline-delimited JSON (application/x-ndjson) as pages are read."),
+) -> Pagination:
+    """
+    Dependency parsing the pagination query parameters of the list endpoints.
+    """
+    return Pagination(limit=limit, continuation=decode_continuation(continuation), stream=stream)
+
+def encode_continuation(token: Optional[str]) -> Optional[str]:
+    """
+    Wrap a storage continuation token in an opaque, URL-safe token.
+    """
+    if token is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps({"c": token}).encode()).decode().rstrip("=")
+
+def decode_continuation(token: Optional[str]) -> Optional[str]:
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))["c"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid continuation token")
+
+def set_continuation_header(response: Response, token: Optional[str]) -> None:
+    encoded = encode_continuation(token)
+    if encoded:
+        response.headers[CONTINUATION_HEADER] = encoded
+
+def ndjson_response(items: AsyncIterator[Any], response_model: Optional[Type[BaseModel]] = None) -> StreamingResponse:
+    """
+    Stream the items as newline-delimited JSON, serialized with the endpoint's response model.
+    Stored documents (dicts) are shaped like the response model without validating them;
+    without a response model (projected documents) the items are written as they are.
+    """
+    serializer = serializer_for(response_model) if response_model is not None else None
+
+    async def lines():
+        async for item in items:
+            if serializer is None:
+                yield dumps(item) + b"\n"
+            elif isinstance(item, dict):
+                yield serializer.dumps(item) + b"\n"
+            else:
+                yield response_model.model_validate(item, from_attributes=True).model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
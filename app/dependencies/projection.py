@@ -0,0 +1,24 @@
+from typing import Any, Dict, List, Optional
+from fastapi import HTTPException, Query, Response
+from app.dependencies.serialization import FastJSONResponse, documents_response
+from app.repositories.base import validate_fields
+
+async def get_fields(
+    fields: Optional[str] = Query(None, description="Comma-separated top-level properties to return, e.g. fields=trainer_id,start_time. The id is always returned."),
+) -> Optional[List[str]]:
+    """
+    Dependency parsing the `fields` projection of the list endpoints.
+    """
+    if not fields:
+        return None
+    try:
+        return validate_fields([field.strip() for field in fields.split(",") if field.strip()])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def projected_response(items: List[Dict[str, Any]], response: Response) -> FastJSONResponse:
+    """
+    Projected documents do not match the response model of the endpoint, they are returned
+    as they come from the database, with the headers already set on `response`.
+    """
+    return documents_response(items, response)
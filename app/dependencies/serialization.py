@@ -0,0 +1,72 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple, Type
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_core import to_json
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+load_dotenv()
+
+# The list endpoints answer straight from the stored documents: the services return them
+# as dicts and they are shaped like the response model and serialized without building
+# models, validating them again against the response model, nor going through the default
+# JSON encoder. The documents come from our own store, where they were validated on write.
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "true").lower() == "true"
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize to JSON with orjson when it is installed, with pydantic's serializer otherwise.
+    """
+    if orjson is not None:
+        # Datetimes like pydantic: UTC as "Z"
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+    return to_json(content)
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+class DocumentSerializer:
+    """
+    Shapes stored documents like a response model without validating them: only the fields
+    of the model are kept (system properties and secrets such as hashed_password are left
+    out), in the order of the model, with the model defaults for the missing ones.
+    """
+
+    def __init__(self, response_model: Type[BaseModel]):
+        self.response_model = response_model
+        self._fields: List[Tuple[str, Any]] = [
+            (name, None if field.is_required() else field.get_default(call_default_factory=True))
+            for name, field in response_model.model_fields.items()
+        ]
+
+    def shape(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: document.get(name, default) for name, default in self._fields}
+
+    def dumps(self, document: Dict[str, Any]) -> bytes:
+        return dumps(self.shape(document))
+
+_serializers: Dict[Type[BaseModel], DocumentSerializer] = {}
+
+def serializer_for(response_model: Type[BaseModel]) -> DocumentSerializer:
+    serializer = _serializers.get(response_model)
+    if serializer is None:
+        serializer = _serializers[response_model] = DocumentSerializer(response_model)
+    return serializer
+
+def documents_response(documents: List[Dict[str, Any]], response: Response, response_model: Optional[Type[BaseModel]] = None) -> FastJSONResponse:
+    """
+    Answer with stored documents, shaped like `response_model` or as they are (projections),
+    with the headers already set on `response`.
+    """
+    if response_model is not None:
+        shape = serializer_for(response_model).shape
+        documents = [shape(document) for document in documents]
+    headers = {name: value for name, value in response.headers.items() if name.lower() != "content-length"}
+    return FastJSONResponse(documents, headers=headers)
@@ -0,0 +1,37 @@
+from typing import Optional
+from app.services.notification_service import NotificationService
+from app.services.training_service import TrainingService
+from app.services.user_service import UserService
+
+class Services:
+    """
+    The services of the process, created once and shared by every request. They get their
+    repositories, and through them the container clients and connection pools, from
+    app.config.storage; the caches they use are module singletons of app.services.
+    """
+
+    def __init__(self):
+        self.users = UserService()
+        self.trainings = TrainingService()
+        self.notifications = NotificationService(user_service=self.users)
+
+_services: Optional[Services] = None
+
+def get_services() -> Services:
+    global _services
+    if _services is None:
+        _services = Services()
+    return _services
+
+# The dependencies are coroutines so that FastAPI resolves them on the event loop instead of
+# dispatching them to the threadpool. Tests and tools replace a service for one app with
+# app.dependency_overrides[get_user_service] = ...
+
+async def get_user_service() -> UserService:
+    return get_services().users
+
+async def get_training_service() -> TrainingService:
+    return get_services().trainings
+
+async def get_notification_service() -> NotificationService:
+    return get_services().notifications
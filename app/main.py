@@ -1,47 +1,88 @@
-from fastapi import FastAPI
-from app.routers import users, auth, trainings, notifications
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.routers import users, auth, trainings, notifications, health
+from app.config.storage import get_repositories, open_storage, close_storage
+from app.repositories.instrumented import RequestUsageMiddleware, storage_metrics
+from app.dependencies.idempotency import IdempotencyMiddleware
+from app.repositories.base import ItemNotFoundError, PreconditionFailedError, ServiceUnavailableError
+from app.services.password_hasher import password_hasher
+from app.services.invalidation_bus import invalidation_bus
+from app.services.email_dispatcher import EMAIL_DISPATCHER_MODE, email_dispatcher
+from app.services.schedule_views import SCHEDULE_VIEWS_MODE, schedule_views
+from app.config.app_insights import configure_telemetry
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
-import os
+import math
 
-from azure.monitor.opentelemetry.exporter import AzureMonitorTraceExporter
-from opentelemetry import trace
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.instrumentation.logging import LoggingInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.instrumentation.urllib import URLLibInstrumentor
-from opentelemetry.instrumentation.urllib3 import URLLib3Instrumentor
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Configurar Application Insights
-from app.config.app_insights import configure_azure_monitor
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing connects to Azure on import: telemetry and clients are created here, and the
+    # containers by the provisioning command (python -m app.config.provisioning)
+    await run_in_threadpool(configure_telemetry)
+    # The async Cosmos client must be created inside the event loop that serves the requests
+    await open_storage()
+    # Before any request: the caches of this worker must hear about the writes of the others
+    await invalidation_bus.start()
+    if EMAIL_DISPATCHER_MODE == "inprocess":
+        await email_dispatcher.start()
+    if SCHEDULE_VIEWS_MODE == "inprocess":
+        await schedule_views.start()
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    await schedule_views.stop()
+    await email_dispatcher.stop()
+    await invalidation_bus.stop()
+    await close_storage()
+    password_hasher.shutdown()
 
-# Configurar OpenTelemetry
-trace.set_tracer_provider(TracerProvider())
-tracer = trace.get_tracer(__name__)
-exporter = AzureMonitorTraceExporter.from_connection_string(os.getenv("APPINSIGHTS_INSTRUMENTATIONKEY"))
-span_processor = BatchSpanProcessor(exporter)
-trace.get_tracer_provider().add_span_processor(span_processor)
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+app.state.ready = False
 
-# Instrumentar FastAPI
-FastAPIInstrumentor.instrument_app(app)
+# Instrumentar FastAPI. Only adds a middleware: the spans are exported once configure_telemetry
+# has set the tracer provider in the lifespan
+FastAPIInstrumentor.instrument_app(app, exclude_spans=["receive", "send"])
 
-# Instrumentar otras bibliotecas
-LoggingInstrumentor().instrument()
-RequestsInstrumentor().instrument()
-URLLibInstrumentor().instrument()
-URLLib3Instrumentor().instrument()
+# Replay the responses of the create endpoints to the retries sent with the same Idempotency-Key
+app.add_middleware(IdempotencyMiddleware)
+
+# Request units and database time of the storage operations per route
+app.add_middleware(RequestUsageMiddleware)
 
 app.include_router(users.router)
 app.include_router(auth.router)
 app.include_router(trainings.router)
 app.include_router(notifications.router)
+app.include_router(health.router)
+
+@app.exception_handler(ItemNotFoundError)
+async def item_not_found_handler(request: Request, exc: ItemNotFoundError):
+    return JSONResponse(status_code=404, content={"detail": "Not found"})
+
+@app.exception_handler(PreconditionFailedError)
+async def precondition_failed_handler(request: Request, exc: PreconditionFailedError):
+    return JSONResponse(status_code=412, content={"detail": "The resource was modified, read it again and retry"})
+
+@app.exception_handler(ServiceUnavailableError)
+async def service_unavailable_handler(request: Request, exc: ServiceUnavailableError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The service is busy, retry later"},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Gym Management API"}
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    # Prometheus text format, for local scraping
+    return PlainTextResponse(storage_metrics.render(get_repositories()), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+class IdempotencyRecord(BaseModel):
+    id: str  # Hash of the user, method, path and Idempotency-Key of the request
+    fingerprint: str  # Hash of the request body
+    state: str = "pending"  # pending | completed
+    status_code: Optional[int] = None
+    headers: List[List[str]] = []
+    body: Optional[str] = None  # Base64 of the response body
+    # Seconds the record is kept (Cosmos TTL): the lock of a pending request, then the response
+    ttl: Optional[int] = None
+
+    class Config:
+        from_attributes = True
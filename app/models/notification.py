@@ -8,6 +8,10 @@ class Notification(BaseModel):
     message: str
     read: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(datetime.timezone.utc))
+    delivery_status: Optional[str] = None  # pending | sent | failed
+    delivered_at: Optional[datetime] = None
+    # ETag of the stored document, used for optimistic concurrency. Never written back.
+    etag: Optional[str] = Field(None, alias="_etag", exclude=True)
 
     class Config:
         from_attributes = True
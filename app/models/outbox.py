@@ -0,0 +1,28 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime, timezone
+
+class OutboxRecipient(BaseModel):
+    notification_id: str
+    user_id: str
+
+class OutboxMessage(BaseModel):
+    id: str
+    notification_id: str
+    user_id: str
+    subject: str
+    body: str
+    # Every recipient of a bulk notification queued as a single message (the first one is also
+    # in notification_id and user_id). Empty for a message to a single user.
+    recipients: List[OutboxRecipient] = []
+    status: str = "pending"  # pending | sending (claimed by a dispatcher) | dead
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    class Config:
+        from_attributes = True
+
+    def deliveries(self) -> List[OutboxRecipient]:
+        return self.recipients or [OutboxRecipient(notification_id=self.notification_id, user_id=self.user_id)]
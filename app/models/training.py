@@ -9,9 +9,20 @@ class Training(BaseModel):
     start_time: datetime
     end_time: datetime
     status: str
+    center_id: Optional[str] = None
+    # ETag of the stored document, used for optimistic concurrency. Never written back.
+    etag: Optional[str] = Field(None, alias="_etag", exclude=True)
+
+    class Config:
+        populate_by_name = True
 
 class Availability(BaseModel):
     id: str = Field(..., alias="_id")
     trainer_id: str
     center_id: str
     available_times: List[datetime]
+    # ETag of the stored document, used for optimistic concurrency. Never written back.
+    etag: Optional[str] = Field(None, alias="_etag", exclude=True)
+
+    class Config:
+        populate_by_name = True
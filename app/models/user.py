@@ -7,9 +7,12 @@ class User(BaseModel):
     email: str
     hashed_password: str
     roles: List[str] = []
+    # ETag of the stored document, used for optimistic concurrency. Never written back.
+    etag: Optional[str] = Field(None, alias="_etag", exclude=True)
 
     class Config:
         from_attributes = True
+        populate_by_name = True
 
 class Trainer(User):
     availability: List[str] = []
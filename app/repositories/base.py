@@ -0,0 +1,346 @@
+import copy
+import json
+import math
+import re
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from pydantic_core import to_jsonable_python
+
+# A query condition: (field, operator, value). Fields may be nested with dots ("a.b").
+# Operators: "=", "!=", "<", "<=", ">", ">=", "in" (field value is one of a list)
+# and "contains" (array field contains the value).
+Condition = Tuple[str, str, Any]
+# Sort order: (field, "ASC" | "DESC")
+OrderBy = Tuple[str, str]
+# Projection: top-level properties to return instead of the whole document ("id" is always returned)
+Fields = Sequence[str]
+
+OPERATORS = ("=", "!=", "<", "<=", ">", ">=", "in", "contains")
+
+_FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+class RepositoryError(Exception):
+    """
+    Base class of the errors raised by repositories, whatever the backend.
+    """
+
+class ItemNotFoundError(RepositoryError):
+    pass
+
+class ItemExistsError(RepositoryError):
+    pass
+
+class PreconditionFailedError(RepositoryError):
+    """
+    The document was modified since the ETag given in `if_match` was read.
+    """
+
+class ThrottledError(RepositoryError):
+    """
+    The container is out of request units (Cosmos 429). `retry_after` is the delay in
+    seconds the service asked for before retrying.
+    """
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TransientError(RepositoryError):
+    """
+    A failure worth retrying: timeout, service unavailable, connection error. The operation
+    may have been applied when `sent` is true (the request reached the service).
+    """
+
+    def __init__(self, message: str, sent: bool = True):
+        super().__init__(message)
+        self.sent = sent
+
+class ServiceUnavailableError(RepositoryError):
+    """
+    The container is unavailable: its retries were exhausted or its circuit breaker is open.
+    Clients should come back after `retry_after` seconds.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def validate_field(field: str) -> str:
+    """
+    Field names end up inside query text, only plain (dotted) identifiers are accepted.
+    """
+    if not _FIELD_PATTERN.match(field):
+        raise ValueError(f"Invalid field name: {field!r}")
+    return field
+
+def validate_conditions(conditions: Optional[Sequence[Condition]]) -> List[Condition]:
+    validated = []
+    for field, operator, value in conditions or []:
+        validate_field(field)
+        if operator not in OPERATORS:
+            raise ValueError(f"Invalid operator: {operator!r}")
+        validated.append((field, operator, to_jsonable_python(value)))
+    return validated
+
+def validate_order_by(order_by: Optional[Sequence[OrderBy]]) -> List[OrderBy]:
+    validated = []
+    for field, direction in order_by or []:
+        direction = direction.upper()
+        if direction not in ("ASC", "DESC"):
+            raise ValueError(f"Invalid sort direction: {direction!r}")
+        validated.append((validate_field(field), direction))
+    return validated
+
+def validate_fields(fields: Optional[Fields]) -> List[str]:
+    """
+    Validate a projection. An empty result means the whole document is returned.
+    """
+    validated = []
+    for field in fields or []:
+        if "." in validate_field(field):
+            raise ValueError(f"Only top-level properties can be projected: {field!r}")
+        if field not in validated:
+            validated.append(field)
+    if validated and "id" not in validated:
+        validated.insert(0, "id")
+    return validated
+
+def project(item: Dict[str, Any], fields: Sequence[str]) -> Dict[str, Any]:
+    # Like Cosmos, properties missing from the document are left out of the projection
+    if not fields:
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+def is_expired(item: Dict[str, Any], now: float) -> bool:
+    """
+    Whether the document outlived its `ttl`, the seconds it lives after its last write
+    (`_ts`). The in-process backends emulate Cosmos time-to-live with it; on Cosmos the
+    container needs TTL enabled (default_ttl) for `ttl` to be honoured.
+    """
+    ttl = item.get("ttl")
+    if isinstance(ttl, bool) or not isinstance(ttl, int) or ttl <= 0:
+        return False
+    return item.get("_ts", 0) + ttl <= now
+
+# Request unit model used by the in-process backends, close to what Cosmos charges
+# for small documents: reads cost 1 RU/KB, writes ~5.7 RU/KB and queries pay a base
+# charge on every physical partition they touch plus a per-KB charge for the results.
+READ_RU_PER_KB = 1.0
+WRITE_RU_PER_KB = 5.71
+QUERY_BASE_RU = 2.31
+QUERY_RU_PER_KB = 0.38
+
+def document_size_kb(item: Dict[str, Any]) -> int:
+    return max(1, math.ceil(len(json.dumps(item, separators=(",", ":"))) / 1024))
+
+def estimate_query_charge(items: Sequence[Dict[str, Any]], partitions_touched: int) -> float:
+    return QUERY_BASE_RU * partitions_touched + QUERY_RU_PER_KB * sum(document_size_kb(item) for item in items)
+
+# [request charge, item count] of the repository operation in progress, accumulated by
+# `Repository._record` for app.repositories.instrumented
+operation_usage: ContextVar[Optional[List[float]]] = ContextVar("operation_usage", default=None)
+
+# Maximum number of operations of a Cosmos transactional batch
+MAX_BATCH_OPERATIONS = 100
+
+def set_operations(changes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Patch operations setting top-level properties to the given values.
+    """
+    return [{"op": "set", "path": f"/{field}", "value": value} for field, value in changes.items()]
+
+def apply_patch_operations(item: Dict[str, Any], operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Apply Cosmos patch operations to a copy of the document and return it.
+    """
+    patched = copy.deepcopy(item)
+    for operation in operations:
+        op = operation["op"]
+        parts = operation["path"].strip("/").split("/")
+        parent = patched
+        for part in parts[:-1]:
+            parent = parent[int(part)] if isinstance(parent, list) else parent.setdefault(part, {})
+        key = parts[-1]
+        value = to_jsonable_python(operation.get("value"))
+        if isinstance(parent, list):
+            index = len(parent) if key == "-" else int(key)
+            if op == "add":
+                parent.insert(index, value)
+            elif op in ("set", "replace"):
+                parent[index] = value
+            elif op == "remove":
+                del parent[index]
+            elif op == "incr":
+                parent[index] += value
+            else:
+                raise ValueError(f"Invalid patch operation: {op!r}")
+            continue
+        if op in ("set", "add"):
+            parent[key] = value
+        elif op == "replace":
+            if key not in parent:
+                raise ValueError(f"Cannot replace missing path {operation['path']!r}")
+            parent[key] = value
+        elif op == "remove":
+            if key not in parent:
+                raise ValueError(f"Cannot remove missing path {operation['path']!r}")
+            del parent[key]
+        elif op == "incr":
+            parent[key] = parent.get(key, 0) + value
+        else:
+            raise ValueError(f"Invalid patch operation: {op!r}")
+    return patched
+
+class Repository(ABC):
+    """
+    Storage of the documents of one container.
+
+    Documents are plain JSON-compatible dicts with an "id" and a partition key property
+    (`partition_key_path`). Every operation is accounted for in `stats`, including the
+    request units (RU) it consumed, so that backends can be compared.
+    """
+
+    def __init__(self, name: str, partition_key_path: str = "/id"):
+        self.name = name
+        self.partition_key_path = partition_key_path
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def partition_key_of(self, item: Dict[str, Any]) -> Any:
+        value = item
+        for part in self.partition_key_path.strip("/").split("/"):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def batch_partition_key(self, items: List[Dict[str, Any]]) -> Any:
+        """
+        Common partition key of the documents of a transactional batch.
+        """
+        if not items or len(items) > MAX_BATCH_OPERATIONS:
+            raise ValueError(f"A batch must contain between 1 and {MAX_BATCH_OPERATIONS} documents")
+        partition_keys = {json.dumps(self.partition_key_of(item)) for item in items}
+        if len(partition_keys) != 1:
+            raise ValueError("The documents of a batch must share the same partition key")
+        return self.partition_key_of(items[0])
+
+    def _record(self, operation: str, request_charge: float, item_count: int = 1) -> None:
+        stats = self.stats.setdefault(operation, {"count": 0, "request_charge": 0.0, "items": 0})
+        stats["count"] += 1
+        stats["request_charge"] += request_charge
+        stats["items"] += item_count
+        usage = operation_usage.get()
+        if usage is not None:
+            usage[0] += request_charge
+            usage[1] += item_count
+
+    @property
+    def total_request_charge(self) -> float:
+        return sum(stats["request_charge"] for stats in self.stats.values())
+
+    @abstractmethod
+    async def read(self, item_id: str, partition_key: Any) -> Dict[str, Any]:
+        """
+        Point read of a document.
+
+        :raises ItemNotFoundError: If there is no such document in the partition.
+        """
+
+    @abstractmethod
+    def query(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        fields: Optional[Fields] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Iterate over the documents matching all the conditions. Without a partition key
+        the query fans out across every partition. With `fields`, only those properties are returned.
+        """
+
+    @abstractmethod
+    async def query_page(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        page_size: int = 100,
+        continuation: Optional[str] = None,
+        fields: Optional[Fields] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Return one page of results and the continuation token of the next page (None on the last page).
+        """
+
+    async def iter_pages(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        page_size: int = 100,
+        continuation: Optional[str] = None,
+        fields: Optional[Fields] = None,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield the results page by page, fetching the next page only when the previous one was consumed.
+        """
+        while True:
+            items, continuation = await self.query_page(conditions, partition_key, order_by, page_size, continuation, fields)
+            if items:
+                yield items
+            if not continuation:
+                return
+
+    @abstractmethod
+    async def read_change_feed(self, continuation: Optional[str] = None, page_size: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of the documents created or updated after `continuation` (from the beginning
+        of the container when None), oldest change first, and the continuation to resume from.
+
+        Like the Cosmos latest-version change feed, a document changed several times is only
+        returned once, in its last version, and deletions are not reported. An empty page
+        means the feed is caught up.
+        """
+
+    @abstractmethod
+    async def create(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        :raises ItemExistsError: If a document with the same id exists in the partition.
+        """
+
+    @abstractmethod
+    async def create_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Create documents of a single logical partition atomically: either all of them are
+        created or none is (a Cosmos transactional batch, at most 100 documents).
+
+        :raises ValueError: If the documents are not all in the same partition.
+        :raises ItemExistsError: If any of the documents already exists, nothing is created then.
+        """
+
+    @abstractmethod
+    async def upsert(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        pass
+
+    @abstractmethod
+    async def replace(self, item_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        :raises ItemNotFoundError: If the document does not exist.
+        """
+
+    @abstractmethod
+    async def patch(self, item_id: str, partition_key: Any, operations: List[Dict[str, Any]], if_match: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Apply Cosmos-style patch operations ({"op": "set" | "add" | "replace" | "remove" | "incr",
+        "path": "/field", "value": ...}) and return the updated document.
+
+        :param if_match: Only apply the operations if the document still has this ETag (`_etag`).
+        :raises ItemNotFoundError: If the document does not exist.
+        :raises PreconditionFailedError: If the document no longer has the `if_match` ETag.
+        """
+
+    @abstractmethod
+    async def delete(self, item_id: str, partition_key: Any) -> None:
+        """
+        :raises ItemNotFoundError: If the document does not exist.
+        """
@@ -0,0 +1,237 @@
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from azure.core.async_paging import AsyncItemPaged
+from azure.core.paging import ItemPaged
+from azure.core import MatchConditions
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosBatchOperationError,
+    CosmosHttpResponseError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from pydantic_core import to_jsonable_python
+from app.config.database import SyncContainerProxy, get_container
+from app.repositories.base import (
+    Condition,
+    Fields,
+    ItemExistsError,
+    ItemNotFoundError,
+    OrderBy,
+    PreconditionFailedError,
+    Repository,
+    ThrottledError,
+    TransientError,
+    validate_conditions,
+    validate_fields,
+    validate_order_by,
+)
+
+def build_query(
+    conditions: Optional[Sequence[Condition]] = None,
+    order_by: Optional[Sequence[OrderBy]] = None,
+    fields: Optional[Fields] = None,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Compile conditions into a parameterized Cosmos SQL query.
+    """
+    clauses = []
+    parameters = []
+    for index, (field, operator, value) in enumerate(validate_conditions(conditions)):
+        name = f"@p{index}"
+        if operator == "in":
+            clauses.append(f"ARRAY_CONTAINS({name}, c.{field})")
+        elif operator == "contains":
+            clauses.append(f"ARRAY_CONTAINS(c.{field}, {name})")
+        else:
+            clauses.append(f"c.{field} {operator} {name}")
+        parameters.append({"name": name, "value": value})
+
+    projection = validate_fields(fields)
+    query = "SELECT " + (", ".join(f"c.{field}" for field in projection) if projection else "*") + " FROM c"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    order = validate_order_by(order_by)
+    if order:
+        query += " ORDER BY " + ", ".join(f"c.{field} {direction}" for field, direction in order)
+    return query, parameters
+
+# Status codes of the failures worth retrying: timeout, gone, retry with, internal error, unavailable
+TRANSIENT_STATUS_CODES = (408, 410, 449, 500, 503)
+
+def _throttled(e: CosmosHttpResponseError) -> ThrottledError:
+    retry_after_ms = (e.headers or {}).get("x-ms-retry-after-ms") if hasattr(e, "headers") else None
+    return ThrottledError(str(e), float(retry_after_ms or 0) / 1000)
+
+@contextmanager
+def _translate_errors():
+    try:
+        yield
+    except CosmosBatchOperationError as e:
+        # The batch was rolled back, report the error of the operation that failed
+        if e.status_code == 409:
+            raise ItemExistsError(str(e)) from e
+        if e.status_code == 404:
+            raise ItemNotFoundError(str(e)) from e
+        if e.status_code == 429:
+            raise _throttled(e) from e
+        raise
+    except CosmosResourceNotFoundError as e:
+        raise ItemNotFoundError(str(e)) from e
+    except CosmosResourceExistsError as e:
+        raise ItemExistsError(str(e)) from e
+    except CosmosAccessConditionFailedError as e:
+        raise PreconditionFailedError(str(e)) from e
+    except CosmosHttpResponseError as e:
+        if e.status_code == 429:
+            raise _throttled(e) from e
+        if e.status_code in TRANSIENT_STATUS_CODES:
+            raise TransientError(str(e)) from e
+        raise
+    except ServiceRequestError as e:
+        # The request could not be sent, nothing was applied
+        raise TransientError(str(e), sent=False) from e
+    except ServiceResponseError as e:
+        raise TransientError(str(e)) from e
+
+class _ChargeHook:
+    """
+    response_hook accumulating the x-ms-request-charge of every response of an operation.
+    """
+
+    def __init__(self):
+        self.request_charge = 0.0
+
+    def __call__(self, headers, body) -> None:
+        # query_items also calls the hook when the pager is created, with the headers of an older response
+        if isinstance(body, (ItemPaged, AsyncItemPaged)):
+            return
+        self.request_charge += float(headers.get("x-ms-request-charge", 0) or 0)
+
+class CosmosRepository(Repository):
+    """
+    Repository backed by a Cosmos DB container, through either the sync or the async client
+    depending on COSMOS_CLIENT_MODE.
+    """
+
+    @property
+    def container(self):
+        return get_container(self.name)
+
+    async def read(self, item_id: str, partition_key: Any) -> Dict[str, Any]:
+        hook = _ChargeHook()
+        with _translate_errors():
+            item = await self.container.read_item(item=item_id, partition_key=partition_key, response_hook=hook)
+        self._record("read", hook.request_charge)
+        return item
+
+    async def query(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        fields: Optional[Fields] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        query, parameters = build_query(conditions, order_by, fields)
+        hook = _ChargeHook()
+        count = 0
+        with _translate_errors():
+            async for item in self.container.query_items(query, parameters=parameters, partition_key=partition_key, response_hook=hook):
+                count += 1
+                yield item
+        self._record("query", hook.request_charge, count)
+
+    async def query_page(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        page_size: int = 100,
+        continuation: Optional[str] = None,
+        fields: Optional[Fields] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        query, parameters = build_query(conditions, order_by, fields)
+        hook = _ChargeHook()
+        container = self.container
+        with _translate_errors():
+            if isinstance(container, SyncContainerProxy):
+                items, next_continuation = await container.query_page(
+                    query, page_size, continuation, parameters=parameters, partition_key=partition_key, response_hook=hook
+                )
+            else:
+                pager = container.query_items(
+                    query, parameters=parameters, partition_key=partition_key, max_item_count=page_size, response_hook=hook
+                ).by_page(continuation)
+                items = []
+                async for page in pager:
+                    items = [item async for item in page]
+                    break
+                next_continuation = pager.continuation_token
+        self._record("query", hook.request_charge, len(items))
+        return items, next_continuation
+
+    async def read_change_feed(self, continuation: Optional[str] = None, page_size: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        hook = _ChargeHook()
+        container = self.container
+        with _translate_errors():
+            if isinstance(container, SyncContainerProxy):
+                items, next_continuation = await container.read_change_feed(page_size, continuation, response_hook=hook)
+            else:
+                start = {"continuation": continuation} if continuation else {"start_time": "Beginning"}
+                pager = container.query_items_change_feed(max_item_count=page_size, response_hook=hook, **start).by_page()
+                items = []
+                async for page in pager:
+                    items = [item async for item in page]
+                    break
+                next_continuation = pager.continuation_token
+        self._record("change_feed", hook.request_charge, len(items))
+        # Without changes the service may not return a new token, resume from the same point then
+        return items, next_continuation or continuation
+
+    async def create(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        hook = _ChargeHook()
+        with _translate_errors():
+            created = await self.container.create_item(to_jsonable_python(item), response_hook=hook)
+        self._record("create", hook.request_charge)
+        return created
+
+    async def create_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        partition_key = self.batch_partition_key(items)
+        hook = _ChargeHook()
+        with _translate_errors():
+            results = await self.container.execute_item_batch(
+                [("create", (to_jsonable_python(item),)) for item in items], partition_key=partition_key, response_hook=hook
+            )
+        self._record("batch", hook.request_charge, len(items))
+        return [result.get("resourceBody", item) for result, item in zip(results, items)]
+
+    async def upsert(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        hook = _ChargeHook()
+        with _translate_errors():
+            upserted = await self.container.upsert_item(to_jsonable_python(item), response_hook=hook)
+        self._record("upsert", hook.request_charge)
+        return upserted
+
+    async def replace(self, item_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        hook = _ChargeHook()
+        with _translate_errors():
+            replaced = await self.container.replace_item(item=item_id, body=to_jsonable_python(item), response_hook=hook)
+        self._record("replace", hook.request_charge)
+        return replaced
+
+    async def patch(self, item_id: str, partition_key: Any, operations: List[Dict[str, Any]], if_match: Optional[str] = None) -> Dict[str, Any]:
+        hook = _ChargeHook()
+        conditions = {"etag": if_match, "match_condition": MatchConditions.IfNotModified} if if_match is not None else {}
+        with _translate_errors():
+            patched = await self.container.patch_item(
+                item=item_id, partition_key=partition_key, patch_operations=to_jsonable_python(operations), response_hook=hook, **conditions
+            )
+        self._record("patch", hook.request_charge)
+        return patched
+
+    async def delete(self, item_id: str, partition_key: Any) -> None:
+        hook = _ChargeHook()
+        with _translate_errors():
+            await self.container.delete_item(item=item_id, partition_key=partition_key, response_hook=hook)
+        self._record("delete", hook.request_charge)
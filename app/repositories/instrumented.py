@@ -0,0 +1,320 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from opentelemetry import metrics, trace
+from app.repositories.base import Condition, Fields, OrderBy, Repository, operation_usage
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Add the X-Storage-Usage debug header (request units, database time and operations) to the responses
+STORAGE_USAGE_HEADER = os.getenv("STORAGE_USAGE_HEADER", "false").lower() == "true"
+
+# Route label of the operations done outside of a request (change feed processors, dispatchers...)
+BACKGROUND_ROUTE = "background"
+
+REQUEST_CHARGE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+tracer = trace.get_tracer(__name__)
+meter = metrics.get_meter(__name__)
+_charge_histogram = meter.create_histogram("db.cosmosdb.request_charge", unit="{request_unit}", description="Request units of the storage operations")
+_duration_histogram = meter.create_histogram("db.client.operation.duration", unit="s", description="Duration of the storage operations")
+
+class RequestUsage:
+    """
+    Storage operations done while serving one request: (container, operation, request
+    charge, item count, duration in seconds).
+    """
+
+    def __init__(self):
+        self.operations: List[Tuple[str, str, float, int, float]] = []
+        self.request_charge = 0.0
+        self.duration = 0.0
+
+    def add(self, container: str, operation: str, request_charge: float, item_count: int, duration: float) -> None:
+        self.operations.append((container, operation, request_charge, item_count, duration))
+        self.request_charge += request_charge
+        self.duration += duration
+
+    def summary(self) -> str:
+        return f"ru={self.request_charge:.2f}; db_ms={self.duration * 1000:.1f}; ops={len(self.operations)}"
+
+_request_usage: ContextVar[Optional[RequestUsage]] = ContextVar("request_usage", default=None)
+
+@contextmanager
+def track_storage_usage() -> Iterator[RequestUsage]:
+    """
+    Account the storage operations done in the block to a RequestUsage, as if it were a
+    request, instead of the background route. Meant for scripts (data loads, benchmarks).
+    """
+    usage = RequestUsage()
+    token = _request_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _request_usage.reset(token)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """
+    Prometheus histogram: cumulative bucket counts, sum and count per label values.
+    """
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, label_values: Tuple[str, ...], value: float) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            # One counter per bucket, then +Inf, sum
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {series[-2]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {series[-2]}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, description: str, label_names: Sequence[str]):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, label_values: Tuple[str, ...], amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {value}")
+        return lines
+
+class StorageMetrics:
+    """
+    Request units, duration and item count of the storage operations per route, container
+    and operation, plus the request units and database time of each request per route.
+    Exported in the Prometheus text format by GET /metrics, and to OpenTelemetry.
+    """
+
+    def __init__(self):
+        labels = ("route", "container", "operation")
+        self.operation_charge = Histogram("storage_operation_request_charge", "Request units of a storage operation", labels, REQUEST_CHARGE_BUCKETS)
+        self.operation_duration = Histogram("storage_operation_duration_seconds", "Duration of a storage operation", labels, DURATION_BUCKETS)
+        self.operation_items = Counter("storage_operation_items_total", "Documents read or written by the storage operations", labels)
+        self.request_charge = Histogram("http_request_storage_request_charge", "Request units spent to serve a request", ("route",), REQUEST_CHARGE_BUCKETS)
+        self.request_duration = Histogram("http_request_storage_duration_seconds", "Time spent in storage operations to serve a request", ("route",), DURATION_BUCKETS)
+
+    def observe(self, route: str, container: str, operation: str, request_charge: float, item_count: int, duration: float) -> None:
+        labels = (route, container, operation)
+        self.operation_charge.observe(labels, request_charge)
+        self.operation_duration.observe(labels, duration)
+        self.operation_items.inc(labels, item_count)
+        attributes = {"db.system": "cosmosdb", "db.collection.name": container, "db.operation.name": operation, "http.route": route}
+        _charge_histogram.record(request_charge, attributes)
+        _duration_histogram.record(duration, attributes)
+
+    def observe_request(self, route: str, usage: RequestUsage) -> None:
+        for container, operation, request_charge, item_count, duration in usage.operations:
+            self.observe(route, container, operation, request_charge, item_count, duration)
+        if usage.operations:
+            self.request_charge.observe((route,), usage.request_charge)
+            self.request_duration.observe((route,), usage.duration)
+
+    def render(self, repositories: Dict[str, Repository]) -> str:
+        lines: List[str] = []
+        for metric in (self.operation_charge, self.operation_duration, self.operation_items, self.request_charge, self.request_duration):
+            lines.extend(metric.render())
+        # Retries and circuit breakers of app.repositories.resilient
+        resilient = {name: repository for name, repository in repositories.items() if hasattr(repository, "resilience")}
+        for counter in ("retries", "throttled", "transient", "rejected", "breaker_opened"):
+            lines.append(f"# TYPE storage_{counter}_total counter")
+            for name, repository in sorted(resilient.items()):
+                lines.append(f"storage_{counter}_total{_labels(('container',), (name,))} {repository.resilience[counter]}")
+        lines.append("# HELP storage_circuit_breaker_open Whether the circuit breaker of the container is open (1) or half-open (0.5)")
+        lines.append("# TYPE storage_circuit_breaker_open gauge")
+        for name, repository in sorted(resilient.items()):
+            state = {"closed": 0, "half_open": 0.5, "open": 1}[repository.breaker.state]
+            lines.append(f"storage_circuit_breaker_open{_labels(('container',), (name,))} {state}")
+        return "\n".join(lines) + "\n"
+
+storage_metrics = StorageMetrics()
+
+def _observe(container: str, operation: str, usage: List[float], duration: float) -> None:
+    request = _request_usage.get()
+    if request is not None:
+        # Labelled with the route once it is known, at the end of the request
+        request.add(container, operation, usage[0], int(usage[1]), duration)
+    else:
+        storage_metrics.observe(BACKGROUND_ROUTE, container, operation, usage[0], int(usage[1]), duration)
+
+class InstrumentedRepository(Repository):
+    """
+    Traces every operation of another repository as a client span with its request charge
+    and item count, and accounts for it in `storage_metrics` under the route of the request
+    being served (see RequestUsageMiddleware).
+    """
+
+    def __init__(self, inner: Repository):
+        self.inner = inner
+        self.name = inner.name
+        self.partition_key_path = inner.partition_key_path
+
+    def __getattr__(self, name: str) -> Any:
+        # resilience, breaker... of the wrapped repository
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return self.inner.stats
+
+    def partition_key_of(self, item: Dict[str, Any]) -> Any:
+        return self.inner.partition_key_of(item)
+
+    def batch_partition_key(self, items: List[Dict[str, Any]]) -> Any:
+        return self.inner.batch_partition_key(items)
+
+    async def _call(self, operation: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        usage = [0.0, 0]
+        token = operation_usage.set(usage)
+        start = time.perf_counter()
+        try:
+            with tracer.start_as_current_span(f"{operation} {self.name}", kind=trace.SpanKind.CLIENT) as span:
+                span.set_attribute("db.system", "cosmosdb")
+                span.set_attribute("db.collection.name", self.name)
+                span.set_attribute("db.operation.name", operation)
+                try:
+                    return await call()
+                finally:
+                    span.set_attribute("db.cosmosdb.request_charge", usage[0])
+                    span.set_attribute("db.cosmosdb.item_count", int(usage[1]))
+        finally:
+            operation_usage.reset(token)
+            _observe(self.name, operation, usage, time.perf_counter() - start)
+
+    async def read(self, item_id: str, partition_key: Any) -> Dict[str, Any]:
+        return await self._call("read", lambda: self.inner.read(item_id, partition_key))
+
+    async def query(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        fields: Optional[Fields] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        usage = [0.0, 0]
+        duration = 0.0
+        # Not made current: the consumer runs between the documents
+        span = tracer.start_span(f"query {self.name}", kind=trace.SpanKind.CLIENT)
+        span.set_attribute("db.system", "cosmosdb")
+        span.set_attribute("db.collection.name", self.name)
+        span.set_attribute("db.operation.name", "query")
+        iterator = self.inner.query(conditions, partition_key, order_by, fields).__aiter__()
+        try:
+            while True:
+                # Only the time spent fetching the documents is accounted for
+                token = operation_usage.set(usage)
+                start = time.perf_counter()
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    duration += time.perf_counter() - start
+                    operation_usage.reset(token)
+                yield item
+        finally:
+            span.set_attribute("db.cosmosdb.request_charge", usage[0])
+            span.set_attribute("db.cosmosdb.item_count", int(usage[1]))
+            span.end()
+            _observe(self.name, "query", usage, duration)
+
+    async def query_page(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        page_size: int = 100,
+        continuation: Optional[str] = None,
+        fields: Optional[Fields] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        return await self._call("query_page", lambda: self.inner.query_page(conditions, partition_key, order_by, page_size, continuation, fields))
+
+    async def read_change_feed(self, continuation: Optional[str] = None, page_size: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        return await self._call("change_feed", lambda: self.inner.read_change_feed(continuation, page_size))
+
+    async def create(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._call("create", lambda: self.inner.create(item))
+
+    async def create_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await self._call("create_batch", lambda: self.inner.create_batch(items))
+
+    async def upsert(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._call("upsert", lambda: self.inner.upsert(item))
+
+    async def replace(self, item_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._call("replace", lambda: self.inner.replace(item_id, item))
+
+    async def patch(self, item_id: str, partition_key: Any, operations: List[Dict[str, Any]], if_match: Optional[str] = None) -> Dict[str, Any]:
+        return await self._call("patch", lambda: self.inner.patch(item_id, partition_key, operations, if_match))
+
+    async def delete(self, item_id: str, partition_key: Any) -> None:
+        return await self._call("delete", lambda: self.inner.delete(item_id, partition_key))
+
+class RequestUsageMiddleware:
+    """
+    ASGI middleware collecting the storage operations of each HTTP request. They are
+    accounted for under the route template once the request is served and, with
+    STORAGE_USAGE_HEADER, summarized in the X-Storage-Usage response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        usage = RequestUsage()
+        token = _request_usage.set(usage)
+
+        async def send_with_usage(message):
+            if message["type"] == "http.response.start" and STORAGE_USAGE_HEADER:
+                message = {**message, "headers": [*message.get("headers", []), (b"x-storage-usage", usage.summary().encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_usage)
+        finally:
+            _request_usage.reset(token)
+            route = scope.get("route")
+            storage_metrics.observe_request(getattr(route, "path", "unmatched"), usage)
@@ -0,0 +1,253 @@
+import itertools
+import json
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+from pydantic_core import to_jsonable_python
+from app.repositories.base import (
+    READ_RU_PER_KB,
+    WRITE_RU_PER_KB,
+    Condition,
+    Fields,
+    ItemExistsError,
+    ItemNotFoundError,
+    OrderBy,
+    PreconditionFailedError,
+    Repository,
+    apply_patch_operations,
+    document_size_kb,
+    estimate_query_charge,
+    is_expired,
+    project,
+    validate_conditions,
+    validate_fields,
+    validate_order_by,
+)
+
+_UNDEFINED = object()
+
+def get_field(item: Dict[str, Any], field: str) -> Any:
+    value: Any = item
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _UNDEFINED
+        value = value[part]
+    return value
+
+def _comparable(left: Any, right: Any) -> bool:
+    # Like Cosmos, values of different types never compare (booleans are not numbers)
+    if isinstance(left, bool) or isinstance(right, bool):
+        return isinstance(left, bool) and isinstance(right, bool)
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return True
+    return type(left) is type(right)
+
+def matches(item: Dict[str, Any], conditions: Sequence[Condition]) -> bool:
+    """
+    Evaluate already validated conditions against a document, following Cosmos semantics
+    for missing properties (the condition is not satisfied).
+    """
+    for field, operator, value in conditions:
+        actual = get_field(item, field)
+        if actual is _UNDEFINED:
+            return False
+        if operator == "in":
+            if actual not in value:
+                return False
+        elif operator == "contains":
+            if not isinstance(actual, list) or value not in actual:
+                return False
+        elif operator in ("=", "!="):
+            equal = _comparable(actual, value) and actual == value
+            if equal != (operator == "="):
+                return False
+        else:
+            if not _comparable(actual, value) or isinstance(actual, (dict, list)):
+                return False
+            if operator == "<" and not actual < value:
+                return False
+            if operator == "<=" and not actual <= value:
+                return False
+            if operator == ">" and not actual > value:
+                return False
+            if operator == ">=" and not actual >= value:
+                return False
+    return True
+
+def sort_items(items: List[Dict[str, Any]], order_by: Sequence[OrderBy]) -> List[Dict[str, Any]]:
+    # Documents without the sort property are left out, as Cosmos does
+    for field, _ in order_by:
+        items = [item for item in items if get_field(item, field) is not _UNDEFINED]
+    for field, direction in reversed(order_by):
+        items.sort(key=lambda item: get_field(item, field), reverse=direction == "DESC")
+    return items
+
+class MemoryRepository(Repository):
+    """
+    In-process, dict based repository emulating a Cosmos container: documents live in
+    logical partitions, point operations only see their own partition and every call is
+    charged with the RU model of app.repositories.base. Logical partitions are hashed
+    onto `physical_partitions` to price cross-partition queries. Documents with a `ttl`
+    expire as in Cosmos.
+
+    Returned documents are shallow copies, callers must not mutate nested values.
+    """
+
+    def __init__(self, name: str, partition_key_path: str = "/id", physical_partitions: int = 4):
+        super().__init__(name, partition_key_path)
+        self.physical_partitions = physical_partitions
+        self._partitions: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        # Logical sequence number of the writes, orders the change feed
+        self._lsn = itertools.count(1)
+
+    @staticmethod
+    def _partition_id(partition_key: Any) -> str:
+        return json.dumps(partition_key)
+
+    def _stamp(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        item = to_jsonable_python(item)
+        item["_etag"] = f'"{uuid4()}"'
+        item["_ts"] = int(time.time())
+        item["_lsn"] = next(self._lsn)
+        return item
+
+    @staticmethod
+    def _purge_expired(partition: Dict[str, Dict[str, Any]], now: float, item_id: Optional[str] = None) -> None:
+        # Documents whose ttl elapsed are deleted lazily, when their partition (or themselves) is next accessed
+        item_ids = [item_id] if item_id is not None else list(partition)
+        for key in item_ids:
+            if key in partition and is_expired(partition[key], now):
+                del partition[key]
+
+    def _scan(self, conditions, partition_key, order_by, fields=None) -> Tuple[List[Dict[str, Any]], int]:
+        conditions = validate_conditions(conditions)
+        order_by = validate_order_by(order_by)
+        fields = validate_fields(fields)
+        now = time.time()
+        with self._lock:
+            if partition_key is not None:
+                partitions = [self._partitions.get(self._partition_id(partition_key), {})]
+                partitions_touched = 1
+            else:
+                partitions = list(self._partitions.values())
+                partitions_touched = self.physical_partitions
+            for partition in partitions:
+                self._purge_expired(partition, now)
+            items = [dict(item) for partition in partitions for item in partition.values() if matches(item, conditions)]
+        if order_by:
+            items = sort_items(items, order_by)
+        return [project(item, fields) for item in items], partitions_touched
+
+    async def read(self, item_id: str, partition_key: Any) -> Dict[str, Any]:
+        with self._lock:
+            partition = self._partitions.get(self._partition_id(partition_key), {})
+            self._purge_expired(partition, time.time(), item_id)
+            item = partition.get(item_id)
+        if item is None:
+            self._record("read", READ_RU_PER_KB)
+            raise ItemNotFoundError(f"Item {item_id} not found in {self.name}")
+        self._record("read", READ_RU_PER_KB * document_size_kb(item))
+        return dict(item)
+
+    async def query(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        fields: Optional[Fields] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        items, partitions_touched = self._scan(conditions, partition_key, order_by, fields)
+        self._record("query", estimate_query_charge(items, partitions_touched), len(items))
+        for item in items:
+            yield item
+
+    async def query_page(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        page_size: int = 100,
+        continuation: Optional[str] = None,
+        fields: Optional[Fields] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        items, partitions_touched = self._scan(conditions, partition_key, order_by, fields)
+        offset = int(continuation) if continuation else 0
+        page = items[offset:offset + page_size]
+        next_offset = offset + page_size
+        self._record("query", estimate_query_charge(page, partitions_touched), len(page))
+        return page, (str(next_offset) if next_offset < len(items) else None)
+
+    async def read_change_feed(self, continuation: Optional[str] = None, page_size: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        after = int(continuation) if continuation else 0
+        with self._lock:
+            changed = [dict(item) for partition in self._partitions.values() for item in partition.values() if item["_lsn"] > after]
+        page = sorted(changed, key=lambda item: item["_lsn"])[:page_size]
+        self._record("change_feed", estimate_query_charge(page, self.physical_partitions), len(page))
+        return page, str(page[-1]["_lsn"] if page else after)
+
+    async def create(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        item = self._stamp(item)
+        with self._lock:
+            partition = self._partitions.setdefault(self._partition_id(self.partition_key_of(item)), {})
+            self._purge_expired(partition, item["_ts"], item["id"])
+            if item["id"] in partition:
+                raise ItemExistsError(f"Item {item['id']} already exists in {self.name}")
+            partition[item["id"]] = item
+        self._record("create", WRITE_RU_PER_KB * document_size_kb(item))
+        return dict(item)
+
+    async def create_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        partition_key = self.batch_partition_key(items)
+        items = [self._stamp(item) for item in items]
+        with self._lock:
+            partition = self._partitions.setdefault(self._partition_id(partition_key), {})
+            for item in items:
+                self._purge_expired(partition, item["_ts"], item["id"])
+                if item["id"] in partition:
+                    raise ItemExistsError(f"Item {item['id']} already exists in {self.name}")
+            for item in items:
+                partition[item["id"]] = item
+        self._record("batch", WRITE_RU_PER_KB * sum(document_size_kb(item) for item in items), len(items))
+        return [dict(item) for item in items]
+
+    async def upsert(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        item = self._stamp(item)
+        with self._lock:
+            self._partitions.setdefault(self._partition_id(self.partition_key_of(item)), {})[item["id"]] = item
+        self._record("upsert", WRITE_RU_PER_KB * document_size_kb(item))
+        return dict(item)
+
+    async def replace(self, item_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        item = self._stamp({**item, "id": item_id})
+        with self._lock:
+            partition = self._partitions.get(self._partition_id(self.partition_key_of(item)), {})
+            self._purge_expired(partition, item["_ts"], item_id)
+            if item_id not in partition:
+                raise ItemNotFoundError(f"Item {item_id} not found in {self.name}")
+            partition[item_id] = item
+        self._record("replace", WRITE_RU_PER_KB * document_size_kb(item))
+        return dict(item)
+
+    async def patch(self, item_id: str, partition_key: Any, operations: List[Dict[str, Any]], if_match: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            partition = self._partitions.get(self._partition_id(partition_key), {})
+            self._purge_expired(partition, time.time(), item_id)
+            if item_id not in partition:
+                raise ItemNotFoundError(f"Item {item_id} not found in {self.name}")
+            if if_match is not None and partition[item_id]["_etag"] != if_match:
+                raise PreconditionFailedError(f"Item {item_id} in {self.name} was modified")
+            item = self._stamp(apply_patch_operations(partition[item_id], operations))
+            partition[item_id] = item
+        self._record("patch", WRITE_RU_PER_KB * document_size_kb(item))
+        return dict(item)
+
+    async def delete(self, item_id: str, partition_key: Any) -> None:
+        with self._lock:
+            partition = self._partitions.get(self._partition_id(partition_key), {})
+            self._purge_expired(partition, time.time(), item_id)
+            item = partition.pop(item_id, None)
+        if item is None:
+            raise ItemNotFoundError(f"Item {item_id} not found in {self.name}")
+        self._record("delete", WRITE_RU_PER_KB * document_size_kb(item))
@@ -0,0 +1,248 @@
+import asyncio
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from app.repositories.base import (
+    Condition,
+    Fields,
+    ItemNotFoundError,
+    OrderBy,
+    Repository,
+    ServiceUnavailableError,
+    ThrottledError,
+    TransientError,
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Attempts per operation type, the first one included
+STORAGE_READ_ATTEMPTS = int(os.getenv("STORAGE_READ_ATTEMPTS", "4"))
+STORAGE_QUERY_ATTEMPTS = int(os.getenv("STORAGE_QUERY_ATTEMPTS", "3"))
+STORAGE_WRITE_ATTEMPTS = int(os.getenv("STORAGE_WRITE_ATTEMPTS", "3"))
+# Base of the exponential backoff between attempts, with full jitter
+STORAGE_RETRY_BASE_SECONDS = float(os.getenv("STORAGE_RETRY_BASE_SECONDS", "0.05"))
+# Maximum time one operation spends waiting between its attempts
+STORAGE_RETRY_MAX_WAIT_SECONDS = float(os.getenv("STORAGE_RETRY_MAX_WAIT_SECONDS", "5"))
+# Consecutive failed operations that open the circuit breaker of a container
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "10"))
+# Seconds the breaker stays open before letting a probe through
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "10"))
+
+ATTEMPTS = {"read": STORAGE_READ_ATTEMPTS, "query": STORAGE_QUERY_ATTEMPTS, "write": STORAGE_WRITE_ATTEMPTS}
+
+class CircuitBreaker:
+    """
+    Consecutive failure counter of a container. Once `failure_threshold` operations failed
+    in a row the breaker opens and calls fail fast for `open_seconds`; then a single probe
+    is let through (half-open) and its outcome closes or reopens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD, open_seconds: float = CIRCUIT_BREAKER_OPEN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_at: Optional[float] = None
+
+    def retry_after(self) -> float:
+        if self.state == "closed":
+            return 0.0
+        return max(1.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = "half_open"
+        # A probe that never reported back (cancelled) is replaced after open_seconds
+        if self.state == "half_open" and (self._probe_at is None or time.monotonic() - self._probe_at >= self.open_seconds):
+            self._probe_at = time.monotonic()
+            return True
+        return False
+
+    def succeeded(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probe_at = None
+
+    def failed(self) -> bool:
+        """
+        Record a failed operation. Returns True if it opened the breaker.
+        """
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe_at = None
+            return True
+        return False
+
+class ResilientRepository(Repository):
+    """
+    Retries the throttled (429) and transient failures of another repository and guards
+    its container with a circuit breaker.
+
+    Throttled calls wait the delay the service asked for (x-ms-retry-after-ms), other
+    failures back off exponentially with jitter, within a per-operation attempt budget.
+    Writes that are not idempotent (create, create_batch, patch) are only retried when
+    they were not applied: throttled, or never sent. Queries are only retried before
+    their first document was returned.
+
+    When the attempts are exhausted or the breaker is open, ServiceUnavailableError is
+    raised with the delay after which the client may retry.
+    """
+
+    def __init__(self, inner: Repository, breaker: Optional[CircuitBreaker] = None):
+        self.inner = inner
+        self.name = inner.name
+        self.partition_key_path = inner.partition_key_path
+        self.breaker = breaker or CircuitBreaker()
+        self.resilience: Dict[str, int] = {"retries": 0, "throttled": 0, "transient": 0, "rejected": 0, "breaker_opened": 0}
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return self.inner.stats
+
+    def partition_key_of(self, item: Dict[str, Any]) -> Any:
+        return self.inner.partition_key_of(item)
+
+    def batch_partition_key(self, items: List[Dict[str, Any]]) -> Any:
+        return self.inner.batch_partition_key(items)
+
+    def _admit(self) -> None:
+        if not self.breaker.allow():
+            self.resilience["rejected"] += 1
+            raise ServiceUnavailableError(f"Container {self.name} is unavailable", self.breaker.retry_after())
+
+    def _succeeded(self) -> None:
+        self.breaker.succeeded()
+
+    def _failed(self, e: Exception) -> ServiceUnavailableError:
+        if self.breaker.failed():
+            self.resilience["breaker_opened"] += 1
+        retry_after = e.retry_after if isinstance(e, ThrottledError) else 0.0
+        return ServiceUnavailableError(f"Container {self.name} is unavailable: {e}", max(1.0, retry_after, self.breaker.retry_after()))
+
+    def _delay(self, e: Exception, attempt: int, waited: float, attempts: int, idempotent: bool) -> Optional[float]:
+        """
+        Seconds to wait before the next attempt, or None if the error must not be retried.
+        """
+        if isinstance(e, ThrottledError):
+            self.resilience["throttled"] += 1
+        else:
+            self.resilience["transient"] += 1
+            if e.sent and not idempotent:
+                return None
+        if attempt + 1 >= attempts:
+            return None
+        if isinstance(e, ThrottledError) and e.retry_after > 0:
+            # Jittered so that the throttled callers do not all come back at once
+            delay = e.retry_after + random.uniform(0, STORAGE_RETRY_BASE_SECONDS)
+        else:
+            delay = random.uniform(0, STORAGE_RETRY_BASE_SECONDS * 2 ** attempt)
+        if waited + delay > STORAGE_RETRY_MAX_WAIT_SECONDS:
+            return None
+        return delay
+
+    async def _call(self, kind: str, idempotent: bool, operation: Callable[[], Awaitable[Any]]) -> Any:
+        self._admit()
+        attempts = ATTEMPTS[kind]
+        waited = 0.0
+        for attempt in range(attempts):
+            try:
+                result = await operation()
+            except (ThrottledError, TransientError) as e:
+                delay = self._delay(e, attempt, waited, attempts, idempotent)
+                if delay is None:
+                    raise self._failed(e) from e
+                self.resilience["retries"] += 1
+                waited += delay
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                # Not found, conflicts... the container itself is healthy
+                self._succeeded()
+                raise
+            self._succeeded()
+            return result
+
+    async def read(self, item_id: str, partition_key: Any) -> Dict[str, Any]:
+        return await self._call("read", True, lambda: self.inner.read(item_id, partition_key))
+
+    async def query(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        fields: Optional[Fields] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        self._admit()
+        attempts = ATTEMPTS["query"]
+        waited = 0.0
+        for attempt in range(attempts):
+            started = False
+            try:
+                async for item in self.inner.query(conditions, partition_key, order_by, fields):
+                    started = True
+                    yield item
+            except (ThrottledError, TransientError) as e:
+                # Documents already returned cannot be taken back
+                delay = None if started else self._delay(e, attempt, waited, attempts, True)
+                if delay is None:
+                    raise self._failed(e) from e
+                self.resilience["retries"] += 1
+                waited += delay
+                await asyncio.sleep(delay)
+                continue
+            self._succeeded()
+            return
+
+    async def query_page(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        page_size: int = 100,
+        continuation: Optional[str] = None,
+        fields: Optional[Fields] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        return await self._call("query", True, lambda: self.inner.query_page(conditions, partition_key, order_by, page_size, continuation, fields))
+
+    async def read_change_feed(self, continuation: Optional[str] = None, page_size: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        return await self._call("query", True, lambda: self.inner.read_change_feed(continuation, page_size))
+
+    async def create(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._call("write", False, lambda: self.inner.create(item))
+
+    async def create_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await self._call("write", False, lambda: self.inner.create_batch(items))
+
+    async def upsert(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._call("write", True, lambda: self.inner.upsert(item))
+
+    async def replace(self, item_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._call("write", True, lambda: self.inner.replace(item_id, item))
+
+    async def patch(self, item_id: str, partition_key: Any, operations: List[Dict[str, Any]], if_match: Optional[str] = None) -> Dict[str, Any]:
+        return await self._call("write", False, lambda: self.inner.patch(item_id, partition_key, operations, if_match))
+
+    async def delete(self, item_id: str, partition_key: Any) -> None:
+        # A delete that timed out may have been applied: its retry then finds nothing to delete
+        applied = False
+
+        async def attempt() -> None:
+            nonlocal applied
+            try:
+                return await self.inner.delete(item_id, partition_key)
+            except TransientError as e:
+                applied = applied or e.sent
+                raise
+            except ItemNotFoundError:
+                if applied:
+                    return None
+                raise
+
+        return await self._call("write", True, attempt)
@@ -0,0 +1,298 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+from pydantic_core import to_jsonable_python
+from starlette.concurrency import run_in_threadpool
+from app.repositories.base import (
+    READ_RU_PER_KB,
+    WRITE_RU_PER_KB,
+    Condition,
+    Fields,
+    ItemExistsError,
+    ItemNotFoundError,
+    OrderBy,
+    PreconditionFailedError,
+    Repository,
+    apply_patch_operations,
+    document_size_kb,
+    estimate_query_charge,
+    is_expired,
+    project,
+    validate_conditions,
+    validate_fields,
+    validate_order_by,
+)
+
+_connections: Dict[str, Tuple[sqlite3.Connection, threading.Lock]] = {}
+_connections_lock = threading.Lock()
+
+def _get_connection(path: str) -> Tuple[sqlite3.Connection, threading.Lock]:
+    # One shared connection per database file, so that ":memory:" databases are shared by every repository
+    with _connections_lock:
+        if path not in _connections:
+            connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            _connections[path] = (connection, threading.Lock())
+        return _connections[path]
+
+# Seconds between two deletions of the expired documents of a table
+TTL_PURGE_INTERVAL_SECONDS = 60
+
+# Same rule as base.is_expired, evaluated by SQLite (documents without a ttl give NULL, hence the IFNULL)
+_EXPIRED = "IFNULL(json_type(body, '$.ttl') = 'integer' AND json_extract(body, '$.ttl') > 0 AND json_extract(body, '$._ts') + json_extract(body, '$.ttl') <= ?, 0)"
+
+def _json_path(field: str) -> str:
+    return "$." + field
+
+def build_where(conditions: Optional[Sequence[Condition]]) -> Tuple[List[str], List[Any]]:
+    """
+    Compile conditions into SQLite clauses over the JSON body column.
+    """
+    clauses = []
+    parameters: List[Any] = []
+    for field, operator, value in validate_conditions(conditions):
+        path = _json_path(field)
+        if operator == "in":
+            placeholders = ", ".join("?" for _ in value) or "NULL"
+            clauses.append(f"json_extract(body, ?) IN ({placeholders})")
+            parameters.extend([path, *value])
+        elif operator == "contains":
+            clauses.append("EXISTS (SELECT 1 FROM json_each(body, ?) WHERE json_each.value = ?)")
+            parameters.extend([path, value])
+        else:
+            clauses.append(f"json_extract(body, ?) {operator} ?")
+            parameters.extend([path, value])
+    return clauses, parameters
+
+class SQLiteRepository(Repository):
+    """
+    Repository storing each container in a SQLite table, with the partition key as part of
+    the primary key. Request charges follow the same RU model as MemoryRepository.
+    Expired documents (`ttl`) are hidden at once and deleted every TTL_PURGE_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, name: str, partition_key_path: str = "/id", path: str = ":memory:", physical_partitions: int = 4):
+        super().__init__(name, partition_key_path)
+        self.physical_partitions = physical_partitions
+        self._connection, self._lock = _get_connection(path)
+        self._table = '"' + name.replace('"', '""') + '"'
+        self._purged_at = 0.0
+        with self._lock:
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} (pk TEXT NOT NULL, id TEXT NOT NULL, body TEXT NOT NULL, lsn INTEGER, PRIMARY KEY (pk, id))"
+            )
+            # Tables created before the change feed was emulated get the column, their rows are not in the feed
+            columns = [row[1] for row in self._connection.execute(f"PRAGMA table_info({self._table})").fetchall()]
+            if "lsn" not in columns:
+                self._connection.execute(f"ALTER TABLE {self._table} ADD COLUMN lsn INTEGER")
+            index = '"' + (name + "_lsn").replace('"', '""') + '"'
+            self._connection.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {self._table} (lsn)")
+        # Every write takes the next logical sequence number of the table, under the SQLite write lock
+        self._next_lsn = f"(SELECT IFNULL(MAX(lsn), 0) + 1 FROM {self._table})"
+
+    def _execute(self, sql: str, parameters: Sequence[Any] = ()) -> List[Tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _purge_expired(self, now: float) -> None:
+        if now - self._purged_at < TTL_PURGE_INTERVAL_SECONDS:
+            return
+        self._purged_at = now
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self._table} WHERE {_EXPIRED}", (now,))
+
+    def _select(self, conditions, partition_key, order_by, limit=None, offset=0, fields=None) -> Tuple[List[Dict[str, Any]], int]:
+        clauses, parameters = build_where(conditions)
+        fields = validate_fields(fields)
+        now = time.time()
+        self._purge_expired(now)
+        clauses.append(f"NOT {_EXPIRED}")
+        parameters.append(now)
+        partitions_touched = self.physical_partitions
+        if partition_key is not None:
+            clauses.insert(0, "pk = ?")
+            parameters.insert(0, json.dumps(partition_key))
+            partitions_touched = 1
+        order = validate_order_by(order_by)
+        for field, _ in order:
+            # Documents without the sort property are left out, as Cosmos does
+            clauses.append("json_type(body, ?) IS NOT NULL")
+            parameters.append(_json_path(field))
+        sql = f"SELECT body FROM {self._table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if order:
+            # Field names are validated identifiers, safe to inline
+            sql += " ORDER BY " + ", ".join(f"json_extract(body, '{_json_path(field)}') {direction}" for field, direction in order)
+        else:
+            sql += " ORDER BY rowid"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            parameters.extend([limit, offset])
+        rows = self._execute(sql, parameters)
+        return [project(json.loads(row[0]), fields) for row in rows], partitions_touched
+
+    def _stamp(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        item = to_jsonable_python(item)
+        item["_etag"] = f'"{uuid4()}"'
+        item["_ts"] = int(time.time())
+        return item
+
+    async def read(self, item_id: str, partition_key: Any) -> Dict[str, Any]:
+        rows = await run_in_threadpool(
+            self._execute, f"SELECT body FROM {self._table} WHERE pk = ? AND id = ?", (json.dumps(partition_key), item_id)
+        )
+        item = json.loads(rows[0][0]) if rows else None
+        if item is None or is_expired(item, time.time()):
+            self._record("read", READ_RU_PER_KB)
+            raise ItemNotFoundError(f"Item {item_id} not found in {self.name}")
+        self._record("read", READ_RU_PER_KB * document_size_kb(item))
+        return item
+
+    async def query(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        fields: Optional[Fields] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        items, partitions_touched = await run_in_threadpool(self._select, conditions, partition_key, order_by, None, 0, fields)
+        self._record("query", estimate_query_charge(items, partitions_touched), len(items))
+        for item in items:
+            yield item
+
+    async def query_page(
+        self,
+        conditions: Optional[Sequence[Condition]] = None,
+        partition_key: Any = None,
+        order_by: Optional[Sequence[OrderBy]] = None,
+        page_size: int = 100,
+        continuation: Optional[str] = None,
+        fields: Optional[Fields] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        offset = int(continuation) if continuation else 0
+        # Fetch one extra row to know whether there is a next page
+        items, partitions_touched = await run_in_threadpool(self._select, conditions, partition_key, order_by, page_size + 1, offset, fields)
+        page = items[:page_size]
+        self._record("query", estimate_query_charge(page, partitions_touched), len(page))
+        return page, (str(offset + page_size) if len(items) > page_size else None)
+
+    async def read_change_feed(self, continuation: Optional[str] = None, page_size: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        after = int(continuation) if continuation else 0
+        rows = await run_in_threadpool(
+            self._execute, f"SELECT body, lsn FROM {self._table} WHERE lsn > ? ORDER BY lsn LIMIT ?", (after, page_size)
+        )
+        page = [{**json.loads(body), "_lsn": lsn} for body, lsn in rows]
+        self._record("change_feed", estimate_query_charge(page, self.physical_partitions), len(page))
+        return page, str(rows[-1][1] if rows else after)
+
+    def _write(self, sql: str, parameters: Sequence[Any]) -> None:
+        with self._lock:
+            self._connection.execute(sql, parameters)
+
+    async def create(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        item = self._stamp(item)
+        try:
+            await run_in_threadpool(self._insert, self.partition_key_of(item), [item])
+        except sqlite3.IntegrityError:
+            raise ItemExistsError(f"Item {item['id']} already exists in {self.name}")
+        self._record("create", WRITE_RU_PER_KB * document_size_kb(item))
+        return item
+
+    def _insert(self, partition_key: Any, items: List[Dict[str, Any]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                # An expired document no longer exists, even if the purge has not deleted its row yet
+                self._connection.executemany(
+                    f"DELETE FROM {self._table} WHERE pk = ? AND id = ? AND {_EXPIRED}",
+                    [(json.dumps(partition_key), item["id"], now) for item in items],
+                )
+                self._connection.executemany(
+                    f"INSERT INTO {self._table} (pk, id, body, lsn) VALUES (?, ?, ?, {self._next_lsn})",
+                    [(json.dumps(partition_key), item["id"], json.dumps(item)) for item in items],
+                )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    async def create_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        partition_key = self.batch_partition_key(items)
+        items = [self._stamp(item) for item in items]
+        try:
+            await run_in_threadpool(self._insert, partition_key, items)
+        except sqlite3.IntegrityError:
+            raise ItemExistsError(f"An item of the batch already exists in {self.name}")
+        self._record("batch", WRITE_RU_PER_KB * sum(document_size_kb(item) for item in items), len(items))
+        return items
+
+    async def upsert(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        item = self._stamp(item)
+        await run_in_threadpool(
+            self._write,
+            f"INSERT OR REPLACE INTO {self._table} (pk, id, body, lsn) VALUES (?, ?, ?, {self._next_lsn})",
+            (json.dumps(self.partition_key_of(item)), item["id"], json.dumps(item)),
+        )
+        self._record("upsert", WRITE_RU_PER_KB * document_size_kb(item))
+        return item
+
+    def _replace(self, item_id: str, partition_key: Any, item: Dict[str, Any]) -> bool:
+        with self._lock:
+            cursor = self._connection.execute(
+                f"UPDATE {self._table} SET body = ?, lsn = {self._next_lsn} WHERE pk = ? AND id = ?", (json.dumps(item), json.dumps(partition_key), item_id)
+            )
+            return cursor.rowcount > 0
+
+    async def replace(self, item_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        item = self._stamp({**item, "id": item_id})
+        if not await run_in_threadpool(self._replace, item_id, self.partition_key_of(item), item):
+            raise ItemNotFoundError(f"Item {item_id} not found in {self.name}")
+        self._record("replace", WRITE_RU_PER_KB * document_size_kb(item))
+        return item
+
+    def _patch(self, item_id: str, partition_key: Any, operations: List[Dict[str, Any]], if_match: Optional[str]) -> Optional[Dict[str, Any]]:
+        # Read and write under the same lock so that concurrent patches (e.g. "incr") do not lose updates
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT body FROM {self._table} WHERE pk = ? AND id = ?", (json.dumps(partition_key), item_id)
+            ).fetchall()
+            if not rows:
+                return None
+            item = json.loads(rows[0][0])
+            if is_expired(item, time.time()):
+                return None
+            if if_match is not None and item["_etag"] != if_match:
+                raise PreconditionFailedError(f"Item {item_id} in {self.name} was modified")
+            item = self._stamp(apply_patch_operations(item, operations))
+            self._connection.execute(
+                f"UPDATE {self._table} SET body = ?, lsn = {self._next_lsn} WHERE pk = ? AND id = ?", (json.dumps(item), json.dumps(partition_key), item_id)
+            )
+            return item
+
+    async def patch(self, item_id: str, partition_key: Any, operations: List[Dict[str, Any]], if_match: Optional[str] = None) -> Dict[str, Any]:
+        item = await run_in_threadpool(self._patch, item_id, partition_key, operations, if_match)
+        if item is None:
+            raise ItemNotFoundError(f"Item {item_id} not found in {self.name}")
+        self._record("patch", WRITE_RU_PER_KB * document_size_kb(item))
+        return item
+
+    def _delete(self, item_id: str, partition_key: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connection.execute(
+                f"DELETE FROM {self._table} WHERE pk = ? AND id = ? RETURNING body", (json.dumps(partition_key), item_id)
+            ).fetchall()
+        if not rows:
+            return None
+        item = json.loads(rows[0][0])
+        return None if is_expired(item, time.time()) else item
+
+    async def delete(self, item_id: str, partition_key: Any) -> None:
+        item = await run_in_threadpool(self._delete, item_id, partition_key)
+        if item is None:
+            raise ItemNotFoundError(f"Item {item_id} not found in {self.name}")
+        self._record("delete", WRITE_RU_PER_KB * document_size_kb(item))
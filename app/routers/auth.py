@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
-from app.dependencies.auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.dependencies.auth import create_access_token, build_token_claims, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.dependencies.services import get_user_service
 from app.schemas.user import UserResponse
 from app.services.user_service import UserService
+from app.services.password_hasher import PasswordHasherBusy
 from pydantic import BaseModel
 
 router = APIRouter()
-user_service = UserService()
 
 class Token(BaseModel):
     access_token: str
@@ -17,8 +18,11 @@ class Token(BaseModel):
     id: str
 
 @router.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = user_service.authenticate_user(form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), user_service: UserService = Depends(get_user_service)):
+    try:
+        user = await user_service.authenticate_user(form_data.username, form_data.password)
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -27,6 +31,6 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=build_token_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer", "username": user.username, "email": user.email, "id": user.id}
@@ -0,0 +1,27 @@
+import asyncio
+import os
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from app.config.storage import check_storage
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Maximum time the readiness probe waits for the storage backend
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", "2"))
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+@router.get("/live", summary="Liveness probe", description="The process is up and serving requests. Does not touch the storage.")
+async def live():
+    return {"status": "ok"}
+
+@router.get("/ready", summary="Readiness probe", description="The application finished starting and the storage backend answers; 503 otherwise.")
+async def ready(request: Request):
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    try:
+        await asyncio.wait_for(check_storage(), READINESS_TIMEOUT_SECONDS)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": f"Storage check failed: {type(e).__name__}"})
+    return {"status": "ok"}
@@ -1,49 +1,155 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
-from app.schemas.notification import NotificationCreate, NotificationUpdate, NotificationResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from app.schemas.notification import NotificationBulkCreate, NotificationBulkResponse, NotificationCreate, NotificationMarkAllReadResponse, NotificationUnreadCount, NotificationUpdate, NotificationResponse
 from app.services.notification_service import NotificationService
+from app.services.notification_hub import NOTIFICATION_STREAM_HEARTBEAT_SECONDS, NotificationHubFull, notification_hub, render_notification
 from app.dependencies.auth import get_current_user
+from app.dependencies.services import get_notification_service
+from app.dependencies.etag import get_if_match, set_etag_header
+from app.dependencies.pagination import Pagination, get_pagination, ndjson_response, set_continuation_header, STREAM_PAGE_SIZE
+from app.dependencies.serialization import FAST_JSON_RESPONSES, documents_response
 from app.models.user import User
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
-notification_service = NotificationService()
 
 @router.post("/", response_model=NotificationResponse)
-def create_notification(notification: NotificationCreate, current_user: User = Depends(get_current_user)):
+async def create_notification(notification: NotificationCreate, notification_service: NotificationService = Depends(get_notification_service), current_user: User = Depends(get_current_user)):
     # Permitir que los administradores creen notificaciones para cualquier usuario
     if "admin" not in current_user.roles and current_user.id != notification.user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return notification_service.create_notification(notification)
+    return await notification_service.create_notification(notification)
 
 @router.post("/send_to_trainer", response_model=NotificationResponse)
-def send_notification_to_trainer(notification: NotificationCreate, current_user: User = Depends(get_current_user)):
+async def send_notification_to_trainer(notification: NotificationCreate, notification_service: NotificationService = Depends(get_notification_service), current_user: User = Depends(get_current_user)):
     # Permitir que los usuarios envíen notificaciones a los entrenadores
     if "user" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return notification_service.create_notification(notification)
+    return await notification_service.create_notification(notification)
 
 @router.post("/send_to_user", response_model=NotificationResponse)
-def send_notification_to_user(notification: NotificationCreate, current_user: User = Depends(get_current_user)):
+async def send_notification_to_user(notification: NotificationCreate, notification_service: NotificationService = Depends(get_notification_service), current_user: User = Depends(get_current_user)):
     # Permitir que los entrenadores envíen notificaciones a los usuarios
     if "trainer" not in current_user.roles and "admin" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return notification_service.create_notification(notification)
+    return await notification_service.create_notification(notification)
+
+@router.post("/bulk", response_model=NotificationBulkResponse, summary="Send a notification to many users", description="Send the same message to a list of users, or to the members of the training sessions matching a filter, and report the outcome per recipient.")
+async def create_notifications(bulk: NotificationBulkCreate, notification_service: NotificationService = Depends(get_notification_service), current_user: User = Depends(get_current_user)):
+    # Los administradores notifican a cualquiera; los entrenadores solo a los miembros de sus propias sesiones
+    own_trainings = bulk.trainings is not None and bulk.trainings.trainer_id == current_user.id
+    if "admin" not in current_user.roles and not ("trainer" in current_user.roles and own_trainings):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        results = await notification_service.create_notifications(bulk)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return NotificationBulkResponse(
+        requested=len(results),
+        queued=sum(result.status == "queued" for result in results),
+        failed=sum(result.status != "queued" for result in results),
+        results=results,
+    )
 
 @router.get("/", response_model=List[NotificationResponse])
-def get_notifications(current_user: User = Depends(get_current_user)):
-    return notification_service.get_notifications(current_user.id)
+async def get_notifications(response: Response, pagination: Pagination = Depends(get_pagination), notification_service: NotificationService = Depends(get_notification_service), current_user: User = Depends(get_current_user)):
+    if pagination.stream:
+        return ndjson_response(
+            notification_service.stream_notifications(current_user.id, pagination.limit or STREAM_PAGE_SIZE, pagination.continuation, FAST_JSON_RESPONSES),
+            NotificationResponse,
+        )
+    if pagination.limit:
+        notifications, continuation = await notification_service.get_notifications_page(current_user.id, pagination.limit, pagination.continuation, FAST_JSON_RESPONSES)
+        set_continuation_header(response, continuation)
+    else:
+        notifications = await notification_service.get_notifications(current_user.id, FAST_JSON_RESPONSES)
+    return documents_response(notifications, response, NotificationResponse) if FAST_JSON_RESPONSES else notifications
 
-@router.put("/{notification_id}", response_model=NotificationResponse)
-def update_notification(notification_id: str, notification: NotificationUpdate, current_user: User = Depends(get_current_user)):
-    existing_notification = notification_service.get_notification(notification_id)
-    if current_user.id != existing_notification.user_id:
+def _sse_event(cursor: str, data: str) -> str:
+    return f"id: {cursor}\nevent: notification\ndata: {data}\n\n"
+
+@router.get("/stream", summary="Stream new notifications", description="Server-Sent Events stream pushing the notifications of the current user as they are created. Pass the id of the last event received in Last-Event-ID (or since) to get the missed ones on reconnect.")
+async def stream_notifications(
+    since: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+    notification_service: NotificationService = Depends(get_notification_service),
+    current_user: User = Depends(get_current_user),
+):
+    if notification_hub.full:
+        raise HTTPException(status_code=503, detail="Too many open notification streams", headers={"Retry-After": "5"})
+    cursor = last_event_id or since
+
+    async def events():
+        try:
+            subscription = notification_hub.subscribe(current_user.id)
+        except NotificationHubFull:
+            return
+        try:
+            yield f"retry: {int(NOTIFICATION_STREAM_HEARTBEAT_SECONDS * 1000)}\n\n"
+            # Subscribed before reading the delta: what is published meanwhile is queued, duplicates are skipped
+            delivered = set()
+            if cursor:
+                async for event_cursor, notification in notification_service.get_notifications_since(current_user.id, cursor):
+                    delivered.add(notification.id)
+                    yield _sse_event(event_cursor, render_notification(notification))
+            while not subscription.overflowed:
+                event = await subscription.get(NOTIFICATION_STREAM_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                event_cursor, notification_id, data = event
+                if notification_id in delivered:
+                    continue
+                yield _sse_event(event_cursor, data)
+            # The client fell behind: closing makes it reconnect from its last event id
+        finally:
+            notification_hub.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def resolve_owner(current_user: User, user_id: Optional[str]) -> str:
+    # Notifications are partitioned by user: the owner is the current user unless an admin names another one
+    if user_id is None or user_id == current_user.id:
+        return current_user.id
+    if "admin" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return notification_service.update_notification(notification_id, notification)
+    return user_id
+
+@router.get("/unread_count", response_model=NotificationUnreadCount, summary="Count unread notifications", description="Number of unread notifications of the user, served from a counter maintained on every write. Pass refresh=true to recount it.")
+async def get_unread_count(user_id: Optional[str] = None, refresh: bool = False, notification_service: NotificationService = Depends(get_notification_service), current_user: User = Depends(get_current_user)):
+    owner = resolve_owner(current_user, user_id)
+    return NotificationUnreadCount(user_id=owner, unread=await notification_service.get_unread_count(owner, refresh))
+
+@router.post("/mark_all_read", response_model=NotificationMarkAllReadResponse, summary="Mark all notifications as read")
+async def mark_all_read(user_id: Optional[str] = None, notification_service: NotificationService = Depends(get_notification_service), current_user: User = Depends(get_current_user)):
+    owner = resolve_owner(current_user, user_id)
+    marked = await notification_service.mark_all_read(owner)
+    return NotificationMarkAllReadResponse(user_id=owner, marked=marked, unread=await notification_service.get_unread_count(owner))
+
+@router.get("/{notification_id}", response_model=NotificationResponse)
+async def get_notification(notification_id: str, response: Response, user_id: Optional[str] = None, notification_service: NotificationService = Depends(get_notification_service), current_user: User = Depends(get_current_user)):
+    notification = await notification_service.get_notification(notification_id, resolve_owner(current_user, user_id))
+    set_etag_header(response, notification)
+    return notification
+
+@router.put("/{notification_id}", response_model=NotificationResponse)
+async def update_notification(
+    notification_id: str,
+    notification: NotificationUpdate,
+    response: Response,
+    user_id: Optional[str] = None,
+    if_match: Optional[str] = Depends(get_if_match),
+    notification_service: NotificationService = Depends(get_notification_service),
+    current_user: User = Depends(get_current_user),
+):
+    try:
+        updated_notification = await notification_service.update_notification(notification_id, resolve_owner(current_user, user_id), notification, if_match)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_etag_header(response, updated_notification)
+    return updated_notification
 
 @router.delete("/{notification_id}")
-def delete_notification(notification_id: str, current_user: User = Depends(get_current_user)):
-    existing_notification = notification_service.get_notification(notification_id)
-    if current_user.id != existing_notification.user_id:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    notification_service.delete_notification(notification_id)
-    return {"message": "Notification deleted"} 
+async def delete_notification(notification_id: str, user_id: Optional[str] = None, notification_service: NotificationService = Depends(get_notification_service), current_user: User = Depends(get_current_user)):
+    await notification_service.delete_notification(notification_id, resolve_owner(current_user, user_id))
+    return {"message": "Notification deleted"}
@@ -1,62 +1,159 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
-from app.schemas.training import TrainingCreate, TrainingUpdate, TrainingResponse, AvailabilityCreate, AvailabilityUpdate, AvailabilityResponse
-from app.services.training_service import TrainingService
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from typing import List, Optional
+from datetime import date, datetime
+from app.schemas.training import TrainingCreate, TrainingUpdate, TrainingResponse, TrainingFilter, AvailabilityCreate, AvailabilityUpdate, AvailabilityResponse, AvailabilityFilter, FreeSlot, TrainerFreeResponse, ScheduleDay
+from app.services.training_service import BookingConflict, TrainingService
 from app.dependencies.auth import get_current_user
+from app.dependencies.services import get_training_service
+from app.dependencies.pagination import Pagination, get_pagination, ndjson_response, set_continuation_header, STREAM_PAGE_SIZE
+from app.dependencies.projection import get_fields, projected_response
+from app.dependencies.serialization import FAST_JSON_RESPONSES, documents_response
+from app.dependencies.etag import get_if_match, set_etag_header
 
 router = APIRouter(prefix="/trainings", tags=["trainings"])
-training_service = TrainingService()
 
 @router.post("/", response_model=TrainingResponse, summary="Create a new training session", description="Create a new training session with the provided details.")
-def create_training(training: TrainingCreate, current_user: str = Depends(get_current_user)):
+async def create_training(training: TrainingCreate, training_service: TrainingService = Depends(get_training_service), current_user: str = Depends(get_current_user)):
     if "trainer" not in current_user.roles and "admin" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return training_service.create_training(training)
+    try:
+        return await training_service.create_training(training)
+    except BookingConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/", response_model=List[TrainingResponse], summary="Get all training sessions", description="Retrieve a list of all training sessions.")
-def get_trainings(current_user: str = Depends(get_current_user)):
-    return training_service.get_trainings()
+@router.get("/", response_model=List[TrainingResponse], summary="Get all training sessions", description="Retrieve the training sessions, optionally filtered by trainer, user, center, status and start time window.")
+async def get_trainings(
+    response: Response,
+    filters: TrainingFilter = Depends(),
+    pagination: Pagination = Depends(get_pagination),
+    fields: Optional[List[str]] = Depends(get_fields),
+    training_service: TrainingService = Depends(get_training_service),
+    current_user: str = Depends(get_current_user),
+):
+    if pagination.stream:
+        trainings = training_service.stream_trainings(pagination.limit or STREAM_PAGE_SIZE, pagination.continuation, filters, fields, FAST_JSON_RESPONSES)
+        return ndjson_response(trainings, None if fields else TrainingResponse)
+    if pagination.limit:
+        trainings, continuation = await training_service.get_trainings_page(pagination.limit, pagination.continuation, filters, fields, FAST_JSON_RESPONSES)
+        set_continuation_header(response, continuation)
+    else:
+        trainings = await training_service.get_trainings(filters, fields, FAST_JSON_RESPONSES)
+    if fields:
+        return projected_response(trainings, response)
+    return documents_response(trainings, response, TrainingResponse) if FAST_JSON_RESPONSES else trainings
 
-@router.get("/{training_id}", response_model=TrainingResponse, summary="Get a training session by ID", description="Retrieve the details of a specific training session by its ID.")
-def get_training(training_id: str, current_user: str = Depends(get_current_user)):
-    return training_service.get_training(training_id)
-
-@router.put("/{training_id}", response_model=TrainingResponse, summary="Update a training session", description="Update the details of a specific training session by its ID.")
-def update_training(training_id: str, training: TrainingUpdate, current_user: str = Depends(get_current_user)):
+@router.post("/availability", response_model=AvailabilityResponse, summary="Create a new availability", description="Create a new availability for a trainer.")
+async def create_availability(availability: AvailabilityCreate, training_service: TrainingService = Depends(get_training_service), current_user: str = Depends(get_current_user)):
     if "trainer" not in current_user.roles and "admin" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return training_service.update_training(training_id, training)
+    return await training_service.create_availability(availability)
 
-@router.delete("/{training_id}", summary="Delete a training session", description="Delete a specific training session by its ID.")
-def delete_training(training_id: str, current_user: str = Depends(get_current_user)):
-    if "admin" not in current_user.roles:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    training_service.delete_training(training_id)
-    return {"message": "Training deleted"}
+@router.get("/availability", response_model=List[AvailabilityResponse], summary="Get all availabilities", description="Retrieve the availabilities, optionally filtered by trainer and center.")
+async def get_availabilities(
+    response: Response,
+    filters: AvailabilityFilter = Depends(),
+    pagination: Pagination = Depends(get_pagination),
+    fields: Optional[List[str]] = Depends(get_fields),
+    training_service: TrainingService = Depends(get_training_service),
+    current_user: str = Depends(get_current_user),
+):
+    if pagination.stream:
+        availabilities = training_service.stream_availabilities(pagination.limit or STREAM_PAGE_SIZE, pagination.continuation, filters, fields, FAST_JSON_RESPONSES)
+        return ndjson_response(availabilities, None if fields else AvailabilityResponse)
+    if pagination.limit:
+        availabilities, continuation = await training_service.get_availabilities_page(pagination.limit, pagination.continuation, filters, fields, FAST_JSON_RESPONSES)
+        set_continuation_header(response, continuation)
+    else:
+        availabilities = await training_service.get_availabilities(filters, fields, FAST_JSON_RESPONSES)
+    if fields:
+        return projected_response(availabilities, response)
+    return documents_response(availabilities, response, AvailabilityResponse) if FAST_JSON_RESPONSES else availabilities
 
-@router.post("/availability", response_model=AvailabilityResponse, summary="Create a new availability", description="Create a new availability for a trainer.")
-def create_availability(availability: AvailabilityCreate, current_user: str = Depends(get_current_user)):
-    if "trainer" not in current_user.roles and "admin" not in current_user.roles:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    return training_service.create_availability(availability)
+@router.get("/availability/slots", response_model=List[FreeSlot], summary="Find free slots in a center", description="Retrieve the next free slots of the trainers of a center between start and end, skipping the booked ones.")
+async def find_free_slots(
+    center_id: str,
+    start: datetime,
+    end: datetime,
+    limit: int = Query(10, ge=1, le=100),
+    training_service: TrainingService = Depends(get_training_service),
+    current_user: str = Depends(get_current_user),
+):
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    return await training_service.find_free_slots(center_id, start, end, limit)
 
-@router.get("/availability", response_model=List[AvailabilityResponse], summary="Get all availabilities", description="Retrieve a list of all availabilities.")
-def get_availabilities(current_user: str = Depends(get_current_user)):
-    return training_service.get_availabilities()
+@router.get("/availability/trainers/{trainer_id}/free", response_model=TrainerFreeResponse, summary="Check whether a trainer is free", description="Check whether the trainer has a free (available and not booked) slot at the given time.")
+async def is_trainer_free(trainer_id: str, at: datetime, training_service: TrainingService = Depends(get_training_service), current_user: str = Depends(get_current_user)):
+    slot = await training_service.find_trainer_slot(trainer_id, at)
+    return TrainerFreeResponse(trainer_id=trainer_id, at=at, free=slot is not None, slot=slot)
 
 @router.get("/availability/{availability_id}", response_model=AvailabilityResponse, summary="Get an availability by ID", description="Retrieve the details of a specific availability by its ID.")
-def get_availability(availability_id: str, current_user: str = Depends(get_current_user)):
-    return training_service.get_availability(availability_id)
+async def get_availability(availability_id: str, response: Response, training_service: TrainingService = Depends(get_training_service), current_user: str = Depends(get_current_user)):
+    availability = await training_service.get_availability(availability_id)
+    set_etag_header(response, availability)
+    return availability
 
-@router.put("/availability/{availability_id}", response_model=AvailabilityResponse, summary="Update an availability", description="Update the details of a specific availability by its ID.")
-def update_availability(availability_id: str, availability: AvailabilityUpdate, current_user: str = Depends(get_current_user)):
+@router.put("/availability/{availability_id}", response_model=AvailabilityResponse, summary="Update an availability", description="Update the fields sent of a specific availability by its ID. Send the ETag of the last read in If-Match to get 412 instead of overwriting a concurrent change.")
+async def update_availability(
+    availability_id: str,
+    availability: AvailabilityUpdate,
+    response: Response,
+    if_match: Optional[str] = Depends(get_if_match),
+    training_service: TrainingService = Depends(get_training_service),
+    current_user: str = Depends(get_current_user),
+):
     if "trainer" not in current_user.roles and "admin" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return training_service.update_availability(availability_id, availability)
+    updated_availability = await training_service.update_availability(availability_id, availability, if_match)
+    set_etag_header(response, updated_availability)
+    return updated_availability
 
 @router.delete("/availability/{availability_id}", summary="Delete an availability", description="Delete a specific availability by its ID.")
-def delete_availability(availability_id: str, current_user: str = Depends(get_current_user)):
+async def delete_availability(availability_id: str, training_service: TrainingService = Depends(get_training_service), current_user: str = Depends(get_current_user)):
     if "admin" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    training_service.delete_availability(availability_id)
+    await training_service.delete_availability(availability_id)
     return {"message": "Availability deleted"}
+
+@router.get("/schedule/trainers/{trainer_id}", response_model=List[ScheduleDay], summary="Get the schedule of a trainer", description="Trainings and available slots of the trainer, day by day from start (UTC days), read from the schedule views. The views follow the writes with a short delay.")
+async def get_trainer_schedule(trainer_id: str, start: date, days: int = Query(7, ge=1, le=31), training_service: TrainingService = Depends(get_training_service), current_user: str = Depends(get_current_user)):
+    return await training_service.get_trainer_schedule(trainer_id, start, days)
+
+@router.get("/schedule/members/{user_id}", response_model=List[ScheduleDay], summary="Get the schedule of a member", description="Trainings of the member, day by day from start (UTC days), read from the schedule views. The views follow the writes with a short delay.")
+async def get_member_schedule(user_id: str, start: date, days: int = Query(7, ge=1, le=31), training_service: TrainingService = Depends(get_training_service), current_user: str = Depends(get_current_user)):
+    return await training_service.get_member_schedule(user_id, start, days)
+
+@router.get("/{training_id}", response_model=TrainingResponse, summary="Get a training session by ID", description="Retrieve the details of a specific training session by its ID.")
+async def get_training(training_id: str, response: Response, training_service: TrainingService = Depends(get_training_service), current_user: str = Depends(get_current_user)):
+    training = await training_service.get_training(training_id)
+    set_etag_header(response, training)
+    return training
+
+@router.put("/{training_id}", response_model=TrainingResponse, summary="Update a training session", description="Update the fields sent of a specific training session by its ID. Send the ETag of the last read in If-Match to get 412 instead of overwriting a concurrent change.")
+async def update_training(
+    training_id: str,
+    training: TrainingUpdate,
+    response: Response,
+    if_match: Optional[str] = Depends(get_if_match),
+    training_service: TrainingService = Depends(get_training_service),
+    current_user: str = Depends(get_current_user),
+):
+    if "trainer" not in current_user.roles and "admin" not in current_user.roles:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        updated_training = await training_service.update_training(training_id, training, if_match)
+    except BookingConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_etag_header(response, updated_training)
+    return updated_training
+
+@router.delete("/{training_id}", summary="Delete a training session", description="Delete a specific training session by its ID.")
+async def delete_training(training_id: str, training_service: TrainingService = Depends(get_training_service), current_user: str = Depends(get_current_user)):
+    if "admin" not in current_user.roles:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    await training_service.delete_training(training_id)
+    return {"message": "Training deleted"}
@@ -1,40 +1,73 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Response
+from typing import List, Optional
 from app.schemas.user import UserCreate, UserUpdate, UserResponse
 from app.services.user_service import UserService
+from app.services.password_hasher import PasswordHasherBusy
 from app.dependencies.auth import get_current_user
+from app.dependencies.services import get_user_service
+from app.dependencies.etag import get_if_match, set_etag_header
+from app.dependencies.pagination import Pagination, get_pagination, ndjson_response, set_continuation_header, STREAM_PAGE_SIZE
+from app.dependencies.serialization import FAST_JSON_RESPONSES, documents_response
 from app.models.user import User
 
 router = APIRouter(prefix="/users", tags=["users"])
-user_service = UserService()
 
 @router.post("/", response_model=UserResponse, summary="Create a new user", description="Create a new user with the provided details.")
-def create_user(user: UserCreate, current_user: str = Depends(get_current_user)):
+async def create_user(user: UserCreate, user_service: UserService = Depends(get_user_service), current_user: str = Depends(get_current_user)):
     if "admin" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return user_service.create_user(user)
+    try:
+        return await user_service.create_user(user)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
 @router.get("/", response_model=List[UserResponse], summary="Get all users", description="Retrieve a list of all users.")
-def get_users(current_user: str = Depends(get_current_user)):
+async def get_users(response: Response, pagination: Pagination = Depends(get_pagination), user_service: UserService = Depends(get_user_service), current_user: str = Depends(get_current_user)):
     if "admin" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return user_service.get_users()
+    if pagination.stream:
+        return ndjson_response(user_service.stream_users(pagination.limit or STREAM_PAGE_SIZE, pagination.continuation, FAST_JSON_RESPONSES), UserResponse)
+    if pagination.limit:
+        users, continuation = await user_service.get_users_page(pagination.limit, pagination.continuation, FAST_JSON_RESPONSES)
+        set_continuation_header(response, continuation)
+    else:
+        users = await user_service.get_users(FAST_JSON_RESPONSES)
+    # UserResponse leaves the password hash of the documents out
+    return documents_response(users, response, UserResponse) if FAST_JSON_RESPONSES else users
 
 @router.get("/{user_id}", response_model=UserResponse, summary="Get a user by ID", description="Retrieve the details of a specific user by their ID.")
-def get_user(user_id: str, current_user: User = Depends(get_current_user)):
+async def get_user(user_id: str, response: Response, user_service: UserService = Depends(get_user_service), current_user: User = Depends(get_current_user)):
     if "admin" not in current_user.roles and current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return user_service.get_user(user_id)
+    user = await user_service.get_user(user_id)
+    set_etag_header(response, user)
+    return user
 
-@router.put("/{user_id}", response_model=UserResponse, summary="Update a user", description="Update the details of a specific user by their ID.")
-def update_user(user_id: str, user: UserUpdate, current_user: str = Depends(get_current_user)):
+@router.put("/{user_id}", response_model=UserResponse, summary="Update a user", description="Update the fields sent of a specific user by their ID. Send the ETag of the last read in If-Match to get 412 instead of overwriting a concurrent change.")
+async def update_user(
+    user_id: str,
+    user: UserUpdate,
+    response: Response,
+    if_match: Optional[str] = Depends(get_if_match),
+    user_service: UserService = Depends(get_user_service),
+    current_user: str = Depends(get_current_user),
+):
     if "admin" not in current_user.roles and current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return user_service.update_user(user_id, user)
+    try:
+        updated_user = await user_service.update_user(user_id, user, if_match)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    set_etag_header(response, updated_user)
+    return updated_user
 
 @router.delete("/{user_id}", summary="Delete a user", description="Delete a specific user by their ID.")
-def delete_user(user_id: str, current_user: str = Depends(get_current_user)):
+async def delete_user(user_id: str, user_service: UserService = Depends(get_user_service), current_user: str = Depends(get_current_user)):
     if "admin" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Not authorized")
-    user_service.delete_user(user_id)
+    await user_service.delete_user(user_id)
     return {"message": "User deleted"}
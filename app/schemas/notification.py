@@ -1,6 +1,7 @@
-from pydantic import BaseModel, field_validator, ConfigDict
-from typing import Optional
-from datetime import datetime, timezone
+from pydantic import BaseModel, model_validator, ConfigDict
+from typing import List, Optional
+from datetime import datetime
+from app.schemas.training import TrainingFilter
 
 class NotificationBase(BaseModel):
     user_id: str
@@ -8,19 +9,57 @@ class NotificationBase(BaseModel):
     read: bool = False
 
 class NotificationCreate(NotificationBase):
+    # Ignored, kept for the clients that still send it: the server sets the creation time,
+    # which orders the notification streams
     created_at: Optional[datetime] = None
 
-    @field_validator('created_at', mode='before')
-    def set_created_at(cls, v):
-        return v or datetime.now(timezone.utc)
-
     model_config = ConfigDict(json_encoders={datetime: lambda v: v.isoformat()})  # Convierte datetime a string
 
-class NotificationUpdate(NotificationBase):
+class NotificationUpdate(BaseModel):
+    # Partial update: only the fields that are sent are changed
+    user_id: Optional[str] = None
+    message: Optional[str] = None
     read: Optional[bool] = None
 
 class NotificationResponse(NotificationBase):
     id: str
     created_at: datetime
+    delivery_status: Optional[str] = None
+
+    model_config = ConfigDict(json_encoders={datetime: lambda v: v.isoformat()})  # Convierte datetime a string
+
+class NotificationBulkCreate(BaseModel):
+    """
+    One message sent to many users: either an explicit list of user ids, or the members
+    of the training sessions matching a filter (a trainer's class, a center, a time window).
+    """
+    message: str
+    user_ids: Optional[List[str]] = None
+    trainings: Optional[TrainingFilter] = None
+
+    @model_validator(mode="after")
+    def check_recipients(self):
+        if (self.user_ids is None) == (self.trainings is None):
+            raise ValueError("Exactly one of user_ids or trainings must be given")
+        return self
 
-    model_config = ConfigDict(json_encoders={datetime: lambda v: v.isoformat()})  # Convierte datetime a string 
+class NotificationRecipientStatus(BaseModel):
+    user_id: str
+    status: str  # queued | created | not_found | failed
+    notification_id: Optional[str] = None
+    detail: Optional[str] = None
+
+class NotificationBulkResponse(BaseModel):
+    requested: int
+    queued: int
+    failed: int
+    results: List[NotificationRecipientStatus]
+
+class NotificationUnreadCount(BaseModel):
+    user_id: str
+    unread: int
+
+class NotificationMarkAllReadResponse(BaseModel):
+    user_id: str
+    marked: int
+    unread: int
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 
 class TrainingBase(BaseModel):
     trainer_id: str
@@ -8,12 +8,19 @@ class TrainingBase(BaseModel):
     start_time: datetime
     end_time: datetime
     status: str
+    center_id: Optional[str] = None
 
 class TrainingCreate(TrainingBase):
     pass
 
-class TrainingUpdate(TrainingBase):
-    pass
+class TrainingUpdate(BaseModel):
+    # Partial update: only the fields that are sent are changed
+    trainer_id: Optional[str] = None
+    user_id: Optional[str] = None
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    status: Optional[str] = None
+    center_id: Optional[str] = None
 
 class TrainingResponse(TrainingBase):
     id: str
@@ -21,6 +28,17 @@ class TrainingResponse(TrainingBase):
     class Config:
         from_attributes = True
 
+class TrainingFilter(BaseModel):
+    """
+    Query parameters filtering the list of training sessions. The time window applies to start_time.
+    """
+    trainer_id: Optional[str] = None
+    user_id: Optional[str] = None
+    center_id: Optional[str] = None
+    status: Optional[str] = None
+    start_from: Optional[datetime] = None
+    start_to: Optional[datetime] = None
+
 class AvailabilityBase(BaseModel):
     trainer_id: str
     center_id: str
@@ -29,11 +47,56 @@ class AvailabilityBase(BaseModel):
 class AvailabilityCreate(AvailabilityBase):
     pass
 
-class AvailabilityUpdate(AvailabilityBase):
-    pass
+class AvailabilityUpdate(BaseModel):
+    # Partial update: only the fields that are sent are changed
+    trainer_id: Optional[str] = None
+    center_id: Optional[str] = None
+    available_times: Optional[List[datetime]] = None
 
 class AvailabilityResponse(AvailabilityBase):
     id: str
 
     class Config:
         from_attributes = True
+
+class AvailabilityFilter(BaseModel):
+    """
+    Query parameters filtering the list of availabilities.
+    """
+    trainer_id: Optional[str] = None
+    center_id: Optional[str] = None
+
+class FreeSlot(BaseModel):
+    trainer_id: str
+    center_id: str
+    start_time: datetime
+    end_time: datetime
+
+class TrainerFreeResponse(BaseModel):
+    trainer_id: str
+    at: datetime
+    free: bool
+    slot: Optional[FreeSlot] = None
+
+class ScheduleTraining(BaseModel):
+    id: str
+    trainer_id: str
+    user_id: str
+    center_id: Optional[str] = None
+    start_time: datetime
+    end_time: datetime
+    status: str
+
+class ScheduleSlot(BaseModel):
+    availability_id: str
+    center_id: str
+    start_time: datetime
+
+class ScheduleDay(BaseModel):
+    """
+    One day of the schedule of a trainer or a member, read from the materialized views.
+    Members' days have no slots.
+    """
+    day: date
+    trainings: List[ScheduleTraining] = []
+    slots: List[ScheduleSlot] = []
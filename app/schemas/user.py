@@ -8,7 +8,10 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     password: str
 
-class UserUpdate(UserBase):
+class UserUpdate(BaseModel):
+    # Partial update: only the fields that are sent are changed
+    username: Optional[str] = None
+    email: Optional[EmailStr] = None
     password: Optional[str] = None
 
 class UserResponse(UserBase):
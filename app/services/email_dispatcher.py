@@ -0,0 +1,291 @@
+"""
+Background delivery of the emails queued in the outbox by NotificationService.
+
+By default the dispatcher runs as an asyncio task inside every API process
+(EMAIL_DISPATCHER_MODE=inprocess). Each dispatcher claims the messages it sends, so the
+dispatchers of several workers never send the same email twice. To keep the sends out of
+the API processes, set EMAIL_DISPATCHER_MODE=worker and run dispatcher processes instead:
+
+    python -m app.services.email_dispatcher
+"""
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple, Union
+from app.config.storage import get_repository
+from app.models.outbox import OutboxMessage, OutboxRecipient
+from app.repositories.base import ItemNotFoundError, PreconditionFailedError
+from app.services.email_sender import EmailMessage, EmailSender, create_email_sender
+from app.services.user_service import UserService
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMAIL_DISPATCHER_MODE = os.getenv("EMAIL_DISPATCHER_MODE", "inprocess").lower()
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+EMAIL_POLL_INTERVAL_SECONDS = float(os.getenv("EMAIL_POLL_INTERVAL_SECONDS", "5"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "2"))
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv("EMAIL_RETRY_MAX_SECONDS", "600"))
+# Seconds a dispatcher holds the messages it claimed. The messages of a dispatcher that died
+# are sent again after this long, so it must exceed the time a batch takes to send.
+EMAIL_LEASE_SECONDS = float(os.getenv("EMAIL_LEASE_SECONDS", "60"))
+
+RECIPIENT_NOT_FOUND = "Recipient not found"
+
+if EMAIL_DISPATCHER_MODE not in ("inprocess", "worker"):
+    raise ValueError("EMAIL_DISPATCHER_MODE must be either 'inprocess' or 'worker'.")
+
+class EmailDispatcher:
+    """
+    Sends the due outbox messages in batches. Failed sends are retried with jittered
+    exponential backoff and dead-lettered (status "dead") after `max_attempts`. The outcome
+    is recorded in the `delivery_status` of the notification.
+
+    A message of a bulk notification holds many recipients. It is sent like the others, and
+    the recipients that failed are then split off into messages of their own, retried and
+    dead-lettered one by one.
+
+    A message is claimed before it is sent: an ETag-conditional patch sets its status to
+    "sending" and moves its next_attempt_at `lease_seconds` ahead. Only one of several
+    dispatchers wins the claim, and the message becomes due again if its dispatcher dies
+    before recording the outcome.
+    """
+
+    def __init__(
+        self,
+        sender: Optional[EmailSender] = None,
+        batch_size: int = EMAIL_BATCH_SIZE,
+        poll_interval: float = EMAIL_POLL_INTERVAL_SECONDS,
+        max_attempts: int = EMAIL_MAX_ATTEMPTS,
+        user_service: Optional[UserService] = None,
+        lease_seconds: float = EMAIL_LEASE_SECONDS,
+    ):
+        self.sender = sender
+        self._user_service = user_service
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.claims_lost = 0
+
+    @property
+    def user_service(self) -> UserService:
+        if self._user_service is None:
+            self._user_service = UserService()
+        return self._user_service
+
+    @property
+    def outbox_repository(self):
+        return get_repository("outbox")
+
+    @property
+    def notification_repository(self):
+        return get_repository("notifications")
+
+    def notify(self) -> None:
+        """
+        Wake the dispatcher up after new messages were queued, instead of waiting for the next poll.
+        """
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self) -> None:
+        if self.sender is None:
+            self.sender = create_email_sender()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wake = None
+        if self.sender is not None:
+            await self.sender.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await self.dispatch_once()
+            except Exception as e:
+                print(f"Email dispatcher failed: {e}")
+                processed = 0
+            # A full batch means more messages are probably due already
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def dispatch_once(self) -> int:
+        """
+        Send one batch of due messages and return how many emails were processed. A batch
+        holds up to `batch_size` emails, or a single bulk message with more recipients.
+        """
+        now = datetime.now(timezone.utc)
+        # The messages "sending" past their next_attempt_at were claimed by a dispatcher that died
+        items, _ = await self.outbox_repository.query_page(
+            [("status", "in", ["pending", "sending"]), ("next_attempt_at", "<=", now)],
+            order_by=[("next_attempt_at", "ASC")],
+            page_size=self.batch_size,
+        )
+        selected, size = [], 0
+        for item in items:
+            recipients = max(len(item.get("recipients") or []), 1)
+            if selected and size + recipients > self.batch_size:
+                break
+            selected.append(item)
+            size += recipients
+        if not selected:
+            return 0
+        claimed = await asyncio.gather(*(self._claim(item, now) for item in selected))
+        messages = [message for message in claimed if message is not None]
+        if not messages:
+            return size
+
+        deliveries = [(message, recipient) for message in messages for recipient in message.deliveries()]
+        emails = await self._resolve_emails({recipient.user_id for _, recipient in deliveries})
+        deliverable = [(message, recipient) for message, recipient in deliveries if recipient.user_id in emails]
+        errors = await self.sender.send_batch(
+            [EmailMessage(to=emails[recipient.user_id], subject=message.subject, body=message.body) for message, recipient in deliverable]
+        )
+        # Outcome of every recipient of every message: None when sent, else the error
+        outcomes: Dict[str, List[Tuple[OutboxRecipient, Optional[str]]]] = {message.id: [] for message in messages}
+        for (message, recipient), error in zip(deliverable, errors):
+            outcomes[message.id].append((recipient, error))
+        for message, recipient in deliveries:
+            if recipient.user_id not in emails:
+                outcomes[message.id].append((recipient, RECIPIENT_NOT_FOUND))
+
+        results = []
+        for message in messages:
+            if message.recipients:
+                results.append(self._record_bulk_results(message, outcomes[message.id]))
+            else:
+                error = outcomes[message.id][0][1]
+                results.append(self._dead_letter(message, error) if error == RECIPIENT_NOT_FOUND else self._record_result(message, error))
+        await asyncio.gather(*results)
+        return size
+
+    async def _claim(self, item: dict, now: datetime) -> Optional[OutboxMessage]:
+        """
+        Lease a due message to this dispatcher. None if another dispatcher claimed it (or
+        it was processed) since it was read.
+        """
+        try:
+            claimed = await self.outbox_repository.patch(item["id"], item["id"], [
+                {"op": "set", "path": "/status", "value": "sending"},
+                {"op": "set", "path": "/next_attempt_at", "value": now + timedelta(seconds=self.lease_seconds)},
+            ], if_match=item.get("_etag"))
+        except (PreconditionFailedError, ItemNotFoundError):
+            self.claims_lost += 1
+            return None
+        return OutboxMessage(**claimed)
+
+    async def _resolve_emails(self, user_ids: Set[str]) -> Dict[str, str]:
+        return await self.user_service.get_emails(list(user_ids))
+
+    async def _record_result(self, message: OutboxMessage, error: Optional[str]) -> None:
+        if error is None:
+            await self.outbox_repository.delete(message.id, message.id)
+            await self._set_delivery_status(message, "sent", delivered_at=datetime.now(timezone.utc))
+            self.sent += 1
+            return
+        attempts = message.attempts + 1
+        if attempts >= self.max_attempts:
+            await self._dead_letter(message, error)
+            return
+        delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+        await self.outbox_repository.patch(message.id, message.id, [
+            {"op": "set", "path": "/status", "value": "pending"},
+            {"op": "set", "path": "/attempts", "value": attempts},
+            {"op": "set", "path": "/next_attempt_at", "value": datetime.now(timezone.utc) + timedelta(seconds=delay)},
+            {"op": "set", "path": "/last_error", "value": error},
+        ])
+        self.retried += 1
+
+    async def _record_bulk_results(self, message: OutboxMessage, outcomes: List[Tuple[OutboxRecipient, Optional[str]]]) -> None:
+        """
+        Record the sent recipients of a bulk message, queue the failed ones as messages of
+        their own and delete it. The ids of the split messages derive from the bulk message,
+        so that a dispatcher sending it again after a crash overwrites them.
+        """
+        attempts = message.attempts + 1
+        delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+        async def record(recipient: OutboxRecipient, error: Optional[str]) -> None:
+            if error is None:
+                await self._set_delivery_status(recipient, "sent", delivered_at=datetime.now(timezone.utc))
+                self.sent += 1
+                return
+            dead = error == RECIPIENT_NOT_FOUND or attempts >= self.max_attempts
+            await self.outbox_repository.upsert(OutboxMessage(
+                id=f"{message.id}-{recipient.notification_id}",
+                notification_id=recipient.notification_id,
+                user_id=recipient.user_id,
+                subject=message.subject,
+                body=message.body,
+                status="dead" if dead else "pending",
+                attempts=attempts,
+                next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=delay * random.uniform(0.5, 1.0)),
+                last_error=error,
+                created_at=message.created_at,
+            ).model_dump())
+            if dead:
+                await self._set_delivery_status(recipient, "failed")
+                self.dead_lettered += 1
+            else:
+                self.retried += 1
+
+        await asyncio.gather(*(record(recipient, error) for recipient, error in outcomes))
+        try:
+            await self.outbox_repository.delete(message.id, message.id)
+        except ItemNotFoundError:
+            pass
+
+    async def _dead_letter(self, message: OutboxMessage, error: str) -> None:
+        await self.outbox_repository.patch(message.id, message.id, [
+            {"op": "set", "path": "/status", "value": "dead"},
+            {"op": "set", "path": "/attempts", "value": message.attempts + 1},
+            {"op": "set", "path": "/last_error", "value": error},
+        ])
+        await self._set_delivery_status(message, "failed")
+        self.dead_lettered += 1
+
+    async def _set_delivery_status(self, message: Union[OutboxMessage, OutboxRecipient], status: str, delivered_at: Optional[datetime] = None) -> None:
+        operations: List[dict] = [{"op": "set", "path": "/delivery_status", "value": status}]
+        if delivered_at is not None:
+            operations.append({"op": "set", "path": "/delivered_at", "value": delivered_at})
+        try:
+            await self.notification_repository.patch(message.notification_id, message.user_id, operations)
+        except ItemNotFoundError:
+            # The notification was deleted in the meantime
+            pass
+
+email_dispatcher = EmailDispatcher()
+
+async def _run_worker() -> None:
+    from app.config.storage import open_storage, close_storage
+
+    await open_storage()
+    await email_dispatcher.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await email_dispatcher.stop()
+        await close_storage()
+
+if __name__ == "__main__":
+    asyncio.run(_run_worker())
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import random
+from abc import ABC, abstractmethod
+from typing import List, Optional
+from pydantic import BaseModel
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "acs" sends through Azure Communication Services, "fake" only records the messages
+EMAIL_SENDER = os.getenv("EMAIL_SENDER", "acs").lower()
+# Simulated latency and failure rate of the fake sender, to measure end-to-end throughput
+EMAIL_FAKE_LATENCY_MS = float(os.getenv("EMAIL_FAKE_LATENCY_MS", "0"))
+EMAIL_FAKE_FAILURE_RATE = float(os.getenv("EMAIL_FAKE_FAILURE_RATE", "0"))
+# Emails of a batch sent at the same time through Azure Communication Services
+EMAIL_ACS_MAX_CONCURRENCY = int(os.getenv("EMAIL_ACS_MAX_CONCURRENCY", "10"))
+
+class EmailMessage(BaseModel):
+    to: str
+    subject: str
+    body: str
+
+class EmailSender(ABC):
+    """
+    Delivers batches of emails. `send_batch` returns, for each message, None when it was
+    sent or the error message when it failed; it must not raise for individual failures.
+    """
+
+    @abstractmethod
+    async def send_batch(self, messages: List[EmailMessage]) -> List[Optional[str]]:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+class AcsEmailSender(EmailSender):
+    """
+    Azure Communication Services has no batch send: every email of a batch is its own
+    `begin_send` call (and long-running operation), so a batch only saves the outbox
+    round trips. At most `max_concurrency` of them are in flight, to stay under the
+    per-minute send quota of the resource.
+    """
+
+    def __init__(self, connection_string: Optional[str] = None, sender_address: Optional[str] = None, max_concurrency: int = EMAIL_ACS_MAX_CONCURRENCY):
+        self.connection_string = connection_string or os.getenv("AZURE_COMMUNICATION_SERVICE_CONNECTION_STRING")
+        self.sender_address = sender_address or os.getenv("EMAIL_ADDRESS")
+        self.max_concurrency = max_concurrency
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from azure.communication.email.aio import EmailClient
+            self._client = EmailClient.from_connection_string(self.connection_string)
+        return self._client
+
+    async def _send(self, message: EmailMessage) -> Optional[str]:
+        email_message = {
+            "senderAddress": self.sender_address,
+            "recipients": {
+                "to": [{"address": message.to}]
+            },
+            "content": {
+                "subject": message.subject,
+                "plainText": message.body
+            }
+        }
+        try:
+            poller = await self.client.begin_send(email_message)
+            result = await poller.result()
+            if result.get("status") not in (None, "Succeeded"):
+                return f"Email not sent: {result.get('status')} {result.get('error')}"
+            return None
+        except Exception as e:
+            return f"Failed to send email: {e}"
+
+    async def send_batch(self, messages: List[EmailMessage]) -> List[Optional[str]]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def send(message: EmailMessage) -> Optional[str]:
+            async with semaphore:
+                return await self._send(message)
+
+        return list(await asyncio.gather(*(send(message) for message in messages)))
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+class FakeEmailSender(EmailSender):
+    """
+    Sender for local runs and benchmarks: keeps the sent messages in memory.
+    """
+
+    def __init__(self, latency_ms: float = EMAIL_FAKE_LATENCY_MS, failure_rate: float = EMAIL_FAKE_FAILURE_RATE):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.sent: List[EmailMessage] = []
+
+    async def send_batch(self, messages: List[EmailMessage]) -> List[Optional[str]]:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        results = []
+        for message in messages:
+            if self.failure_rate and random.random() < self.failure_rate:
+                results.append("Simulated delivery failure")
+            else:
+                self.sent.append(message)
+                results.append(None)
+        return results
+
+def create_email_sender() -> EmailSender:
+    if EMAIL_SENDER == "fake":
+        return FakeEmailSender()
+    if EMAIL_SENDER == "acs":
+        return AcsEmailSender()
+    raise ValueError("EMAIL_SENDER must be either 'acs' or 'fake'.")
@@ -0,0 +1,162 @@
+import asyncio
+import importlib
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from app.config.storage import get_repository
+from app.models.idempotency import IdempotencyRecord
+from app.repositories.base import ItemExistsError, ItemNotFoundError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Where the responses of the requests sent with an Idempotency-Key are kept:
+# - "memory": in this process only. With several workers, a retry that reaches another
+#   worker than the first request is executed again;
+# - "storage": the idempotency_keys container of the storage backend (Cosmos), shared by every worker;
+# - "package.module:factory": a callable returning an IdempotencyStore.
+# Defaults to "storage" when WEB_CONCURRENCY (the worker count of uvicorn and gunicorn) is above 1.
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "storage" if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 else "memory")
+# Seconds a response is replayed to the retries of its request
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# Seconds a request holds its key: if its worker dies, the key is free again after this long
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+# Seconds a retry waits for the original request to finish before getting 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+# Keys kept by the memory store
+IDEMPOTENCY_MEMORY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MEMORY_MAX_KEYS", "100000"))
+
+class IdempotencyKeyInUse(Exception):
+    """
+    The request that first used the key is still being processed.
+    """
+
+class IdempotencyStore(ABC):
+    """
+    Records the response of the first request sent with a key. `begin` either lets the
+    caller execute the request (None), or returns the completed record to replay, waiting
+    for the request in flight with the same key. The caller then has to call `complete`
+    with the response, or `release` if there is nothing to replay.
+    """
+
+    @abstractmethod
+    async def begin(self, key: str, fingerprint: str) -> Optional[IdempotencyRecord]:
+        """
+        :raises IdempotencyKeyInUse: If the request in flight did not finish within IDEMPOTENCY_WAIT_SECONDS.
+        """
+
+    @abstractmethod
+    async def complete(self, record: IdempotencyRecord) -> None:
+        pass
+
+    @abstractmethod
+    async def release(self, key: str) -> None:
+        pass
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """
+    Keys of this process only: retries landing on another worker execute again.
+    """
+
+    def __init__(self, max_keys: int = IDEMPOTENCY_MEMORY_MAX_KEYS, ttl: float = IDEMPOTENCY_TTL_SECONDS, wait: float = IDEMPOTENCY_WAIT_SECONDS):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.wait = wait
+        # key -> (expires at, record)
+        self._records: "OrderedDict[str, Tuple[float, IdempotencyRecord]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Event] = {}
+
+    async def begin(self, key: str, fingerprint: str) -> Optional[IdempotencyRecord]:
+        deadline = time.monotonic() + self.wait
+        while True:
+            entry = self._records.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    return entry[1]
+                del self._records[key]
+            event = self._in_flight.get(key)
+            if event is None:
+                self._in_flight[key] = asyncio.Event()
+                return None
+            try:
+                await asyncio.wait_for(event.wait(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise IdempotencyKeyInUse(key)
+
+    async def complete(self, record: IdempotencyRecord) -> None:
+        self._records.pop(record.id, None)
+        self._records[record.id] = (time.monotonic() + self.ttl, record)
+        while len(self._records) > self.max_keys:
+            self._records.popitem(last=False)
+        self._wake(record.id)
+
+    async def release(self, key: str) -> None:
+        self._wake(key)
+
+    def _wake(self, key: str) -> None:
+        event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+class RepositoryIdempotencyStore(IdempotencyStore):
+    """
+    Keys shared by every worker through the idempotency_keys container. A request takes its
+    key by creating a pending record, which expires after `lock_seconds` (Cosmos TTL) if its
+    worker dies; concurrent duplicates poll the record until it is completed.
+    """
+
+    def __init__(self, lock_seconds: int = IDEMPOTENCY_LOCK_SECONDS, ttl: int = IDEMPOTENCY_TTL_SECONDS, wait: float = IDEMPOTENCY_WAIT_SECONDS):
+        self.repository = get_repository("idempotency_keys")
+        self.lock_seconds = lock_seconds
+        self.ttl = ttl
+        self.wait = wait
+
+    async def begin(self, key: str, fingerprint: str) -> Optional[IdempotencyRecord]:
+        deadline = time.monotonic() + self.wait
+        delay = 0.05
+        while True:
+            try:
+                await self.repository.create(IdempotencyRecord(id=key, fingerprint=fingerprint, ttl=self.lock_seconds).model_dump())
+                return None
+            except ItemExistsError:
+                pass
+            try:
+                record = IdempotencyRecord(**await self.repository.read(key, key))
+                if record.state == "completed":
+                    return record
+            except ItemNotFoundError:
+                # Released or expired meanwhile: take it on the next attempt. A backend that
+                # hides an expired record before deleting it keeps failing the create, so
+                # this wait is bounded by the deadline like the pending one
+                pass
+            if time.monotonic() + delay > deadline:
+                raise IdempotencyKeyInUse(key)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    async def complete(self, record: IdempotencyRecord) -> None:
+        record.ttl = self.ttl
+        await self.repository.upsert(record.model_dump())
+
+    async def release(self, key: str) -> None:
+        try:
+            await self.repository.delete(key, key)
+        except ItemNotFoundError:
+            pass
+
+def create_idempotency_store(kind: str = IDEMPOTENCY_STORE) -> IdempotencyStore:
+    """
+    :raises ValueError: If `kind` is not a known store nor a "package.module:factory" path.
+    """
+    if kind == "memory":
+        return MemoryIdempotencyStore()
+    if kind == "storage":
+        return RepositoryIdempotencyStore()
+    module_name, _, factory_name = kind.partition(":")
+    if not module_name or not factory_name:
+        raise ValueError("IDEMPOTENCY_STORE must be 'memory', 'storage' or 'package.module:factory'.")
+    return getattr(importlib.import_module(module_name), factory_name)()
+
+idempotency_store = create_idempotency_store()
@@ -0,0 +1,187 @@
+import asyncio
+import importlib
+import json
+import os
+import socket
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# How the writes of one worker invalidate the in-process caches of the others:
+# - "local": no other process is told (a single worker per deployment);
+# - "unix": every worker of the host binds a Unix datagram socket in INVALIDATION_BUS_PATH
+#   and broadcasts its invalidations to the sockets of the other workers;
+# - "package.module:factory": a callable returning an InvalidationBus, e.g. one backed by a
+#   networked pub/sub for workers spread over several hosts.
+INVALIDATION_BUS = os.getenv("INVALIDATION_BUS", "local")
+INVALIDATION_BUS_PATH = os.getenv("INVALIDATION_BUS_PATH", os.path.join(tempfile.gettempdir(), "gimassistant-invalidation"))
+
+# Largest message sent over the bus; keys are document ids
+MAX_MESSAGE_BYTES = 4096
+
+Handler = Callable[[str], None]
+
+class InvalidationBus(ABC):
+    """
+    Publish/subscribe of cache invalidations. A topic names the cached documents ("users",
+    "trainings", "availabilities") and a message carries the id of the document that was
+    written.
+
+    `publish` runs the handlers subscribed in this process right away and broadcasts the
+    message to the other processes, whose bus calls `receive` with it. Subclasses connect
+    to the other processes in `start` and implement `_broadcast`. A message that is lost
+    leaves the caches of the process that missed it stale until their entries expire, so
+    every cache subscribed to the bus must still bound its staleness with a TTL.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+        self.published = 0
+        self.received = 0
+        self.failed = 0
+
+    def subscribe(self, topic: str, handler: Handler) -> None:
+        """
+        :param handler: Called with the document id on the event loop; must not block.
+        """
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic: str, key: str) -> None:
+        self.published += 1
+        self._deliver(topic, key)
+        try:
+            self._broadcast(topic, key)
+        except Exception as e:
+            self.failed += 1
+            print(f"Failed to broadcast the invalidation of {topic}/{key}: {e}")
+
+    def receive(self, topic: str, key: str) -> None:
+        """
+        Deliver a message published by another process.
+        """
+        self.received += 1
+        self._deliver(topic, key)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {"published": self.published, "received": self.received, "failed": self.failed}
+
+    def _deliver(self, topic: str, key: str) -> None:
+        for handler in self._handlers.get(topic, []):
+            try:
+                handler(key)
+            except Exception as e:
+                print(f"Invalidation handler of {topic} failed for {key}: {e}")
+
+    @abstractmethod
+    def _broadcast(self, topic: str, key: str) -> None:
+        pass
+
+class LocalInvalidationBus(InvalidationBus):
+    """
+    Only the caches of this process are invalidated.
+    """
+
+    def _broadcast(self, topic: str, key: str) -> None:
+        pass
+
+class UnixSocketInvalidationBus(InvalidationBus):
+    """
+    Broadcast between the worker processes of one host. Each worker binds a datagram socket
+    in `path` while it runs, and sends every invalidation to the sockets of the others:
+    delivery takes one system call per worker, with no broker to run. The socket of a
+    worker that died without removing it is removed by the next worker that fails to reach it.
+    """
+
+    def __init__(self, path: str = INVALIDATION_BUS_PATH):
+        super().__init__()
+        self.path = path
+        self._socket: Optional[socket.socket] = None
+        self._address: Optional[str] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self) -> None:
+        if self._socket is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self._address = os.path.join(self.path, f"{os.getpid()}-{uuid4().hex[:8]}.sock")
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.bind(self._address)
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._socket.fileno(), self._on_readable)
+
+    async def stop(self) -> None:
+        if self._socket is None:
+            return
+        self._loop.remove_reader(self._socket.fileno())
+        self._socket.close()
+        self._socket = None
+        try:
+            os.unlink(self._address)
+        except FileNotFoundError:
+            pass
+
+    def _on_readable(self) -> None:
+        while self._socket is not None:
+            try:
+                data = self._socket.recv(MAX_MESSAGE_BYTES)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                message = json.loads(data)
+                topic, key = message["topic"], message["key"]
+            except (ValueError, KeyError, TypeError):
+                print(f"Ignoring malformed invalidation message: {data[:100]!r}")
+                continue
+            self.receive(topic, key)
+
+    def _broadcast(self, topic: str, key: str) -> None:
+        # Before start (scripts, tools) there is nobody to tell
+        if self._socket is None:
+            return
+        data = json.dumps({"topic": topic, "key": key}).encode()
+        if len(data) > MAX_MESSAGE_BYTES:
+            raise ValueError("The invalidation message is too large.")
+        for name in os.listdir(self.path):
+            address = os.path.join(self.path, name)
+            if address == self._address or not name.endswith(".sock"):
+                continue
+            try:
+                self._socket.sendto(data, address)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nobody listens on it anymore
+                try:
+                    os.unlink(address)
+                except FileNotFoundError:
+                    pass
+            except (BlockingIOError, OSError) as e:
+                # The receive queue of that worker is full: its caches expire by themselves
+                self.failed += 1
+                print(f"Failed to send an invalidation to {name}: {e}")
+
+def create_invalidation_bus(kind: str = INVALIDATION_BUS) -> InvalidationBus:
+    """
+    :raises ValueError: If `kind` is not a known bus nor a "package.module:factory" path.
+    """
+    if kind == "local":
+        return LocalInvalidationBus()
+    if kind == "unix":
+        return UnixSocketInvalidationBus()
+    module_name, _, factory_name = kind.partition(":")
+    if not module_name or not factory_name:
+        raise ValueError("INVALIDATION_BUS must be 'local', 'unix' or 'package.module:factory'.")
+    # Imported lazily so that the client library of a networked bus is only needed when used
+    factory = getattr(importlib.import_module(module_name), factory_name)
+    return factory()
+
+invalidation_bus = create_invalidation_bus()
@@ -0,0 +1,108 @@
+import asyncio
+import os
+from typing import Dict, Optional, Set, Tuple
+from app.models.notification import Notification
+from app.schemas.notification import NotificationResponse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Notifications buffered per connection before it is considered too slow and closed
+NOTIFICATION_STREAM_QUEUE_SIZE = int(os.getenv("NOTIFICATION_STREAM_QUEUE_SIZE", "100"))
+# Open notification streams accepted by one worker
+NOTIFICATION_STREAM_MAX_CONNECTIONS = int(os.getenv("NOTIFICATION_STREAM_MAX_CONNECTIONS", "10000"))
+# Seconds between two heartbeats of an idle stream, keeps proxies from closing the connection
+NOTIFICATION_STREAM_HEARTBEAT_SECONDS = float(os.getenv("NOTIFICATION_STREAM_HEARTBEAT_SECONDS", "15"))
+
+def render_notification(notification: Notification) -> str:
+    """
+    JSON payload of a notification as sent to the streams.
+    """
+    return NotificationResponse.model_validate(notification, from_attributes=True).model_dump_json()
+
+class NotificationHubFull(Exception):
+    """
+    Raised when the worker already serves NOTIFICATION_STREAM_MAX_CONNECTIONS streams.
+    """
+
+class Subscription:
+    """
+    Bounded queue of the (cursor, notification id, payload) entries published to one open stream.
+    """
+
+    def __init__(self, user_id: str, queue_size: int):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[Tuple[str, str, str]]" = asyncio.Queue(maxsize=queue_size)
+        # Set when the client did not keep up; the stream is closed and the client resumes from its cursor
+        self.overflowed = False
+
+    async def get(self, timeout: float) -> Optional[Tuple[str, str, str]]:
+        """
+        Next published notification, or None if nothing was published within `timeout` seconds.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class NotificationHub:
+    """
+    In-process fan-out of new notifications to the open streams of their user.
+
+    An idle stream only costs a coroutine and an empty queue. Publishing never blocks:
+    a stream whose queue is full is flagged as overflowed and closed, and the client
+    reconnects with the cursor of the last notification it received.
+
+    Only the notifications created by this worker are published. With several workers
+    the hub must also be fed with the notifications written by the other ones.
+    """
+
+    def __init__(self, queue_size: int = NOTIFICATION_STREAM_QUEUE_SIZE, max_connections: int = NOTIFICATION_STREAM_MAX_CONNECTIONS):
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self.connections = 0
+        self.published = 0
+        self.overflows = 0
+
+    @property
+    def full(self) -> bool:
+        return self.connections >= self.max_connections
+
+    def subscribe(self, user_id: str) -> Subscription:
+        """
+        :raises NotificationHubFull: If the worker already serves `max_connections` streams.
+        """
+        if self.full:
+            raise NotificationHubFull("Too many open notification streams")
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        self.connections += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.user_id]
+        self.connections -= 1
+
+    def publish(self, user_id: str, cursor: str, notification: Notification) -> None:
+        subscriptions = self._subscriptions.get(user_id)
+        if not subscriptions:
+            return
+        # Serialized once and shared by all the streams of the user
+        entry = (cursor, notification.id, render_notification(notification))
+        for subscription in list(subscriptions):
+            if subscription.overflowed:
+                continue
+            try:
+                subscription.queue.put_nowait(entry)
+                self.published += 1
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                self.overflows += 1
+
+notification_hub = NotificationHub()
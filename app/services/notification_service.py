@@ -1,75 +1,314 @@
+import asyncio
+import os
 from app.models.notification import Notification
-from app.schemas.notification import NotificationCreate, NotificationUpdate
-from typing import List
+from app.models.outbox import OutboxMessage, OutboxRecipient
+from app.schemas.notification import NotificationBulkCreate, NotificationCreate, NotificationRecipientStatus, NotificationUpdate
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from pydantic import TypeAdapter
+from app.config.storage import get_repository
+from app.repositories.base import ItemNotFoundError, PreconditionFailedError, set_operations
+from app.services.email_dispatcher import EMAIL_BATCH_SIZE, email_dispatcher
+from app.services.notification_hub import notification_hub
+from app.services.training_service import training_conditions
 from app.services.user_service import UserService
-from app.config.database import database
-from azure.communication.email import EmailClient
-import os
 from uuid import uuid4
 from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Recipients accepted by one bulk request
+BULK_NOTIFICATION_MAX_RECIPIENTS = int(os.getenv("BULK_NOTIFICATION_MAX_RECIPIENTS", "10000"))
+# Writes in flight at the same time while creating the notifications of a bulk request
+BULK_NOTIFICATION_CONCURRENCY = int(os.getenv("BULK_NOTIFICATION_CONCURRENCY", "50"))
+# Read notifications are deleted this many seconds after being marked read (Cosmos TTL), 0 keeps them forever
+NOTIFICATION_READ_TTL_SECONDS = int(os.getenv("NOTIFICATION_READ_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Validate a whole list of stored documents in one call
+_notifications = TypeAdapter(List[Notification])
+
+def stream_cursor(document: Dict[str, Any]) -> str:
+    """
+    Position of a stored notification in the streams of its user: its created_at, with the
+    id to order the notifications created at the same instant.
+    """
+    return f"{document['created_at']}|{document['id']}"
 
 class NotificationService:
-    def __init__(self):
-        self.container = database.get_container_client("notifications")
-        self.user_service = UserService()
-        self.email_client = EmailClient.from_connection_string(
-            os.getenv("AZURE_COMMUNICATION_SERVICE_CONNECTION_STRING")
-        )
+    def __init__(self, user_service: Optional[UserService] = None):
+        self.user_service = user_service or UserService()
+        self.repository = get_repository("notifications")
+        self.outbox_repository = get_repository("outbox")
+        # Unread counter of every user, document id = user id
+        self.counter_repository = get_repository("notification_counters")
+
+    async def create_notification(self, notification: NotificationCreate) -> Notification:
+        # created_at lo asigna siempre el servidor: es el cursor de los streams (ver stream_cursor)
+        created_at = datetime.now(timezone.utc)
+        new_notification = self._new_notification(notification.user_id, notification.message, notification.read, created_at)
+        notification_data = self._to_document(new_notification)
+
+        await self.repository.create(notification_data)
+        if not new_notification.read:
+            await self._add_unread(new_notification.user_id, 1)
 
-    def send_email(self, to_email: str, subject: str, body: str):
-        email_message = {
-            "senderAddress": os.getenv("EMAIL_ADDRESS"),
-            "recipients": {
-                "to": [{"address": to_email}]
-            },
-            "content": {
-                "subject": subject,
-                "plainText": body
-            }
+        # El correo electrónico se envía en segundo plano desde el outbox
+        await self.outbox_repository.create(self._outbox_message(new_notification).model_dump())
+        email_dispatcher.notify()
+
+        # Push a las conexiones abiertas del usuario
+        notification_hub.publish(new_notification.user_id, stream_cursor(notification_data), new_notification)
+
+        return new_notification
+
+    async def create_notifications(self, bulk: NotificationBulkCreate) -> List[NotificationRecipientStatus]:
+        """
+        Send the same message to many users and report the outcome per recipient.
+
+        Recipient emails are resolved in batches and every recipient gets one notification,
+        in its own partition: they are written with up to BULK_NOTIFICATION_CONCURRENCY creates
+        in flight. The emails are queued in the outbox as one message per EMAIL_BATCH_SIZE
+        recipients, a batch of the dispatcher.
+
+        :raises ValueError: If there are more than BULK_NOTIFICATION_MAX_RECIPIENTS recipients.
+        """
+        recipients = await self._bulk_recipients(bulk)
+        if len(recipients) > BULK_NOTIFICATION_MAX_RECIPIENTS:
+            raise ValueError(f"A bulk notification cannot have more than {BULK_NOTIFICATION_MAX_RECIPIENTS} recipients")
+        emails = await self.user_service.get_emails(recipients)
+        results: Dict[str, NotificationRecipientStatus] = {
+            user_id: NotificationRecipientStatus(user_id=user_id, status="not_found", detail="User not found")
+            for user_id in recipients if user_id not in emails
         }
 
-        try:
-            poller = self.email_client.begin_send(email_message)
-            result = poller.result()
-            print("Email sent successfully:", result)
-        except Exception as e:
-            print(f"Failed to send email: {e}")
+        created_at = datetime.now(timezone.utc)
+        notifications = [self._new_notification(user_id, bulk.message, False, created_at) for user_id in recipients if user_id in emails]
+        semaphore = asyncio.Semaphore(BULK_NOTIFICATION_CONCURRENCY)
+
+        async def create(notification: Notification) -> None:
+            document = self._to_document(notification)
+            async with semaphore:
+                try:
+                    await self.repository.create(document)
+                except Exception as e:
+                    results[notification.user_id] = NotificationRecipientStatus(user_id=notification.user_id, status="failed", detail=str(e))
+                    return
+            results[notification.user_id] = NotificationRecipientStatus(user_id=notification.user_id, status="created", notification_id=notification.id)
+            notification_hub.publish(notification.user_id, stream_cursor(document), notification)
+
+        async def queue_emails(chunk: List[Notification]) -> None:
+            message = self._outbox_message(chunk[0])
+            message.recipients = [OutboxRecipient(notification_id=notification.id, user_id=notification.user_id) for notification in chunk]
+            async with semaphore:
+                try:
+                    await self.outbox_repository.create(message.model_dump())
+                except Exception as e:
+                    for notification in chunk:
+                        results[notification.user_id].detail = f"Email not queued: {e}"
+                    return
+            for notification in chunk:
+                results[notification.user_id].status = "queued"
+
+        await asyncio.gather(*(create(notification) for notification in notifications))
+        created = [notification for notification in notifications if results[notification.user_id].status == "created"]
+        await asyncio.gather(*(queue_emails(created[start:start + EMAIL_BATCH_SIZE]) for start in range(0, len(created), EMAIL_BATCH_SIZE)))
+
+        async def count_unread(user_id: str) -> None:
+            async with semaphore:
+                try:
+                    await self._add_unread(user_id, 1)
+                except Exception as e:
+                    # The notification is written and its email queued: report them anyway
+                    print(f"Failed to count the bulk notification of {user_id}: {e}")
+                    await self._drop_unread_counter(user_id)
+
+        await asyncio.gather(*(count_unread(notification.user_id) for notification in created))
+        email_dispatcher.notify()
+
+        return [results[user_id] for user_id in recipients]
 
-    def create_notification(self, notification: NotificationCreate) -> Notification:
-        # Mantener created_at como datetime (si no se proporciona, se asigna el tiempo actual)
-        created_at = notification.created_at or datetime.now(timezone.utc)
-        
-        new_notification = Notification(
+    async def _bulk_recipients(self, bulk: NotificationBulkCreate) -> List[str]:
+        if bulk.user_ids is not None:
+            return list(dict.fromkeys(bulk.user_ids))
+        # Members of the matching trainings, only their user_id is read
+        recipients: Dict[str, None] = {}
+        async for items in get_repository("trainings").iter_pages(training_conditions(bulk.trainings), fields=["user_id"]):
+            for item in items:
+                recipients.setdefault(item["user_id"], None)
+        return list(recipients)
+
+    def _new_notification(self, user_id: str, message: str, read: bool, created_at: datetime) -> Notification:
+        return Notification(
             id=str(uuid4()),  # Genera un ID único
-            user_id=notification.user_id,
-            message=notification.message,
-            read=notification.read,
-            created_at=created_at  # Se guarda como datetime
+            user_id=user_id,
+            message=message,
+            read=read,
+            created_at=created_at,  # Se guarda como datetime
+            delivery_status="pending"
         )
-        
+
+    def _to_document(self, notification: Notification) -> dict:
         # Convertir a diccionario y luego transformar el datetime a ISO solo para enviar a CosmosDB
-        notification_data = new_notification.model_dump(by_alias=True)
+        notification_data = notification.model_dump(by_alias=True)
         if isinstance(notification_data.get("created_at"), datetime):
             notification_data["created_at"] = notification_data["created_at"].isoformat()
-        
-        self.container.create_item(notification_data)
+        if notification.read and NOTIFICATION_READ_TTL_SECONDS > 0:
+            notification_data["ttl"] = NOTIFICATION_READ_TTL_SECONDS
+        return notification_data
 
-        # Enviar correo electrónico
-        user = self.user_service.get_user(notification.user_id) 
-        self.send_email(user.email, "New Notification", notification.message)
+    def _outbox_message(self, notification: Notification) -> OutboxMessage:
+        return OutboxMessage(
+            id=str(uuid4()),
+            notification_id=notification.id,
+            user_id=notification.user_id,
+            subject="New Notification",
+            body=notification.message
+        )
 
-        return new_notification
+    async def get_notifications(self, user_id: str, documents: bool = False) -> List[Union[Notification, Dict[str, Any]]]:
+        """
+        With `documents`, the stored documents are returned as dicts instead of models.
+        """
+        # Notifications are partitioned by user_id, listing them is a single-partition query
+        items = [item async for item in self.repository.query(partition_key=user_id)]
+        return items if documents else _notifications.validate_python(items)
+
+    async def get_notifications_page(
+        self, user_id: str, page_size: int, continuation: Optional[str] = None, documents: bool = False
+    ) -> Tuple[List[Union[Notification, Dict[str, Any]]], Optional[str]]:
+        items, continuation = await self.repository.query_page(partition_key=user_id, page_size=page_size, continuation=continuation)
+        return (items if documents else _notifications.validate_python(items)), continuation
+
+    async def stream_notifications(
+        self, user_id: str, page_size: int = 100, continuation: Optional[str] = None, documents: bool = False
+    ) -> AsyncIterator[Union[Notification, Dict[str, Any]]]:
+        async for items in self.repository.iter_pages(partition_key=user_id, page_size=page_size, continuation=continuation):
+            for item in (items if documents else _notifications.validate_python(items)):
+                yield item
+
+    async def get_notifications_since(self, user_id: str, cursor: str) -> AsyncIterator[Tuple[str, Notification]]:
+        """
+        Notifications of the user after `cursor` (the stream_cursor of the last notification a
+        stream delivered), oldest first, with their own cursor. A cursor without an id (a bare
+        created_at) resumes with every notification of that instant.
+        """
+        created_at, _, last_id = cursor.rpartition("|") if "|" in cursor else (cursor, "", "")
+        order_by = [("created_at", "ASC"), ("id", "ASC")]
+        async for items in self.repository.iter_pages([("created_at", ">=", created_at)], partition_key=user_id, order_by=order_by):
+            for item in items:
+                # Created at the same instant, at or before the cursor in id order
+                if item["created_at"] == created_at and item["id"] <= last_id:
+                    continue
+                yield stream_cursor(item), Notification(**item)
+
+    async def get_notification(self, notification_id: str, user_id: str) -> Notification:
+        """
+        Point read of a notification in the partition of its user.
+
+        :raises ItemNotFoundError: If the user has no such notification.
+        """
+        item = await self.repository.read(notification_id, user_id)
+        return Notification(**item)
+
+    async def update_notification(self, notification_id: str, user_id: str, notification: NotificationUpdate, if_match: Optional[str] = None) -> Notification:
+        """
+        Patch the fields that were sent, in a single round-trip. Changing `read` reads the
+        notification first, to keep the unread counter and the retention of read notifications in step.
 
-    def get_notifications(self, user_id: str) -> List[Notification]:
-        query = f"SELECT * FROM notifications n WHERE n.user_id = '{user_id}'"
-        items = list(self.container.query_items(query, enable_cross_partition_query=True))
-        return [Notification(**item) for item in items]
+        :raises ValueError: If the update tries to move the notification to another user.
+        :raises ItemNotFoundError: If the user has no such notification.
+        :raises PreconditionFailedError: If the notification was modified since `if_match` was read.
+        """
+        changes = notification.dict(exclude_unset=True, exclude_none=True)
+        if changes.pop("user_id", user_id) != user_id:
+            raise ValueError("A notification cannot be moved to another user.")
+        if not changes:
+            return await self.get_notification(notification_id, user_id)
+        if "read" not in changes:
+            item = await self.repository.patch(notification_id, user_id, set_operations(changes), if_match=if_match)
+            return Notification(**item)
 
-    def update_notification(self, notification_id: str, notification: NotificationUpdate) -> Notification:
-        item = self.container.read_item(item=notification_id, partition_key=notification_id)
-        updated_notification = Notification(**{**item, **notification.dict(exclude_unset=True)})
-        self.container.replace_item(item=notification_id, body=updated_notification.dict(by_alias=True))
-        return updated_notification
+        item = await self.repository.read(notification_id, user_id)
+        if if_match is not None and item["_etag"] != if_match:
+            raise PreconditionFailedError(f"Notification {notification_id} was modified")
+        was_read = item.get("read", False)
+        item = await self.repository.patch(notification_id, user_id, set_operations({**changes, **self._retention(changes["read"])}), if_match=item["_etag"])
+        if changes["read"] != was_read:
+            await self._add_unread(user_id, -1 if changes["read"] else 1)
+        return Notification(**item)
+
+    async def delete_notification(self, notification_id: str, user_id: str) -> None:
+        item = await self.repository.read(notification_id, user_id)
+        await self.repository.delete(notification_id, user_id)
+        if not item.get("read", False):
+            await self._add_unread(user_id, -1)
+
+    async def mark_all_read(self, user_id: str) -> int:
+        """
+        Mark every unread notification of the user as read and return how many were marked.
+        Each one is patched with the ETag it was listed with, so that a notification marked
+        read concurrently is not counted twice.
+        """
+        unread = []
+        async for items in self.repository.iter_pages([("read", "=", False)], partition_key=user_id, fields=["_etag"]):
+            unread.extend(items)
+        semaphore = asyncio.Semaphore(BULK_NOTIFICATION_CONCURRENCY)
+        operations = set_operations({"read": True, **self._retention(True)})
+
+        async def mark(item: dict) -> bool:
+            async with semaphore:
+                try:
+                    await self.repository.patch(item["id"], user_id, operations, if_match=item["_etag"])
+                    return True
+                except (ItemNotFoundError, PreconditionFailedError):
+                    return False
+
+        marked = sum(await asyncio.gather(*(mark(item) for item in unread)))
+        if marked:
+            await self._add_unread(user_id, -marked)
+        return marked
+
+    async def get_unread_count(self, user_id: str, refresh: bool = False) -> int:
+        """
+        Unread notifications of the user, from the counter maintained on every write (a
+        single point read). `refresh` recounts them from the notifications and stores the
+        result, for counters that drifted after a failed write.
+        """
+        if not refresh:
+            try:
+                item = await self.counter_repository.read(user_id, user_id)
+                return max(0, item["unread"])
+            except ItemNotFoundError:
+                pass
+        return await self._recount_unread(user_id)
+
+    async def _recount_unread(self, user_id: str) -> int:
+        unread = 0
+        async for items in self.repository.iter_pages([("read", "=", False)], partition_key=user_id, fields=["id"]):
+            unread += len(items)
+        await self.counter_repository.upsert({"id": user_id, "unread": unread})
+        return unread
+
+    async def _add_unread(self, user_id: str, delta: int) -> None:
+        try:
+            await self.counter_repository.patch(user_id, user_id, [{"op": "incr", "path": "/unread", "value": delta}])
+        except ItemNotFoundError:
+            # First counted write of the user (or a counter lost): start from the actual count
+            await self._recount_unread(user_id)
+
+    async def _drop_unread_counter(self, user_id: str) -> None:
+        """
+        Delete a counter that missed an update, so that the next read recounts it.
+        """
+        try:
+            await self.counter_repository.delete(user_id, user_id)
+        except ItemNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Failed to drop the unread counter of {user_id}, refresh it with refresh=true: {e}")
 
-    def delete_notification(self, notification_id: str) -> None:
-        self.container.delete_item(item=notification_id, partition_key=notification_id)
+    def _retention(self, read: bool) -> dict:
+        # Read notifications expire after NOTIFICATION_READ_TTL_SECONDS, unread ones never do (ttl -1)
+        if NOTIFICATION_READ_TTL_SECONDS <= 0:
+            return {}
+        return {"ttl": NOTIFICATION_READ_TTL_SECONDS if read else -1}
@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Number of worker processes dedicated to bcrypt and how many extra operations may wait
+# for a worker before new ones are rejected.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+# bcrypt cost. Hashes created with a different cost are transparently rehashed on login.
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=PASSWORD_BCRYPT_ROUNDS,
+)
+
+def _hash(secret: str) -> str:
+    return pwd_context.hash(secret)
+
+def _verify_and_update(secret: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(secret, hashed)
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when the password hashing pool has no room for another operation.
+    """
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a dedicated process pool so that a burst
+    of logins does not starve the request threadpool or the event loop.
+
+    At most `workers + queue_limit` operations are admitted at a time; beyond that
+    PasswordHasherBusy is raised so the caller can shed load.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                self.rejected += 1
+                raise PasswordHasherBusy("Too many password operations in progress, try again later.")
+            if self._executor is None:
+                # spawn keeps the workers independent from the threads of the server process
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def hash(self, secret: str) -> str:
+        return await asyncio.wrap_future(self._submit(_hash, secret))
+
+    async def verify_and_update(self, secret: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password. When the hash was created with outdated parameters, the new
+        hash is returned as the second element so the caller can persist it.
+        """
+        return await asyncio.wrap_future(self._submit(_verify_and_update, secret, hashed))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher()
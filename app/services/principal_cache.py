@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from app.models.user import User
+from app.services.invalidation_bus import invalidation_bus
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Maximum number of principals kept in memory and how long (in seconds) a cached
+# principal may be served before it has to be read again from the database.
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_MAX_STALENESS = float(os.environ.get("AUTH_PRINCIPAL_CACHE_MAX_STALENESS", "60"))
+
+class PrincipalCache:
+    """
+    Bounded TTL/LRU cache of authenticated users keyed by the token subject.
+
+    Entries expire after `max_staleness` seconds and the least recently used entry
+    is evicted once `max_size` is reached. Writes to a user must publish its id on the
+    "users" topic of app.services.invalidation_bus, which calls `invalidate_user` in every
+    worker, so that changed roles or deleted accounts are not served.
+    """
+
+    def __init__(self, max_size: int = PRINCIPAL_CACHE_SIZE, max_staleness: float = PRINCIPAL_CACHE_MAX_STALENESS):
+        self.max_size = max_size
+        self.max_staleness = max_staleness
+        self._entries: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+        self._subjects_by_user_id: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, see set()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.max_staleness > 0
+
+    def get(self, subject: str) -> Optional[User]:
+        """
+        Return the cached user for the subject, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, user = entry
+            if expires_at <= time.monotonic():
+                self._remove(subject)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return user
+
+    def set(self, subject: str, user: User, generation: Optional[int] = None) -> None:
+        """
+        :param generation: The `generation` read before the user was loaded: the user is not
+            cached if an invalidation happened meanwhile, as it may predate the write.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(subject)
+            self._entries[subject] = (time.monotonic() + self.max_staleness, user)
+            self._subjects_by_user_id[user.id] = subject
+            while len(self._entries) > self.max_size:
+                oldest_subject = next(iter(self._entries))
+                self._remove(oldest_subject)
+                self.evictions += 1
+
+    def invalidate(self, subject: str) -> None:
+        with self._lock:
+            self.generation += 1
+            if self._remove(subject):
+                self.invalidations += 1
+
+    def invalidate_user(self, user_id: str) -> None:
+        """
+        Drop the cached principal for a user id, whatever subject it was cached under.
+        """
+        with self._lock:
+            self.generation += 1
+            subject = self._subjects_by_user_id.get(user_id)
+            if subject is not None and self._remove(subject):
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._subjects_by_user_id.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, subject: str) -> bool:
+        entry = self._entries.pop(subject, None)
+        if entry is None:
+            return False
+        user = entry[1]
+        if self._subjects_by_user_id.get(user.id) == subject:
+            del self._subjects_by_user_id[user.id]
+        return True
+
+principal_cache = PrincipalCache()
+
+invalidation_bus.subscribe("users", principal_cache.invalidate_user)
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set, Tuple
+from app.services.invalidation_bus import invalidation_bus
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Seconds a cached read is served as is, then how many more seconds it may still be served
+# while it is refreshed in the background (stale-while-revalidate). Writes invalidate the cache
+# through app.services.invalidation_bus; with the "local" bus, the writes of other workers are
+# only seen after READ_CACHE_FRESH_SECONDS.
+READ_CACHE_FRESH_SECONDS = float(os.getenv("READ_CACHE_FRESH_SECONDS", "1"))
+READ_CACHE_STALE_SECONDS = float(os.getenv("READ_CACHE_STALE_SECONDS", "10"))
+# Documents kept by each cache: a point read counts for one, a query for the documents it returned
+READ_CACHE_MAX_DOCUMENTS = int(os.getenv("READ_CACHE_MAX_DOCUMENTS", "50000"))
+
+Loader = Callable[[], Awaitable[Any]]
+
+class ReadCache:
+    """
+    Cache of the reads of one container: point reads keyed by document id and queries keyed
+    by their conditions and projection. A write to a document invalidates its point read and
+    every cached query, since any of them may match the document.
+
+    Concurrent identical reads are coalesced into a single call to the database (single
+    flight). A fresh entry is returned as is; a stale one is returned while one background
+    refresh replaces it; an entry older than that is loaded again. Entries are evicted least
+    recently used first once `max_documents` is reached.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_documents: int = READ_CACHE_MAX_DOCUMENTS,
+        fresh_seconds: float = READ_CACHE_FRESH_SECONDS,
+        stale_seconds: float = READ_CACHE_STALE_SECONDS,
+    ):
+        self.name = name
+        self.max_documents = max_documents
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        # key -> (loaded at, value, documents)
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any, int]]" = OrderedDict()
+        self._documents = 0
+        self._query_keys: Set[Tuple] = set()
+        self._loading: Dict[Tuple, asyncio.Task] = {}
+        # Background refreshes no caller has joined: nobody else sees their errors
+        self._unawaited: Set[asyncio.Task] = set()
+        # Bumped by every invalidation: loads started before it are not stored
+        self._generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_documents > 0
+
+    async def read(self, document_id: str, loader: Loader) -> Any:
+        return await self._get(("document", document_id), loader)
+
+    async def query(self, key: Hashable, loader: Loader) -> Any:
+        """
+        :param key: Identifies the query: its conditions, projection...
+        """
+        return await self._get(("query", key), loader)
+
+    def invalidate(self, document_id: str) -> None:
+        """
+        Drop the point read of a document and every cached query. Called after each write.
+        """
+        self._generation += 1
+        self.invalidations += 1
+        self._remove(("document", document_id))
+        for key in list(self._query_keys):
+            self._remove(key)
+        # Reads already in flight may not see the write, later ones must not join them
+        self._loading.pop(("document", document_id), None)
+        for key in [key for key in self._loading if key[0] == "query"]:
+            del self._loading[key]
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+        self._query_keys.clear()
+        self._documents = 0
+        self._loading.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "documents": self._documents,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    async def _get(self, key: Tuple, loader: Loader) -> Any:
+        if not self.enabled:
+            return await loader()
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.fresh_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if age < self.fresh_seconds + self.stale_seconds:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._loading:
+                    self.refreshes += 1
+                    self._unawaited.add(self._load(key, loader))
+                return entry[1]
+        self.misses += 1
+        task = self._loading.get(key)
+        if task is None:
+            task = self._load(key, loader)
+        else:
+            self.coalesced += 1
+            self._unawaited.discard(task)
+        # A caller that goes away does not cancel the read the others are waiting for
+        return await asyncio.shield(task)
+
+    def _load(self, key: Tuple, loader: Loader) -> asyncio.Task:
+        task = asyncio.ensure_future(self._fetch(key, loader, self._generation))
+        self._loading[key] = task
+
+        def done(finished: asyncio.Task) -> None:
+            if self._loading.get(key) is finished:
+                del self._loading[key]
+            error = None if finished.cancelled() else finished.exception()
+            # The callers of a load get its error; a background refresh nobody joined has no caller
+            if error is not None and finished in self._unawaited:
+                print(f"Read cache {self.name}: failed to refresh {key}: {error}")
+            self._unawaited.discard(finished)
+
+        task.add_done_callback(done)
+        return task
+
+    async def _fetch(self, key: Tuple, loader: Loader, generation: int) -> Any:
+        value = await loader()
+        if generation == self._generation:
+            self._store(key, value)
+        return value
+
+    def _store(self, key: Tuple, value: Any) -> None:
+        documents = max(len(value), 1) if isinstance(value, list) else 1
+        if documents > self.max_documents:
+            return
+        self._remove(key)
+        self._entries[key] = (time.monotonic(), value, documents)
+        self._documents += documents
+        if key[0] == "query":
+            self._query_keys.add(key)
+        while self._documents > self.max_documents:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Tuple) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._documents -= entry[2]
+        self._query_keys.discard(key)
+        return True
+
+training_cache = ReadCache("trainings")
+availability_cache = ReadCache("availabilities")
+
+invalidation_bus.subscribe("trainings", training_cache.invalidate)
+invalidation_bus.subscribe("availabilities", availability_cache.invalidate)
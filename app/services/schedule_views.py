@@ -0,0 +1,323 @@
+"""
+Materialized schedule views, maintained from the change feed of the trainings and
+availabilities containers.
+
+Every training is copied into the day of its trainer (trainer_schedules, partitioned by
+trainer_id) and the day of its member (member_schedules, partitioned by user_id), and every
+available slot into the day of its trainer. The id of a day document is the day itself, so
+a week of schedule is 7 point reads instead of a cross-partition scan of the trainings.
+
+By default the processor runs as an asyncio task inside the API process
+(SCHEDULE_VIEWS_MODE=inprocess). With several API workers set SCHEDULE_VIEWS_MODE=worker and
+run the processor on its own; several processors may run, each source container is leased
+to one of them at a time and its position in the change feed is checkpointed in the lease:
+
+    python -m app.services.schedule_views
+
+To drop the views and build them again from the beginning of the change feed:
+
+    python -m app.services.schedule_views rebuild
+"""
+import asyncio
+import os
+import socket
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+from pydantic import TypeAdapter
+from app.config.storage import get_repository
+from app.repositories.base import ItemExistsError, ItemNotFoundError, PreconditionFailedError, set_operations
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCHEDULE_VIEWS_MODE = os.getenv("SCHEDULE_VIEWS_MODE", "inprocess").lower()
+SCHEDULE_VIEWS_POLL_SECONDS = float(os.getenv("SCHEDULE_VIEWS_POLL_SECONDS", "1"))
+SCHEDULE_VIEWS_PAGE_SIZE = int(os.getenv("SCHEDULE_VIEWS_PAGE_SIZE", "100"))
+# A processor that did not renew its lease for this long is considered gone
+SCHEDULE_VIEWS_LEASE_SECONDS = float(os.getenv("SCHEDULE_VIEWS_LEASE_SECONDS", "30"))
+# Tombstones of deleted trainings and availabilities, must outlast the lag of the processor
+SCHEDULE_TOMBSTONE_TTL_SECONDS = int(os.getenv("SCHEDULE_TOMBSTONE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+if SCHEDULE_VIEWS_MODE not in ("inprocess", "worker"):
+    raise ValueError("SCHEDULE_VIEWS_MODE must be either 'inprocess' or 'worker'.")
+
+# A view document: (container, partition key, day)
+ViewKey = Tuple[str, str, str]
+
+_datetime = TypeAdapter(datetime)
+
+def _day(value) -> str:
+    value = _datetime.validate_python(value)
+    value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+    return value.date().isoformat()
+
+def training_placements(item: Dict[str, Any]) -> Dict[ViewKey, List[Dict[str, Any]]]:
+    entry = {field: item.get(field) for field in ("id", "trainer_id", "user_id", "center_id", "start_time", "end_time", "status")}
+    day = _day(item["start_time"])
+    return {
+        ("trainer_schedules", item["trainer_id"], day): [entry],
+        ("member_schedules", item["user_id"], day): [entry],
+    }
+
+def availability_placements(item: Dict[str, Any]) -> Dict[ViewKey, List[Dict[str, Any]]]:
+    placements: Dict[ViewKey, List[Dict[str, Any]]] = {}
+    for start_time in item.get("available_times", []):
+        key = ("trainer_schedules", item["trainer_id"], _day(start_time))
+        placements.setdefault(key, []).append({"availability_id": item["id"], "center_id": item["center_id"], "start_time": start_time})
+    return placements
+
+# Source container -> (placements of a document, list of the day document, id property of its entries)
+SOURCES: Dict[str, Tuple[Callable[[Dict[str, Any]], Dict[ViewKey, List[Dict[str, Any]]]], str, str]] = {
+    "trainings": (training_placements, "trainings", "id"),
+    "availabilities": (availability_placements, "slots", "availability_id"),
+}
+
+# View container -> property holding its partition key
+VIEWS = {"trainer_schedules": "trainer_id", "member_schedules": "user_id"}
+
+class ScheduleViews:
+    """
+    Change feed processor of the schedule views, and their reads.
+
+    The change feed only carries the last version of the documents, so the view documents a
+    source document was copied into are recorded in schedule_sources, to remove it from its
+    previous days when it moves. Deletions are not in the change feed either: TrainingService
+    calls `remove` when it deletes, which leaves a tombstone there so that a late change of
+    the deleted document is not applied again.
+    """
+
+    def __init__(self, page_size: int = SCHEDULE_VIEWS_PAGE_SIZE, poll_interval: float = SCHEDULE_VIEWS_POLL_SECONDS, lease_duration: float = SCHEDULE_VIEWS_LEASE_SECONDS):
+        self.page_size = page_size
+        self.poll_interval = poll_interval
+        self.lease_duration = lease_duration
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+        self.applied = 0
+
+    @property
+    def source_repository(self):
+        return get_repository("schedule_sources")
+
+    @property
+    def lease_repository(self):
+        return get_repository("leases")
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await self.process_once()
+            except Exception as e:
+                print(f"Schedule views processor failed: {e}")
+                processed = 0
+            if not processed:
+                await asyncio.sleep(self.poll_interval)
+
+    async def process_once(self) -> int:
+        """
+        Apply one page of changes of every source container leased to this processor and
+        return how many changes were applied.
+        """
+        processed = 0
+        for source in SOURCES:
+            lease = await self._acquire_lease(source)
+            if lease is None:
+                continue
+            items, continuation = await get_repository(source).read_change_feed(lease.get("continuation"), self.page_size)
+            for item in items:
+                await self.apply(source, item)
+            processed += len(items)
+            if continuation != lease.get("continuation") or lease["expires_at"] - time.time() < self.lease_duration / 2:
+                await self._checkpoint(lease, continuation)
+        return processed
+
+    async def catch_up(self) -> int:
+        """
+        Process the change feeds until there is nothing left, return how many changes were applied.
+        """
+        total = 0
+        while True:
+            processed = await self.process_once()
+            if not processed:
+                return total
+            total += processed
+
+    async def rebuild(self) -> int:
+        """
+        Drop the views and build them again from the beginning of the change feeds. Other
+        processors are kept out by taking over the leases, reads see partial views meanwhile.
+        """
+        for source in SOURCES:
+            await self.lease_repository.upsert({"id": self._lease_id(source), "owner": self.owner, "expires_at": time.time() + self.lease_duration, "continuation": None})
+        for name, partition_field in [*VIEWS.items(), ("schedule_sources", "id")]:
+            repository = get_repository(name)
+            items = []
+            async for page in repository.iter_pages(fields=[partition_field]):
+                items.extend(page)
+            for item in items:
+                try:
+                    await repository.delete(item["id"], item[partition_field])
+                except ItemNotFoundError:
+                    pass
+        return await self.catch_up()
+
+    async def apply(self, source: str, item: Dict[str, Any]) -> None:
+        """
+        Copy the current version of a source document into the view documents of its days.
+        Applying the same change twice is harmless.
+        """
+        placements, list_name, id_field = SOURCES[source]
+        new_placements = placements(item)
+        record_id = f"{source}:{item['id']}"
+        while True:
+            record = await self._read_record(record_id)
+            if record is not None and record.get("deleted"):
+                # Deleted since this change was written: make sure it is not left in a view
+                for key in new_placements:
+                    await self._update_view(key, list_name, id_field, item["id"], [])
+                return
+            previous = {tuple(key) for key in record["keys"]} if record else set()
+            for key in previous - set(new_placements):
+                await self._update_view(key, list_name, id_field, item["id"], [])
+            for key, entries in new_placements.items():
+                await self._update_view(key, list_name, id_field, item["id"], entries)
+            if await self._write_record(record, record_id, {"keys": [list(key) for key in sorted(new_placements)]}):
+                self.applied += 1
+                return
+
+    async def remove(self, source: str, source_id: str) -> None:
+        """
+        Remove a deleted source document from the views and leave its tombstone.
+        """
+        _, list_name, id_field = SOURCES[source]
+        record_id = f"{source}:{source_id}"
+        while True:
+            record = await self._read_record(record_id)
+            if await self._write_record(record, record_id, {"keys": [], "deleted": True, "ttl": SCHEDULE_TOMBSTONE_TTL_SECONDS}):
+                break
+        for key in record["keys"] if record else []:
+            await self._update_view(tuple(key), list_name, id_field, source_id, [])
+
+    async def get_days(self, view: str, owner_id: str, start: date, days: int) -> List[Dict[str, Any]]:
+        """
+        The day documents of a trainer (view "trainer_schedules") or a member ("member_schedules")
+        from `start`, one point read per day. Days without a document are empty.
+        """
+        repository = get_repository(view)
+
+        async def read(day: str) -> Dict[str, Any]:
+            try:
+                return await repository.read(day, owner_id)
+            except ItemNotFoundError:
+                return {"day": day}
+
+        return await asyncio.gather(*(read((start + timedelta(days=offset)).isoformat()) for offset in range(days)))
+
+    async def _read_record(self, record_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.source_repository.read(record_id, record_id)
+        except ItemNotFoundError:
+            return None
+
+    async def _write_record(self, record: Optional[Dict[str, Any]], record_id: str, values: Dict[str, Any]) -> bool:
+        # Conditional on the version read, returns False when the record changed meanwhile
+        try:
+            if record is None:
+                await self.source_repository.create({"id": record_id, **values})
+            else:
+                await self.source_repository.patch(record_id, record_id, set_operations(values), if_match=record["_etag"])
+            return True
+        except (ItemExistsError, ItemNotFoundError, PreconditionFailedError):
+            return False
+
+    async def _update_view(self, key: ViewKey, list_name: str, id_field: str, source_id: str, entries: List[Dict[str, Any]]) -> None:
+        # Replace the entries of the source document in a day, conditional on the ETag of the day read
+        view, owner_id, day = key
+        repository = get_repository(view)
+        while True:
+            try:
+                document = await repository.read(day, owner_id)
+            except ItemNotFoundError:
+                document = None
+            if document is None and not entries:
+                return
+            kept = [entry for entry in (document or {}).get(list_name, []) if entry[id_field] != source_id]
+            merged = sorted(kept + entries, key=lambda entry: _datetime.validate_python(entry["start_time"]))
+            try:
+                if document is None:
+                    await repository.create({"id": day, VIEWS[view]: owner_id, "day": day, list_name: merged})
+                else:
+                    await repository.patch(day, owner_id, [{"op": "set", "path": f"/{list_name}", "value": merged}], if_match=document["_etag"])
+                return
+            except (ItemExistsError, ItemNotFoundError, PreconditionFailedError):
+                continue
+
+    @staticmethod
+    def _lease_id(source: str) -> str:
+        return f"schedule_views:{source}"
+
+    async def _acquire_lease(self, source: str) -> Optional[Dict[str, Any]]:
+        """
+        The lease of the source container if this processor holds it or could take it over.
+        """
+        lease_id = self._lease_id(source)
+        now = time.time()
+        try:
+            lease = await self.lease_repository.read(lease_id, lease_id)
+        except ItemNotFoundError:
+            try:
+                return await self.lease_repository.create({"id": lease_id, "owner": self.owner, "expires_at": now + self.lease_duration, "continuation": None})
+            except ItemExistsError:
+                return None
+        if lease["owner"] == self.owner:
+            return lease
+        if lease["expires_at"] > now:
+            return None
+        try:
+            return await self.lease_repository.patch(lease_id, lease_id, set_operations({"owner": self.owner, "expires_at": now + self.lease_duration}), if_match=lease["_etag"])
+        except PreconditionFailedError:
+            return None
+
+    async def _checkpoint(self, lease: Dict[str, Any], continuation: Optional[str]) -> None:
+        try:
+            await self.lease_repository.patch(
+                lease["id"], lease["id"],
+                set_operations({"continuation": continuation, "expires_at": time.time() + self.lease_duration}),
+                if_match=lease["_etag"],
+            )
+        except PreconditionFailedError:
+            # Another processor took the lease over, it resumes from the previous checkpoint
+            print(f"Schedule views processor lost the lease {lease['id']}")
+
+schedule_views = ScheduleViews()
+
+async def _run_worker(command: str) -> None:
+    from app.config.storage import open_storage, close_storage
+
+    await open_storage()
+    try:
+        if command == "rebuild":
+            print(f"Rebuilt the schedule views from {await schedule_views.rebuild()} changes")
+        else:
+            await schedule_views.start()
+            await asyncio.Event().wait()
+    finally:
+        await schedule_views.stop()
+        await close_storage()
+
+if __name__ == "__main__":
+    asyncio.run(_run_worker(sys.argv[1] if len(sys.argv) > 1 else "run"))
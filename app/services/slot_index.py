@@ -0,0 +1,282 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from pydantic import TypeAdapter
+from app.config.storage import get_repository
+from app.models.training import Availability, Training
+from app.repositories.base import ItemNotFoundError
+from app.schemas.training import FreeSlot
+from app.services.invalidation_bus import invalidation_bus
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Length of the slot that starts at each of the available_times of an availability
+SLOT_DURATION_MINUTES = int(os.getenv("SLOT_DURATION_MINUTES", "60"))
+# The index is rebuilt from the database after this many seconds. The writes of this worker
+# are applied incrementally and the ones of other workers are reloaded when they are received
+# from app.services.invalidation_bus; the rebuild catches up with the messages that were lost
+# (and, with the "local" bus, with every write of the other workers).
+SLOT_INDEX_REFRESH_SECONDS = float(os.getenv("SLOT_INDEX_REFRESH_SECONDS", "300"))
+
+# Trainings with these statuses do not occupy their trainer
+CANCELLED_STATUSES = ("cancelled", "canceled")
+
+_datetime = TypeAdapter(datetime)
+
+def _utc(value) -> datetime:
+    value = _datetime.validate_python(value)
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+class SlotIndex:
+    """
+    In-process index of the free training slots, built from the availabilities and the
+    booked trainings.
+
+    Slots are kept in lists sorted by start time, per trainer and per center, and the
+    bookings of every trainer in a list sorted by start time, so that searches are a
+    bisection followed by a walk over the matching entries only. TrainingService keeps the
+    index up to date on every write, the writes published on the invalidation bus are
+    reloaded from the database, and the whole index is rebuilt every `refresh_interval` seconds.
+    """
+
+    def __init__(self, slot_duration: timedelta = timedelta(minutes=SLOT_DURATION_MINUTES), refresh_interval: float = SLOT_INDEX_REFRESH_SECONDS):
+        self.slot_duration = slot_duration
+        self.refresh_interval = refresh_interval
+        self._loaded_at: Optional[float] = None
+        self._load_lock: Optional[asyncio.Lock] = None
+        # (container, id) being reloaded -> whether another message arrived meanwhile
+        self._reloads: Dict[Tuple[str, str], bool] = {}
+        # Messages received while the index is rebuilt, reloaded once it is
+        self._rebuilding = False
+        self._missed: Set[Tuple[str, str]] = set()
+        self._reset()
+
+    def _reset(self) -> None:
+        # availability id -> (trainer_id, center_id, slot starts)
+        self._availabilities: Dict[str, Tuple[str, str, List[datetime]]] = {}
+        # trainer_id -> sorted [(start, center_id)] and center_id -> sorted [(start, trainer_id)]
+        self._slots_by_trainer: Dict[str, List[Tuple[datetime, str]]] = {}
+        self._slots_by_center: Dict[str, List[Tuple[datetime, str]]] = {}
+        # training id -> (trainer_id, start, end) and trainer_id -> sorted [(start, end, training id)]
+        self._trainings: Dict[str, Tuple[str, datetime, datetime]] = {}
+        self._bookings_by_trainer: Dict[str, List[Tuple[datetime, datetime, str]]] = {}
+        # Longest booking of every trainer, bounds how far back an overlapping booking can start
+        self._longest_booking: Dict[str, timedelta] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    async def ensure_loaded(self) -> None:
+        """
+        Build the index on first use and rebuild it once it is older than `refresh_interval`.
+        """
+        if self.loaded and time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if self.loaded and time.monotonic() - self._loaded_at < self.refresh_interval:
+                return
+            await self.rebuild()
+
+    async def rebuild(self) -> None:
+        self._rebuilding = True
+        try:
+            availabilities = []
+            async for items in get_repository("availabilities").iter_pages(fields=["trainer_id", "center_id", "available_times"]):
+                availabilities.extend(items)
+            trainings = []
+            async for items in get_repository("trainings").iter_pages(fields=["trainer_id", "start_time", "end_time", "status"]):
+                trainings.extend(items)
+
+            self._reset()
+            for item in availabilities:
+                self._add_availability(item["id"], item["trainer_id"], item["center_id"], item.get("available_times", []))
+            for item in trainings:
+                self._add_training(item["id"], item["trainer_id"], item["start_time"], item["end_time"], item.get("status"))
+            self._loaded_at = time.monotonic()
+        finally:
+            self._rebuilding = False
+        # The pages may have been read before these writes
+        missed, self._missed = self._missed, set()
+        for container, document_id in missed:
+            self._schedule_reload(container, document_id)
+
+    def invalidate_training(self, training_id: str) -> None:
+        """
+        Reload a training written by any worker, in the background.
+        """
+        self._schedule_reload("trainings", training_id)
+
+    def invalidate_availability(self, availability_id: str) -> None:
+        """
+        Reload an availability written by any worker, in the background.
+        """
+        self._schedule_reload("availabilities", availability_id)
+
+    def _schedule_reload(self, container: str, document_id: str) -> None:
+        key = (container, document_id)
+        if self._rebuilding:
+            self._missed.add(key)
+            return
+        # Not built yet: it will be read when it is
+        if not self.loaded:
+            return
+        if key in self._reloads:
+            # Read again once the read in flight is applied, which may predate this write
+            self._reloads[key] = True
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._reloads[key] = False
+        loop.create_task(self._reload(container, document_id))
+
+    async def _reload(self, container: str, document_id: str) -> None:
+        key = (container, document_id)
+        try:
+            while True:
+                self._reloads[key] = False
+                try:
+                    item = await get_repository(container).read(document_id, document_id)
+                except ItemNotFoundError:
+                    item = None
+                if self._rebuilding:
+                    # Applied after the rebuild, which may have read it before this write
+                    self._missed.add(key)
+                    return
+                if container == "trainings":
+                    self.remove_training(document_id)
+                    if item is not None:
+                        self._add_training(document_id, item["trainer_id"], item["start_time"], item["end_time"], item.get("status"))
+                else:
+                    self.remove_availability(document_id)
+                    if item is not None:
+                        self._add_availability(document_id, item["trainer_id"], item["center_id"], item.get("available_times", []))
+                if not self._reloads[key]:
+                    return
+        except Exception as e:
+            # The next rebuild picks it up
+            print(f"Failed to reload {container}/{document_id} into the slot index: {e}")
+        finally:
+            del self._reloads[key]
+
+    def put_availability(self, availability: Availability) -> None:
+        if self.loaded:
+            self.remove_availability(availability.id)
+            self._add_availability(availability.id, availability.trainer_id, availability.center_id, availability.available_times)
+
+    def remove_availability(self, availability_id: str) -> None:
+        entry = self._availabilities.pop(availability_id, None)
+        if entry is None:
+            return
+        trainer_id, center_id, starts = entry
+        for start in starts:
+            _remove(self._slots_by_trainer.get(trainer_id, []), (start, center_id))
+            _remove(self._slots_by_center.get(center_id, []), (start, trainer_id))
+
+    def put_training(self, training: Training) -> None:
+        if self.loaded:
+            self.remove_training(training.id)
+            self._add_training(training.id, training.trainer_id, training.start_time, training.end_time, training.status)
+
+    def remove_training(self, training_id: str) -> None:
+        entry = self._trainings.pop(training_id, None)
+        if entry is None:
+            return
+        trainer_id, start, end = entry
+        _remove(self._bookings_by_trainer.get(trainer_id, []), (start, end, training_id))
+
+    def _add_availability(self, availability_id: str, trainer_id: str, center_id: str, available_times) -> None:
+        starts = sorted({_utc(value) for value in available_times})
+        self._availabilities[availability_id] = (trainer_id, center_id, starts)
+        for start in starts:
+            insort(self._slots_by_trainer.setdefault(trainer_id, []), (start, center_id))
+            insort(self._slots_by_center.setdefault(center_id, []), (start, trainer_id))
+
+    def _add_training(self, training_id: str, trainer_id: str, start_time, end_time, status: Optional[str]) -> None:
+        if status in CANCELLED_STATUSES:
+            return
+        start, end = _utc(start_time), _utc(end_time)
+        self._trainings[training_id] = (trainer_id, start, end)
+        insort(self._bookings_by_trainer.setdefault(trainer_id, []), (start, end, training_id))
+        self._longest_booking[trainer_id] = max(self._longest_booking.get(trainer_id, timedelta(0)), end - start)
+
+    def is_booked(self, trainer_id: str, start: datetime, end: datetime) -> bool:
+        """
+        Whether a booked training of the trainer overlaps [start, end).
+        """
+        start, end = _utc(start), _utc(end)
+        bookings = self._bookings_by_trainer.get(trainer_id)
+        if not bookings:
+            return False
+        # Only bookings starting in [start - longest booking, end) can overlap [start, end)
+        low = bisect_left(bookings, (start - self._longest_booking[trainer_id],))
+        high = bisect_left(bookings, (end,))
+        return any(booking_end > start for _, booking_end, _ in bookings[low:high])
+
+    def is_available(self, trainer_id: str, start: datetime, end: datetime) -> bool:
+        """
+        Whether [start, end) is covered by consecutive available slots of the trainer, bookings aside.
+        """
+        moment, end = _utc(start), _utc(end)
+        slots = self._slots_by_trainer.get(trainer_id, [])
+        while moment < end:
+            index = bisect_right(slots, (moment, "\uffff")) - 1
+            if index < 0 or slots[index][0] + self.slot_duration <= moment:
+                return False
+            moment = slots[index][0] + self.slot_duration
+        return True
+
+    def find_free_slots(self, center_id: str, start: datetime, end: datetime, limit: int = 10) -> List[FreeSlot]:
+        """
+        Next `limit` free slots of the center that fit between `start` and `end`, by start time.
+        """
+        start, end = _utc(start), _utc(end)
+        slots = self._slots_by_center.get(center_id, [])
+        free: List[FreeSlot] = []
+        previous = None
+        for index in range(bisect_left(slots, (start,)), len(slots)):
+            slot_start, trainer_id = slots[index]
+            slot_end = slot_start + self.slot_duration
+            if slot_end > end or len(free) >= limit:
+                break
+            # The same slot may be listed by several availabilities of the trainer
+            if (slot_start, trainer_id) == previous:
+                continue
+            previous = (slot_start, trainer_id)
+            if not self.is_booked(trainer_id, slot_start, slot_end):
+                free.append(FreeSlot(trainer_id=trainer_id, center_id=center_id, start_time=slot_start, end_time=slot_end))
+        return free
+
+    def find_trainer_slot(self, trainer_id: str, at: datetime) -> Optional[FreeSlot]:
+        """
+        The free slot of the trainer that contains `at`, or None if the trainer is not available or booked.
+        """
+        at = _utc(at)
+        slots = self._slots_by_trainer.get(trainer_id, [])
+        # Slots starting at or before `at`, the latest ones first
+        index = bisect_right(slots, (at, "\uffff")) - 1
+        while index >= 0 and slots[index][0] + self.slot_duration > at:
+            slot_start, center_id = slots[index]
+            slot_end = slot_start + self.slot_duration
+            if not self.is_booked(trainer_id, slot_start, slot_end):
+                return FreeSlot(trainer_id=trainer_id, center_id=center_id, start_time=slot_start, end_time=slot_end)
+            index -= 1
+        return None
+
+def _remove(entries: list, entry: tuple) -> None:
+    index = bisect_left(entries, entry)
+    if index < len(entries) and entries[index] == entry:
+        del entries[index]
+
+slot_index = SlotIndex()
+
+invalidation_bus.subscribe("trainings", slot_index.invalidate_training)
+invalidation_bus.subscribe("availabilities", slot_index.invalidate_availability)
@@ -1,73 +1,329 @@
 from app.models.training import Training, Availability
-from app.schemas.training import TrainingCreate, TrainingUpdate, AvailabilityCreate, AvailabilityUpdate
-from typing import List
-from datetime import datetime, timedelta
-from app.config.database import database
+from app.schemas.training import TrainingCreate, TrainingUpdate, TrainingFilter, AvailabilityCreate, AvailabilityUpdate, AvailabilityFilter, FreeSlot
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from datetime import date, datetime, timedelta, timezone
+from uuid import uuid4
+from pydantic import TypeAdapter
+from app.config.storage import get_repository
+from app.repositories.base import MAX_BATCH_OPERATIONS, Condition, ItemExistsError, ItemNotFoundError, PreconditionFailedError, set_operations
+from app.services.invalidation_bus import invalidation_bus
+from app.services.read_cache import availability_cache, training_cache
+from app.services.schedule_views import schedule_views
+from app.services.slot_index import CANCELLED_STATUSES, slot_index
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# A booked training reserves every bucket of this many minutes that it overlaps in the
+# partition of its trainer, so that two overlapping bookings always collide on a reservation
+RESERVATION_GRANULARITY_MINUTES = int(os.getenv("RESERVATION_GRANULARITY_MINUTES", "15"))
+# Only accept bookings that fall within the availabilities of the trainer
+BOOKING_REQUIRE_AVAILABILITY = os.getenv("BOOKING_REQUIRE_AVAILABILITY", "true").lower() == "true"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Validate a whole list of stored documents in one call
+_trainings = TypeAdapter(List[Training])
+_availabilities = TypeAdapter(List[Availability])
+
+class BookingConflict(ValueError):
+    """
+    The trainer already has a session booked at the requested time.
+    """
+
+def _utc(value: datetime) -> datetime:
+    # Stored datetimes are serialized in UTC ("...Z"), filters must use the same representation to compare as strings
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def training_conditions(filters: Optional[TrainingFilter]) -> List[Condition]:
+    """
+    Compile the training filters into repository conditions.
+    """
+    if filters is None:
+        return []
+    equalities = filters.model_dump(include={"trainer_id", "user_id", "center_id", "status"}, exclude_none=True)
+    conditions: List[Condition] = [(field, "=", value) for field, value in sorted(equalities.items())]
+    if filters.start_from is not None:
+        conditions.append(("start_time", ">=", _utc(filters.start_from)))
+    if filters.start_to is not None:
+        conditions.append(("start_time", "<", _utc(filters.start_to)))
+    return conditions
+
+def reservation_ids(start: datetime, end: datetime) -> List[str]:
+    """
+    Ids of the reservation buckets overlapped by [start, end), unique within the partition of a trainer.
+    """
+    granularity = timedelta(minutes=RESERVATION_GRANULARITY_MINUTES)
+    start, end = _utc(start), _utc(end)
+    bucket = _EPOCH + ((start - _EPOCH) // granularity) * granularity
+    ids = []
+    while bucket < end:
+        ids.append(bucket.strftime("%Y-%m-%dT%H:%M:%SZ"))
+        bucket += granularity
+    return ids
+
+def _reserves(training: Training) -> bool:
+    return training.status not in CANCELLED_STATUSES
+
+def availability_conditions(filters: Optional[AvailabilityFilter]) -> List[Condition]:
+    if filters is None:
+        return []
+    return [(field, "=", value) for field, value in sorted(filters.model_dump(exclude_none=True).items())]
 
 class TrainingService:
     def __init__(self):
-        self.training_container = database.get_container_client("trainings")
-        self.availability_container = database.get_container_client("availabilities")
+        self.training_repository = get_repository("trainings")
+        self.availability_repository = get_repository("availabilities")
+        # Slot reservations, partitioned by trainer_id
+        self.reservation_repository = get_repository("reservations")
+
+    async def create_training(self, training: TrainingCreate) -> Training:
+        """
+        Book a training session. The time of the trainer is reserved atomically before the
+        session is stored, so that only one of several concurrent overlapping bookings succeeds.
 
-    def create_training(self, training: TrainingCreate) -> Training:
+        :raises BookingConflict: If the trainer is already booked at that time.
+        :raises ValueError: If the times are invalid or the trainer is not available.
+        """
         new_training = Training(
-            id="1",  # Generar un ID único
+            _id=str(uuid4()),
             trainer_id=training.trainer_id,
             user_id=training.user_id,
             start_time=training.start_time,
             end_time=training.end_time,
-            status=training.status
+            status=training.status,
+            center_id=training.center_id
         )
-        self.training_container.create_item(new_training.dict(by_alias=True))
+        reserved: List[str] = []
+        if _reserves(new_training):
+            await self._validate_booking(new_training)
+            # Sessions booked before the reservations existed are only known to the slot index
+            if slot_index.is_booked(new_training.trainer_id, new_training.start_time, new_training.end_time):
+                raise BookingConflict("The trainer is already booked at that time.")
+            reserved = reservation_ids(new_training.start_time, new_training.end_time)
+            await self._reserve(new_training, reserved)
+        try:
+            await self.training_repository.create(new_training.model_dump())
+        except Exception:
+            await self._release(new_training.trainer_id, reserved)
+            raise
+        invalidation_bus.publish("trainings", new_training.id)
+        slot_index.put_training(new_training)
         return new_training
 
-    def get_trainings(self) -> List[Training]:
-        query = "SELECT * FROM trainings"
-        items = list(self.training_container.query_items(query, enable_cross_partition_query=True))
-        for item in items:
-            item["_id"] = item.get("id", item.get("_id"))  # Map 'id' to '_id' if 'id' exists
-        return [Training(**item) for item in items]
+    async def _validate_booking(self, training: Training) -> None:
+        if _utc(training.end_time) <= _utc(training.start_time):
+            raise ValueError("The training session must end after it starts.")
+        if len(reservation_ids(training.start_time, training.end_time)) > MAX_BATCH_OPERATIONS:
+            raise ValueError("The training session is too long.")
+        await slot_index.ensure_loaded()
+        if BOOKING_REQUIRE_AVAILABILITY and not slot_index.is_available(training.trainer_id, training.start_time, training.end_time):
+            raise ValueError("The trainer is not available at that time.")
+
+    async def _reserve(self, training: Training, ids: List[str]) -> None:
+        if not ids:
+            return
+        reservations = [{"id": reservation_id, "trainer_id": training.trainer_id, "training_id": training.id} for reservation_id in ids]
+        try:
+            # A transactional batch in the partition of the trainer: all the buckets or none
+            await self.reservation_repository.create_batch(reservations)
+        except ItemExistsError:
+            raise BookingConflict("The trainer is already booked at that time.")
+
+    async def _release(self, trainer_id: str, ids: List[str]) -> None:
+        for reservation_id in ids:
+            try:
+                await self.reservation_repository.delete(reservation_id, trainer_id)
+            except ItemNotFoundError:
+                pass
 
-    def get_training(self, training_id: str) -> Training:
-        item = self.training_container.read_item(item=training_id, partition_key=training_id)
-        return Training(**item)
+    async def get_trainings(
+        self, filters: Optional[TrainingFilter] = None, fields: Optional[List[str]] = None, documents: bool = False
+    ) -> List[Union[Training, Dict[str, Any]]]:
+        """
+        With `fields` or `documents`, the stored (projected) documents are returned as dicts
+        instead of models. Identical concurrent listings share one query, see app.services.read_cache.
+        """
+        conditions = training_conditions(filters)
+        documents = documents or bool(fields)
+
+        async def load() -> List[Union[Training, Dict[str, Any]]]:
+            items = [item async for item in self.training_repository.query(conditions, fields=fields)]
+            return items if documents else _trainings.validate_python(items)
+
+        # The cached list is shared, callers get their own copy of it
+        return list(await training_cache.query((tuple(conditions), tuple(fields or ()), documents), load))
+
+    async def get_trainings_page(
+        self, page_size: int, continuation: Optional[str] = None, filters: Optional[TrainingFilter] = None, fields: Optional[List[str]] = None,
+        documents: bool = False,
+    ) -> Tuple[List[Union[Training, Dict[str, Any]]], Optional[str]]:
+        items, continuation = await self.training_repository.query_page(
+            training_conditions(filters), page_size=page_size, continuation=continuation, fields=fields
+        )
+        return (items if fields or documents else _trainings.validate_python(items)), continuation
 
-    def update_training(self, training_id: str, training: TrainingUpdate) -> Training:
-        item = self.training_container.read_item(item=training_id, partition_key=training_id)
+    async def stream_trainings(
+        self, page_size: int = 100, continuation: Optional[str] = None, filters: Optional[TrainingFilter] = None, fields: Optional[List[str]] = None,
+        documents: bool = False,
+    ) -> AsyncIterator[Union[Training, Dict[str, Any]]]:
+        async for items in self.training_repository.iter_pages(
+            training_conditions(filters), page_size=page_size, continuation=continuation, fields=fields
+        ):
+            for item in (items if fields or documents else _trainings.validate_python(items)):
+                yield item
+
+    async def get_training(self, training_id: str) -> Training:
+        async def load() -> Training:
+            return Training(**await self.training_repository.read(training_id, training_id))
+
+        return await training_cache.read(training_id, load)
+
+    async def update_training(self, training_id: str, training: TrainingUpdate, if_match: Optional[str] = None) -> Training:
+        """
+        Patch the fields that were sent. The 24-hour rule needs the stored start time, so the
+        session is read first and the patch is conditional on the ETag that was validated.
+
+        :raises ValueError: If the session starts within 24 hours, or cannot be moved to the new time.
+        :raises BookingConflict: If the trainer is already booked at the new time.
+        :raises PreconditionFailedError: If the session was modified since `if_match` was read.
+        """
+        item = await self.training_repository.read(training_id, training_id)
+        if if_match is not None and item["_etag"] != if_match:
+            raise PreconditionFailedError(f"Training {training_id} was modified")
         existing_training = Training(**item)
-        if existing_training.start_time - datetime.utcnow() < timedelta(hours=24):
+        if _utc(existing_training.start_time) - datetime.now(timezone.utc) < timedelta(hours=24):
             raise ValueError("Cannot modify training session within 24 hours of its start time.")
-        updated_training = Training(**{**item, **training.dict(exclude_unset=True)})
-        self.training_container.replace_item(item=training_id, body=updated_training.dict(by_alias=True))
+        changes = training.dict(exclude_unset=True, exclude_none=True)
+        if not changes:
+            return existing_training
+
+        # Moving the session reserves the new buckets before the old ones are released
+        candidate = Training(**{**item, **changes})
+        old_ids = reservation_ids(existing_training.start_time, existing_training.end_time) if _reserves(existing_training) else []
+        new_ids = reservation_ids(candidate.start_time, candidate.end_time) if _reserves(candidate) else []
+        same_trainer = candidate.trainer_id == existing_training.trainer_id
+        to_reserve = [reservation_id for reservation_id in new_ids if not (same_trainer and reservation_id in old_ids)]
+        to_release = [reservation_id for reservation_id in old_ids if not (same_trainer and reservation_id in new_ids)]
+        if to_reserve:
+            await self._validate_booking(candidate)
+            await self._reserve(candidate, to_reserve)
+        try:
+            item = await self.training_repository.patch(training_id, training_id, set_operations(changes), if_match=item["_etag"])
+        except Exception:
+            await self._release(candidate.trainer_id, to_reserve)
+            raise
+        invalidation_bus.publish("trainings", training_id)
+        await self._release(existing_training.trainer_id, to_release)
+        updated_training = Training(**item)
+        slot_index.put_training(updated_training)
         return updated_training
 
-    def delete_training(self, training_id: str) -> None:
-        self.training_container.delete_item(item=training_id, partition_key=training_id)
+    async def delete_training(self, training_id: str) -> None:
+        # Read from the database, not the cache: the reservations to release depend on it
+        existing_training = Training(**await self.training_repository.read(training_id, training_id))
+        await self.training_repository.delete(training_id, training_id)
+        invalidation_bus.publish("trainings", training_id)
+        if _reserves(existing_training):
+            await self._release(existing_training.trainer_id, reservation_ids(existing_training.start_time, existing_training.end_time))
+        slot_index.remove_training(training_id)
+        # Deletions are not in the change feed: remove the training from the schedule views here
+        await schedule_views.remove("trainings", training_id)
 
-    def create_availability(self, availability: AvailabilityCreate) -> Availability:
+    async def create_availability(self, availability: AvailabilityCreate) -> Availability:
         new_availability = Availability(
-            id="1",  # Generar un ID único
+            _id=str(uuid4()),
             trainer_id=availability.trainer_id,
             center_id=availability.center_id,
             available_times=availability.available_times
         )
-        self.availability_container.create_item(new_availability.dict(by_alias=True))
+        await self.availability_repository.create(new_availability.model_dump())
+        invalidation_bus.publish("availabilities", new_availability.id)
+        slot_index.put_availability(new_availability)
         return new_availability
 
-    def get_availabilities(self) -> List[Availability]:
-        query = "SELECT * FROM availabilities"
-        items = list(self.availability_container.query_items(query, enable_cross_partition_query=True))
-        return [Availability(**item) for item in items]
+    async def get_availabilities(
+        self, filters: Optional[AvailabilityFilter] = None, fields: Optional[List[str]] = None, documents: bool = False
+    ) -> List[Union[Availability, Dict[str, Any]]]:
+        """
+        With `fields` or `documents`, the stored (projected) documents are returned as dicts instead of models.
+        """
+        conditions = availability_conditions(filters)
+        documents = documents or bool(fields)
+
+        async def load() -> List[Union[Availability, Dict[str, Any]]]:
+            items = [item async for item in self.availability_repository.query(conditions, fields=fields)]
+            return items if documents else _availabilities.validate_python(items)
+
+        return list(await availability_cache.query((tuple(conditions), tuple(fields or ()), documents), load))
+
+    async def get_availabilities_page(
+        self, page_size: int, continuation: Optional[str] = None, filters: Optional[AvailabilityFilter] = None, fields: Optional[List[str]] = None,
+        documents: bool = False,
+    ) -> Tuple[List[Union[Availability, Dict[str, Any]]], Optional[str]]:
+        items, continuation = await self.availability_repository.query_page(
+            availability_conditions(filters), page_size=page_size, continuation=continuation, fields=fields
+        )
+        return (items if fields or documents else _availabilities.validate_python(items)), continuation
+
+    async def stream_availabilities(
+        self, page_size: int = 100, continuation: Optional[str] = None, filters: Optional[AvailabilityFilter] = None, fields: Optional[List[str]] = None,
+        documents: bool = False,
+    ) -> AsyncIterator[Union[Availability, Dict[str, Any]]]:
+        async for items in self.availability_repository.iter_pages(
+            availability_conditions(filters), page_size=page_size, continuation=continuation, fields=fields
+        ):
+            for item in (items if fields or documents else _availabilities.validate_python(items)):
+                yield item
+
+    async def get_availability(self, availability_id: str) -> Availability:
+        async def load() -> Availability:
+            return Availability(**await self.availability_repository.read(availability_id, availability_id))
+
+        return await availability_cache.read(availability_id, load)
 
-    def get_availability(self, availability_id: str) -> Availability:
-        item = self.availability_container.read_item(item=availability_id, partition_key=availability_id)
-        return Availability(**item)
+    async def update_availability(self, availability_id: str, availability: AvailabilityUpdate, if_match: Optional[str] = None) -> Availability:
+        """
+        Patch the fields that were sent, in a single round-trip.
 
-    def update_availability(self, availability_id: str, availability: AvailabilityUpdate) -> Availability:
-        item = self.availability_container.read_item(item=availability_id, partition_key=availability_id)
-        updated_availability = Availability(**{**item, **availability.dict(exclude_unset=True)})
-        self.availability_container.replace_item(item=availability_id, body=updated_availability.dict(by_alias=True))
+        :raises PreconditionFailedError: If the availability was modified since `if_match` was read.
+        """
+        changes = availability.dict(exclude_unset=True, exclude_none=True)
+        if not changes:
+            return await self.get_availability(availability_id)
+        item = await self.availability_repository.patch(availability_id, availability_id, set_operations(changes), if_match=if_match)
+        invalidation_bus.publish("availabilities", availability_id)
+        updated_availability = Availability(**item)
+        slot_index.put_availability(updated_availability)
         return updated_availability
 
-    def delete_availability(self, availability_id: str) -> None:
-        self.availability_container.delete_item(item=availability_id, partition_key=availability_id)
+    async def delete_availability(self, availability_id: str) -> None:
+        await self.availability_repository.delete(availability_id, availability_id)
+        invalidation_bus.publish("availabilities", availability_id)
+        slot_index.remove_availability(availability_id)
+        await schedule_views.remove("availabilities", availability_id)
+
+    async def get_trainer_schedule(self, trainer_id: str, start: date, days: int = 7) -> List[Dict[str, Any]]:
+        """
+        Days of the trainer from the materialized schedule views (eventually consistent with the trainings).
+        """
+        return await schedule_views.get_days("trainer_schedules", trainer_id, start, days)
+
+    async def get_member_schedule(self, user_id: str, start: date, days: int = 7) -> List[Dict[str, Any]]:
+        return await schedule_views.get_days("member_schedules", user_id, start, days)
+
+    async def find_free_slots(self, center_id: str, start: datetime, end: datetime, limit: int = 10) -> List[FreeSlot]:
+        """
+        Next free slots of the center between `start` and `end`: available slots of its
+        trainers that do not overlap a booked training, answered from the slot index.
+        """
+        await slot_index.ensure_loaded()
+        return slot_index.find_free_slots(center_id, start, end, limit)
+
+    async def find_trainer_slot(self, trainer_id: str, at: datetime) -> Optional[FreeSlot]:
+        """
+        The free slot of the trainer containing `at`, None if the trainer is not free at that time.
+        """
+        await slot_index.ensure_loaded()
+        return slot_index.find_trainer_slot(trainer_id, at)
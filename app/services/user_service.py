@@ -1,65 +1,193 @@
+import os
 from app.models.user import User
 from app.schemas.user import UserCreate, UserUpdate
-from typing import List, Optional
-from passlib.context import CryptContext
-from app.config.database import database
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+from uuid import uuid4
+from pydantic import TypeAdapter
+from app.config.storage import get_repository
+from app.repositories.base import MAX_BATCH_OPERATIONS, ItemExistsError, ItemNotFoundError, PreconditionFailedError, set_operations
+from app.services.invalidation_bus import invalidation_bus
+from app.services.password_hasher import password_hasher
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Fall back to the cross-partition username query when the index has no entry.
+# Only meant to be enabled while the username index is being backfilled.
+USERNAME_INDEX_FALLBACK = os.getenv("USERNAME_INDEX_FALLBACK", "false").lower() == "true"
+
+# Validate a whole list of stored documents in one call
+_users = TypeAdapter(List[User])
+
+def username_index_id(username: str) -> str:
+    """
+    Id of the username index document. Characters that are not allowed in Cosmos ids
+    ('/', '\\', '?', '#') are percent-encoded.
+    """
+    return quote(username, safe="")
 
 class UserService:
     def __init__(self):
-        self.container = database.get_container_client("users")
+        self.repository = get_repository("users")
+        # Username -> user id lookup, partitioned by the (encoded) username itself
+        self.username_repository = get_repository("usernames")
 
-    def create_user(self, user: UserCreate) -> User:
-        hashed_password = pwd_context.hash(user.password)
+    async def create_user(self, user: UserCreate) -> User:
+        hashed_password = await password_hasher.hash(user.password)
         new_user = User(
-            id="1",  # Generar un ID único
+            _id=str(uuid4()),
             username=user.username,
             email=user.email,
             hashed_password=hashed_password,
             roles=["user"]
         )
-        self.container.create_item(new_user.dict(by_alias=True))
+        # Reserving the username first also guarantees it is unique
+        await self._create_username_index(new_user.username, new_user.id)
+        try:
+            await self.repository.create(new_user.model_dump())
+        except Exception:
+            await self._delete_username_index(new_user.username)
+            raise
         return new_user
 
-    def get_users(self) -> List[User]:
-        query = "SELECT * FROM users"
-        items = list(self.container.query_items(query, enable_cross_partition_query=True))
-        for item in items:
-            item["_id"] = item.get("id", item.get("_id"))  # Map 'id' to '_id' if 'id' exists
-        return [User(**item) for item in items]
+    async def get_users(self, documents: bool = False) -> List[Union[User, Dict[str, Any]]]:
+        """
+        With `documents`, the stored documents are returned as dicts instead of models.
+        They include the password hash: only shape them with a response model that leaves it out.
+        """
+        items = [item async for item in self.repository.query()]
+        return items if documents else _users.validate_python(items)
+
+    async def get_users_page(self, page_size: int, continuation: Optional[str] = None, documents: bool = False) -> Tuple[List[Union[User, Dict[str, Any]]], Optional[str]]:
+        items, continuation = await self.repository.query_page(page_size=page_size, continuation=continuation)
+        return (items if documents else _users.validate_python(items)), continuation
+
+    async def stream_users(self, page_size: int = 100, continuation: Optional[str] = None, documents: bool = False) -> AsyncIterator[Union[User, Dict[str, Any]]]:
+        async for items in self.repository.iter_pages(page_size=page_size, continuation=continuation):
+            for item in (items if documents else _users.validate_python(items)):
+                yield item
+
+    async def get_user(self, user_id: str) -> User:
+        item = await self.repository.read(user_id, user_id)
+        return User(**item)
+
+    async def get_emails(self, user_ids: List[str]) -> Dict[str, str]:
+        """
+        Email of each of the users that exist, looked up with one query per
+        MAX_BATCH_OPERATIONS users instead of a point read per user.
+        """
+        emails: Dict[str, str] = {}
+        user_ids = list(dict.fromkeys(user_ids))
+        for start in range(0, len(user_ids), MAX_BATCH_OPERATIONS):
+            chunk = user_ids[start:start + MAX_BATCH_OPERATIONS]
+            async for item in self.repository.query([("id", "in", chunk)], fields=["email"]):
+                if item.get("email"):
+                    emails[item["id"]] = item["email"]
+        return emails
+
+    async def update_user(self, user_id: str, user: UserUpdate, if_match: Optional[str] = None) -> User:
+        """
+        Patch the fields that were sent. Only a rename reads the user first, to move its username index entry.
 
-    def get_user(self, user_id: str) -> User:
-        item = self.container.read_item(item=user_id, partition_key=user_id)
-        item["_id"] = item.get("id", item.get("_id"))  # Map 'id' to '_id' if 'id' exists
+        :raises ValueError: If the new username is already registered.
+        :raises PreconditionFailedError: If the user was modified since `if_match` was read.
+        """
+        changes = user.dict(exclude_unset=True, exclude_none=True)
+        password = changes.pop("password", None)
+        if password:
+            changes["hashed_password"] = await password_hasher.hash(password)
+        if not changes:
+            return await self.get_user(user_id)
+        if "username" not in changes:
+            item = await self.repository.patch(user_id, user_id, set_operations(changes), if_match=if_match)
+            invalidation_bus.publish("users", user_id)
+            return User(**item)
+
+        item = await self.repository.read(user_id, user_id)
+        if if_match is not None and item["_etag"] != if_match:
+            raise PreconditionFailedError(f"User {user_id} was modified")
+        existing_username = item["username"]
+        renamed = changes["username"] != existing_username
+        if renamed:
+            await self._create_username_index(changes["username"], user_id)
+        try:
+            item = await self.repository.patch(user_id, user_id, set_operations(changes), if_match=item["_etag"])
+        except Exception:
+            if renamed:
+                await self._delete_username_index(changes["username"])
+            raise
+        if renamed:
+            await self._delete_username_index(existing_username)
+        invalidation_bus.publish("users", user_id)
         return User(**item)
 
-    def update_user(self, user_id: str, user: UserUpdate) -> User:
-        item = self.container.read_item(item=user_id, partition_key=user_id)
-        updated_user = User(**{**item, **user.dict(exclude_unset=True)})
-        self.container.replace_item(item=user_id, body=updated_user.dict(by_alias=True))
-        return updated_user
+    async def delete_user(self, user_id: str) -> None:
+        existing_user = await self.get_user(user_id)
+        await self.repository.delete(user_id, user_id)
+        await self._delete_username_index(existing_user.username)
+        invalidation_bus.publish("users", user_id)
 
-    def delete_user(self, user_id: str) -> None:
-        self.container.delete_item(item=user_id, partition_key=user_id)
+    async def authenticate_user(self, username: str, password: str) -> Optional[User]:
+        """
+        Verify the credentials on the password hashing pool, upgrading the stored hash
+        when it was created with outdated bcrypt parameters.
 
-    def authenticate_user(self, username: str, password: str) -> Optional[User]:
-        query = f"SELECT * FROM users u WHERE u.username = '{username}'"
-        items = list(self.container.query_items(query, enable_cross_partition_query=True))
-        if not items:
+        :raises PasswordHasherBusy: If the password hashing pool is saturated.
+        """
+        user = await self.get_user_by_username(username)
+        if user is None:
             return None
-        user_data = items[0]
-        user_data["_id"] = user_data["id"]  # Map 'id' to '_id'
-        user = User(**user_data)
-        if not pwd_context.verify(password, user.hashed_password):
+        valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+        if not valid:
             return None
+        if new_hash:
+            await self._update_password_hash(user.id, new_hash)
+            user.hashed_password = new_hash
         return user
 
-    def get_user_by_username(self, username: str) -> Optional[User]:
-        query = f"SELECT * FROM users u WHERE u.username = '{username}'"
-        items = list(self.container.query_items(query, enable_cross_partition_query=True))
-        if not items:
+    async def get_user_by_username(self, username: str) -> Optional[User]:
+        user_id = await self.get_user_id_by_username(username)
+        if user_id is None:
+            return None
+        try:
+            user = await self.get_user(user_id)
+        except ItemNotFoundError:
             return None
-        user_data = items[0]
-        user_data["_id"] = user_data.get("id", user_data.get("_id"))  # Map 'id' to '_id' if 'id' exists
-        return User(**user_data)
+        # Guard against an index entry left behind by an interrupted rename
+        if user.username != username:
+            return None
+        return user
+
+    async def get_user_id_by_username(self, username: str) -> Optional[str]:
+        """
+        Resolve a username to a user id with a single-partition point read on the username index.
+        """
+        index_id = username_index_id(username)
+        try:
+            item = await self.username_repository.read(index_id, index_id)
+            return item["user_id"]
+        except ItemNotFoundError:
+            if not USERNAME_INDEX_FALLBACK:
+                return None
+        items = [item async for item in self.repository.query([("username", "=", username)])]
+        return items[0]["id"] if items else None
+
+    async def _update_password_hash(self, user_id: str, hashed_password: str) -> None:
+        try:
+            await self.repository.patch(user_id, user_id, [{"op": "set", "path": "/hashed_password", "value": hashed_password}])
+            invalidation_bus.publish("users", user_id)
+        except Exception as e:
+            # The old hash is still valid, the upgrade is retried on the next login
+            print(f"Failed to rehash password for user {user_id}: {e}")
+
+    async def _create_username_index(self, username: str, user_id: str) -> None:
+        index_id = username_index_id(username)
+        try:
+            await self.username_repository.create({"id": index_id, "username": username, "user_id": user_id})
+        except ItemExistsError:
+            raise ValueError(f"Username '{username}' is already registered.")
+
+    async def _delete_username_index(self, username: str) -> None:
+        index_id = username_index_id(username)
+        try:
+            await self.username_repository.delete(index_id, index_id)
+        except ItemNotFoundError:
+            pass
@@ -0,0 +1,118 @@
+"""
+A/B load benchmark of the sync (threadpool) and async (azure.cosmos.aio) Cosmos data paths.
+
+For every mode a uvicorn server is started with COSMOS_CLIENT_MODE set accordingly and
+hammered with an increasing number of concurrent clients. Point COSMOS_DB_ENDPOINT at a
+local stand-in (e.g. the Cosmos DB emulator seeded with app/config/databasepreload.py)
+so that the numbers are not dominated by network latency. STORAGE_BACKEND=memory or
+sqlite benchmarks the API without any Cosmos account (the client mode then has no effect).
+
+Usage: python -m benchmarks.async_load [--modes sync async] [--concurrency 50 200 1000]
+                                       [--duration 10] [--path /trainings/]
+                                       [--url http://127.0.0.1:8000]  (skip starting servers)
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import aiohttp
+
+async def wait_until_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url + "/") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"Server at {url} did not become ready in {timeout}s")
+
+async def login(session: aiohttp.ClientSession, url: str, username: str, password: str) -> str:
+    async with session.post(url + "/token", data={"username": username, "password": password}) as response:
+        response.raise_for_status()
+        return (await response.json())["access_token"]
+
+async def run_level(url: str, path: str, token: str, concurrency: int, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    stop_at = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def client(session: aiohttp.ClientSession) -> None:
+        nonlocal errors
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                async with session.get(url + path, headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    started = time.monotonic()
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0,
+        "errors": errors,
+    }
+
+async def benchmark(url: str, args) -> list:
+    await wait_until_ready(url)
+    async with aiohttp.ClientSession() as session:
+        token = await login(session, url, args.username, args.password)
+    results = []
+    for concurrency in args.concurrency:
+        results.append(await run_level(url, args.path, token, concurrency, args.duration))
+    return results
+
+def start_server(mode: str, port: int) -> subprocess.Popen:
+    env = {**os.environ, "COSMOS_CLIENT_MODE": mode}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[50, 200, 1000])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--path", default="/trainings/")
+    parser.add_argument("--username", default="user1")
+    parser.add_argument("--password", default="password1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one per mode")
+    args = parser.parse_args()
+
+    runs = [("external", args.url)] if args.url else [(mode, f"http://127.0.0.1:{args.port}") for mode in args.modes]
+    print(f"{'mode':<9} {'clients':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode, url in runs:
+        server = None if args.url else start_server(mode, args.port)
+        try:
+            for result in asyncio.run(benchmark(url, args)):
+                print(f"{mode:<9} {result['concurrency']:>7} {result['rps']:>9.1f} {result['p50']:>8.1f} {result['p99']:>8.1f} {result['errors']:>7}")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Concurrency stress test of the training booking path: fires --bookings simultaneous
+TrainingService.create_training calls at the same trainer slot and checks that exactly
+one of them succeeds, then repeats with bookings overlapping the slot at different offsets.
+
+Runs in-process on the memory storage backend unless STORAGE_BACKEND is set (sqlite
+exercises real threads, a Cosmos account the transactional batches). Exits with status 1
+if more than one booking won a slot.
+
+Usage: python -m benchmarks.booking_stress [--bookings 500] [--rounds 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from app.config.storage import close_storage, get_repository, open_storage
+from app.schemas.training import TrainingCreate
+from app.services.slot_index import slot_index
+from app.services.training_service import BookingConflict, TrainingService
+
+async def book(service: TrainingService, trainer_id: str, start: datetime, end: datetime) -> str:
+    try:
+        await service.create_training(TrainingCreate(trainer_id=trainer_id, user_id=f"member-{uuid4()}", start_time=start, end_time=end, status="scheduled"))
+        return "booked"
+    except BookingConflict:
+        return "conflict"
+    except ValueError:
+        return "rejected"
+
+async def run_round(service: TrainingService, bookings: int, overlapping: bool) -> dict:
+    trainer_id = f"stress-trainer-{uuid4()}"
+    slot_start = datetime(2030, 1, 1, 10, tzinfo=timezone.utc)
+    await get_repository("availabilities").create({
+        "id": str(uuid4()),
+        "trainer_id": trainer_id,
+        "center_id": "stress-center",
+        "available_times": [slot_start - timedelta(hours=1), slot_start, slot_start + timedelta(hours=1)],
+    })
+    # Make the new availability visible to the slot index
+    await slot_index.rebuild()
+
+    requests = []
+    for index in range(bookings):
+        offset = timedelta(minutes=(index % 5) * 10 - 20) if overlapping else timedelta(0)
+        requests.append(book(service, trainer_id, slot_start + offset, slot_start + offset + timedelta(hours=1)))
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(*requests)
+    elapsed = time.perf_counter() - started
+
+    booked = [item async for item in get_repository("trainings").query([("trainer_id", "=", trainer_id)])]
+    return {
+        "booked": outcomes.count("booked"),
+        "conflict": outcomes.count("conflict"),
+        "rejected": outcomes.count("rejected"),
+        "stored": len(booked),
+        "elapsed": elapsed,
+    }
+
+async def run(args) -> int:
+    await open_storage()
+    service = TrainingService()
+    failures = 0
+    print(f"{'round':<12} {'booked':>7} {'conflict':>9} {'rejected':>9} {'stored':>7} {'seconds':>8}")
+    for round_number in range(args.rounds):
+        for overlapping in (False, True):
+            result = await run_round(service, args.bookings, overlapping)
+            label = f"{round_number + 1}/{'overlap' if overlapping else 'same'}"
+            print(f"{label:<12} {result['booked']:>7} {result['conflict']:>9} {result['rejected']:>9} {result['stored']:>7} {result['elapsed']:>8.2f}")
+            # Every booking overlaps every other one, so only one may win
+            if result["booked"] != 1 or result["stored"] != 1:
+                failures += 1
+    await close_storage()
+    print("OK" if not failures else f"FAILED: {failures} round(s) double-booked or booked nothing")
+    return 1 if failures else 0
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+if __name__ == "__main__":
+    main()
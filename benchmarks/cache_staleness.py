@@ -0,0 +1,233 @@
+"""
+Staleness of the per-process caches when several workers serve the same database. Starts
+--workers uvicorn processes on consecutive ports of one host, sharing a SQLite database
+file and the invalidation bus of app.services.invalidation_bus, with cache TTLs long enough
+(--ttl) that only the bus can make a worker see the writes of another one.
+
+Every round writes through one worker, round robin, then polls every other worker until
+it serves the write:
+
+- training: PUT /trainings/{id}, then GET /trainings/{id} and GET /trainings/?trainer_id=...
+  (read cache) until they return the new center;
+- user: DELETE /users/{id}, then GET /users/{id} with the token of the deleted user
+  (principal cache) until it is rejected with 401;
+- availability: POST /trainings/availability of a new trainer, then
+  GET /trainings/availability/trainers/{id}/free (slot index) until the trainer is free;
+- booking: POST /trainings/ of that slot, then the same until the trainer is not free anymore.
+
+Exits with status 1 if a worker served stale data for longer than --max-staleness seconds.
+With --bus local, the workers are not told about each other's writes and the check fails.
+
+Usage: python -m benchmarks.cache_staleness [--workers 4] [--rounds 20] [--bus unix]
+                                            [--max-staleness 0.25] [--ttl 60]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+
+async def wait_until_ready(session: aiohttp.ClientSession, url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url + "/health/ready") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"Server at {url} did not become ready in {timeout}s")
+
+def seed(rounds: int, env: dict) -> dict:
+    """
+    Write the documents of the run straight into the database, in a child process configured
+    like the workers, and return their ids and access tokens.
+    """
+    code = f"""
+import asyncio, json
+from app.config.storage import close_storage, get_repository, open_storage
+from app.dependencies.auth import build_token_claims, create_access_token
+from app.models.user import User
+
+async def main():
+    await open_storage()
+    users = get_repository("users")
+    admin = User(_id="staleness-admin", username="staleness-admin", email="admin@example.com", hashed_password="", roles=["admin"])
+    members = [User(_id=f"staleness-member-{{index}}", username=f"staleness-member-{{index}}", email="member@example.com", hashed_password="", roles=["user"]) for index in range({rounds})]
+    for user in [admin, *members]:
+        await users.upsert(user.model_dump())
+    await get_repository("trainings").upsert({{
+        "id": "staleness-training", "trainer_id": "staleness-trainer", "user_id": "staleness-member-0", "center_id": "center-initial",
+        "start_time": "2030-01-01T10:00:00Z", "end_time": "2030-01-01T11:00:00Z", "status": "cancelled",
+    }})
+    await close_storage()
+    print(json.dumps({{
+        "admin": create_access_token(build_token_claims(admin)),
+        "members": [[member.id, create_access_token(build_token_claims(member))] for member in members],
+    }}))
+
+asyncio.run(main())
+"""
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"Seeding failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def start_workers(args, port: int, env: dict) -> list:
+    return [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port + index), "--log-level", "warning"],
+            env=env, stdout=subprocess.DEVNULL,
+        )
+        for index in range(args.workers)
+    ]
+
+async def until_fresh(session: aiohttp.ClientSession, probe, timeout: float) -> float:
+    """
+    Seconds until `probe` returns True, or `timeout` if it never does.
+    """
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if await probe(session):
+            return time.perf_counter() - started
+        await asyncio.sleep(0.005)
+    return timeout
+
+async def run(args, urls: list, seeded: dict) -> dict:
+    admin = {"Authorization": f"Bearer {seeded['admin']}"}
+    staleness = {"training": [], "user": [], "availability": [], "booking": []}
+    async with aiohttp.ClientSession() as session:
+        for url in urls:
+            await wait_until_ready(session, url)
+
+        async def training_center(session, url: str) -> set:
+            async with session.get(url + "/trainings/staleness-training", headers=admin) as response:
+                point = (await response.json())["center_id"]
+            async with session.get(url + "/trainings/", params={"trainer_id": "staleness-trainer"}, headers=admin) as response:
+                listing = (await response.json())[0]["center_id"]
+            return {point, listing}
+
+        async def user_status(session, url: str, user_id: str, token: str) -> int:
+            async with session.get(url + f"/users/{user_id}", headers={"Authorization": f"Bearer {token}"}) as response:
+                await response.read()
+                return response.status
+
+        async def trainer_free(session, url: str, trainer_id: str, at: str) -> bool:
+            async with session.get(url + f"/trainings/availability/trainers/{trainer_id}/free", params={"at": at}, headers=admin) as response:
+                response.raise_for_status()
+                return (await response.json())["free"]
+
+        for round_number in range(args.rounds):
+            writer, readers = urls[round_number % len(urls)], [url for index, url in enumerate(urls) if index != round_number % len(urls)]
+            user_id, token = seeded["members"][round_number]
+            trainer_id, slot_start = f"staleness-slot-trainer-{round_number}", f"2031-01-01T{round_number % 24:02d}:00:00Z"
+            # Fill the caches of every worker with the values about to change
+            for url in urls:
+                await training_center(session, url)
+                if await user_status(session, url, user_id, token) != 200:
+                    raise RuntimeError(f"{url} does not serve the user {user_id}")
+                if await trainer_free(session, url, trainer_id, slot_start):
+                    raise RuntimeError(f"{url} finds {trainer_id} free before its availability exists")
+
+            center = f"center-{round_number}"
+            async with session.put(writer + "/trainings/staleness-training", json={"center_id": center}, headers=admin) as response:
+                response.raise_for_status()
+            async with session.delete(writer + f"/users/{user_id}", headers=admin) as response:
+                response.raise_for_status()
+
+            for url in readers:
+                async def training_fresh(session, url=url) -> bool:
+                    return await training_center(session, url) == {center}
+
+                async def user_fresh(session, url=url) -> bool:
+                    return await user_status(session, url, user_id, token) == 401
+
+                staleness["training"].append(await until_fresh(session, training_fresh, args.timeout))
+                staleness["user"].append(await until_fresh(session, user_fresh, args.timeout))
+
+            availability = {"trainer_id": trainer_id, "center_id": "staleness-center", "available_times": [slot_start]}
+            async with session.post(writer + "/trainings/availability", json=availability, headers=admin) as response:
+                response.raise_for_status()
+            for url in readers:
+                async def available(session, url=url) -> bool:
+                    return await trainer_free(session, url, trainer_id, slot_start)
+
+                staleness["availability"].append(await until_fresh(session, available, args.timeout))
+
+            booking = {
+                "trainer_id": trainer_id, "user_id": user_id, "center_id": "staleness-center", "status": "scheduled",
+                "start_time": slot_start, "end_time": slot_start.replace(":00:00Z", ":59:00Z"),
+            }
+            async with session.post(writer + "/trainings/", json=booking, headers=admin) as response:
+                response.raise_for_status()
+            for url in readers:
+                async def booked(session, url=url) -> bool:
+                    return not await trainer_free(session, url, trainer_id, slot_start)
+
+                staleness["booking"].append(await until_fresh(session, booked, args.timeout))
+    return staleness
+
+def measure(args) -> dict:
+    """
+    Start the workers on a fresh database, run the rounds and return the staleness (in
+    seconds) of every read, by cache.
+    """
+    directory = tempfile.mkdtemp(prefix="cache-staleness-")
+    env = {
+        **os.environ,
+        "STORAGE_BACKEND": "sqlite",
+        "SQLITE_PATH": os.path.join(directory, "database.sqlite"),
+        "INVALIDATION_BUS": args.bus,
+        "INVALIDATION_BUS_PATH": os.path.join(directory, "bus"),
+        "READ_CACHE_FRESH_SECONDS": str(args.ttl),
+        "AUTH_PRINCIPAL_CACHE_MAX_STALENESS": str(args.ttl),
+        "SLOT_INDEX_REFRESH_SECONDS": str(args.ttl),
+        "AUTH_TRUST_TOKEN_CLAIMS": "false",
+        "EMAIL_DISPATCHER_MODE": "worker",
+        "SCHEDULE_VIEWS_MODE": "worker",
+    }
+    workers = []
+    try:
+        seeded = seed(args.rounds, env)
+        workers = start_workers(args, args.port, env)
+        return asyncio.run(run(args, [f"http://127.0.0.1:{args.port + index}" for index in range(args.workers)], seeded))
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--bus", default="unix", help="INVALIDATION_BUS of the workers")
+    parser.add_argument("--max-staleness", type=float, default=0.25, help="seconds")
+    parser.add_argument("--ttl", type=float, default=60, help="seconds the caches keep an entry")
+    parser.add_argument("--timeout", type=float, default=5, help="seconds a worker is polled for a write")
+    parser.add_argument("--port", type=int, default=8770)
+    return parser.parse_args(argv)
+
+def main() -> None:
+    args = parse_args()
+    staleness = measure(args)
+
+    print(f"{'cache':<13} {'reads':>6} {'p50 ms':>8} {'max ms':>8}")
+    failed = False
+    for cache, values in staleness.items():
+        print(f"{cache:<13} {len(values):>6} {statistics.median(values) * 1000:>8.1f} {max(values) * 1000:>8.1f}")
+        failed = failed or max(values) > args.max_staleness
+    if failed:
+        print(f"FAILED: a worker served stale data for more than {args.max_staleness}s")
+        sys.exit(1)
+    print(f"OK: every worker served the writes within {args.max_staleness}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Per-request cost of resolving the service dependencies. Calls the ASGI app in-process
+(no server, no network) on endpoints that only differ by how their UserService is provided:
+
+- none: no dependency at all, the cost of the framework alone;
+- per request: a sync factory building a new UserService on every request, as
+  get_user_service did before the services were shared (FastAPI runs sync dependencies
+  on the threadpool);
+- shared: the async app.dependencies.services.get_user_service returning the shared instance.
+
+Runs on the memory storage backend unless STORAGE_BACKEND is set.
+
+Usage: python -m benchmarks.dependency_overhead [--requests 20000]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from fastapi import Depends, FastAPI
+from app.dependencies.services import get_user_service
+from app.services.user_service import UserService
+
+def new_user_service() -> UserService:
+    return UserService()
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/none")
+    async def no_dependency():
+        return {}
+
+    @app.get("/per_request")
+    async def per_request(user_service: UserService = Depends(new_user_service)):
+        return {}
+
+    @app.get("/shared")
+    async def shared(user_service: UserService = Depends(get_user_service)):
+        return {}
+
+    return app
+
+async def call(app: FastAPI, path: str) -> None:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError(f"{path} answered {message['status']}")
+
+    await app(scope, receive, send)
+
+async def measure(app: FastAPI, path: str, requests: int, rounds: int = 5) -> float:
+    for _ in range(min(requests, 1000)):
+        await call(app, path)
+    # Best median of several rounds, in microseconds per request
+    per_round = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(requests // rounds):
+            await call(app, path)
+        per_round.append((time.perf_counter() - start) / (requests // rounds) * 1e6)
+    return statistics.median(per_round)
+
+async def run(args) -> None:
+    app = build_app()
+    results = {label: await measure(app, path, args.requests) for label, path in (("none", "/none"), ("per request", "/per_request"), ("shared", "/shared"))}
+    print(f"{'dependency':<14} {'us/request':>11} {'overhead us':>12}")
+    for label, elapsed in results.items():
+        print(f"{label:<14} {elapsed:>11.1f} {elapsed - results['none']:>12.1f}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
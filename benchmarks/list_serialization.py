@@ -0,0 +1,111 @@
+"""
+Cost of answering the list endpoints with --items documents, with the models path (the
+services build models, FastAPI validates them against the response model and serializes
+them with its default encoder) and with FAST_JSON_RESPONSES (the stored documents are
+shaped like the response model and dumped with orjson, see app.dependencies.serialization).
+
+Calls the ASGI app in-process (no server, no network) on GET /trainings/, GET /users/ and
+GET /notifications/, each container seeded with --items documents, and checks that both
+paths return the same items. The read cache is disabled so that every request runs its query.
+Runs on the memory storage backend unless STORAGE_BACKEND is set.
+
+Usage: python -m benchmarks.list_serialization [--items 10000] [--requests 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("READ_CACHE_MAX_DOCUMENTS", "0")
+
+from app.config.storage import close_storage, get_repository, open_storage
+from app.dependencies.auth import get_current_user
+from app.main import app
+from app.models.user import User
+from app.routers import notifications, trainings, users
+
+ADMIN = User(_id="bench-admin", username="bench-admin", email="admin@example.com", hashed_password="", roles=["admin"])
+PATHS = ("/trainings/", "/users/", "/notifications/")
+
+async def seed(items: int) -> None:
+    start = datetime(2030, 1, 1, 9, tzinfo=timezone.utc)
+    for index in range(items):
+        await get_repository("trainings").upsert({
+            "id": f"bench-training-{index}", "trainer_id": f"bench-trainer-{index % 50}", "user_id": f"bench-member-{index}",
+            "center_id": "bench-center", "start_time": start + timedelta(hours=index), "end_time": start + timedelta(hours=index + 1),
+            "status": "scheduled",
+        })
+        await get_repository("users").upsert({
+            "id": f"bench-member-{index}", "username": f"bench-member-{index}", "email": f"member{index}@example.com",
+            "hashed_password": "$2b$12$" + "x" * 53, "roles": ["user"],
+        })
+        await get_repository("notifications").upsert({
+            "id": f"bench-notification-{index}", "user_id": ADMIN.id, "message": f"Your session {index} was moved",
+            "read": index % 3 == 0, "created_at": start + timedelta(minutes=index), "delivery_status": "sent",
+        })
+
+async def call(path: str) -> bytes:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    body = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError(f"{path} answered {message['status']}")
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+def use_fast_json(enabled: bool) -> None:
+    # The routers read the setting when the request is handled
+    for router in (trainings, users, notifications):
+        router.FAST_JSON_RESPONSES = enabled
+
+async def measure(path: str, requests: int) -> tuple:
+    body = await call(path)
+    elapsed = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await call(path)
+        elapsed.append((time.perf_counter() - start) * 1000)
+    return statistics.median(elapsed), body
+
+def normalized(body: bytes) -> list:
+    # Both paths write the same instants, possibly as "+00:00" or "Z"
+    return [{key: (value.replace("+00:00", "Z") if isinstance(value, str) else value) for key, value in item.items()} for item in json.loads(body)]
+
+async def run(args) -> None:
+    await open_storage()
+    await seed(args.items)
+    app.dependency_overrides[get_current_user] = lambda: ADMIN
+    print(f"{'endpoint':<16} {'models ms':>10} {'fast ms':>10} {'speedup':>8} {'same':>5}")
+    for path in PATHS:
+        use_fast_json(False)
+        models_ms, models_body = await measure(path, args.requests)
+        use_fast_json(True)
+        fast_ms, fast_body = await measure(path, args.requests)
+        same = normalized(models_body) == normalized(fast_body)
+        print(f"{path:<16} {models_ms:>10.1f} {fast_ms:>10.1f} {models_ms / fast_ms:>7.1f}x {'yes' if same else 'NO':>5}")
+    await close_storage()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
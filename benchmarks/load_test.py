@@ -0,0 +1,436 @@
+"""
+Load test of the API replaying a realistic mix of gym traffic, in-process (the ASGI app
+with its lifespan, no server nor network) or against a running server with --url, on a
+dataset of benchmarks.synthetic_data.
+
+--clients virtual users loop for --duration seconds (the first --warmup ones are not
+measured), each one picking its next scenario by weight. --trainer-clients of them log in
+as trainers and are the ones booking; the others are members.
+
+- login: POST /token with the password of the user (bcrypt, in the password hasher pool);
+- trainings: GET /trainings/?limit=20 of the sessions of the user (user_id, or trainer_id);
+- training: GET /trainings/{id} of a random session of the dataset;
+- slots: GET /trainings/availability/slots of the center of the user, over a day;
+- booking (trainers): the free slots of their center over a day, then POST /trainings/ of
+  one of them for a random member, with an Idempotency-Key. A 409 (the slot was taken
+  meanwhile) or a day without free slots counts as a conflict, not as an error;
+- notifications: GET /notifications/?limit=20, then GET /notifications/unread_count.
+
+The latency of a scenario is the time of all its requests, and its RU the sum of their
+X-Storage-Usage headers (set STORAGE_USAGE_HEADER=true on the server; in-process it is).
+--record appends the results to a JSON lines file, tagged with `git describe`. --compare
+checks them against the last run recorded in a file for the same target and exits with 1
+when the p95 of a scenario grew, or its throughput fell, by more than --tolerance.
+
+In-process, the dataset is generated in the STORAGE_BACKEND (memory by default) with the
+volumes of the options below, unless --dataset points at the manifest of one already loaded
+with benchmarks.synthetic_data. Against --url, --dataset is required.
+
+Usage: python -m benchmarks.load_test [--clients 50] [--duration 30] [--warmup 5]
+                                      [--trainer-clients 0.1] [--mix booking=10 login=1 ...]
+                                      [--users 2000] [--trainings 20000] [--notifications 50000]
+                                      [--url http://127.0.0.1:8000] [--dataset synthetic.json]
+                                      [--record load_test.jsonl] [--compare load_test.jsonl]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+from uuid import uuid4
+import aiohttp
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("STORAGE_USAGE_HEADER", "true")
+
+from benchmarks.startup import release
+from benchmarks.synthetic_data import SyntheticDataset, add_dataset_arguments, generate, print_stats
+
+MIX = {"login": 2, "trainings": 25, "training": 20, "slots": 15, "booking": 8, "notifications": 30}
+MEMBER_SCENARIOS = ("login", "trainings", "training", "slots", "notifications")
+TRAINER_SCENARIOS = ("login", "trainings", "training", "slots", "booking", "notifications")
+
+Response = Tuple[int, Dict[str, str], bytes]
+
+class AsgiClient:
+    """
+    Calls the ASGI app in-process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, headers: Dict[str, str], body: bytes = b"") -> Response:
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+            "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+            "headers": [(b"host", b"load-test"), (b"content-length", str(len(body)).encode())]
+            + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            "client": ("127.0.0.1", 50000), "server": ("load-test", 80),
+        }
+        received = False
+        status = 500
+        response_headers: Dict[str, str] = {}
+        chunks: List[bytes] = []
+
+        async def receive():
+            nonlocal received
+            if received:
+                return {"type": "http.disconnect"}
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers.update((name.decode().lower(), value.decode()) for name, value in message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, response_headers, b"".join(chunks)
+
+class HttpClient:
+    """
+    Calls a running server.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, url: str):
+        self.session = session
+        self.url = url.rstrip("/")
+
+    async def request(self, method: str, path: str, headers: Dict[str, str], body: bytes = b"") -> Response:
+        async with self.session.request(method, self.url + path, headers=headers, data=body or None) as response:
+            content = await response.read()
+            return response.status, {name.lower(): value for name, value in response.headers.items()}, content
+
+class ScenarioError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+class Conflict(Exception):
+    """
+    The booking found no free slot, or lost it to a concurrent booking.
+    """
+
+def request_charge(headers: Dict[str, str]) -> float:
+    # X-Storage-Usage: "ru=12.34; db_ms=5.6; ops=3"
+    for part in headers.get("x-storage-usage", "").split(";"):
+        name, _, value = part.strip().partition("=")
+        if name == "ru":
+            return float(value)
+    return 0.0
+
+class VirtualUser:
+    """
+    One client of the load test, logged in as the user `index` of the dataset.
+    """
+
+    def __init__(self, client, dataset: SyntheticDataset, index: int, rng: random.Random):
+        self.client = client
+        self.dataset = dataset
+        self.index = index
+        self.rng = rng
+        self.trainer = index < dataset.trainers
+        self.user_id = dataset.user_id(index)
+        # Members go to a center of their choice
+        self.center_id = dataset.center_id(index if self.trainer else rng.randrange(dataset.trainers))
+        self.token: Optional[str] = None
+        self.request_charge = 0.0
+
+    async def call(self, method: str, path: str, body: bytes = b"", headers: Optional[Dict[str, str]] = None, allowed: Tuple[int, ...] = (200,)) -> Tuple[int, bytes]:
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        status, response_headers, content = await self.client.request(method, path, headers, body)
+        self.request_charge += request_charge(response_headers)
+        if status not in allowed:
+            raise ScenarioError(status)
+        return status, content
+
+    async def login(self) -> None:
+        form = urlencode({"username": self.dataset.username(self.index), "password": self.dataset.password}).encode()
+        self.token = None
+        _, content = await self.call("POST", "/token", form, {"Content-Type": "application/x-www-form-urlencoded"})
+        self.token = json.loads(content)["access_token"]
+
+    async def trainings(self) -> None:
+        owner = "trainer_id" if self.trainer else "user_id"
+        await self.call("GET", f"/trainings/?{owner}={self.user_id}&limit=20")
+
+    async def training(self) -> None:
+        training_id = self.dataset.training_id(self.rng.randrange(self.dataset.trainings))
+        await self.call("GET", f"/trainings/{training_id}", allowed=(200, 404))
+
+    async def _free_slots(self) -> List[Dict[str, Any]]:
+        # A day among the ones with availability left
+        first_day = max((datetime.now(timezone.utc) - self.dataset.start).days + 1, 0)
+        day = self.dataset.start + timedelta(days=self.rng.randrange(first_day, max(self.dataset.days, first_day + 1)))
+        query = urlencode({"center_id": self.center_id, "start": day.isoformat(), "end": (day + timedelta(days=1)).isoformat(), "limit": 50})
+        _, content = await self.call("GET", f"/trainings/availability/slots?{query}")
+        return json.loads(content)
+
+    async def slots(self) -> None:
+        await self._free_slots()
+
+    async def booking(self) -> None:
+        slots = await self._free_slots()
+        own = [slot for slot in slots if slot["trainer_id"] == self.user_id]
+        if not slots:
+            raise Conflict()
+        slot = self.rng.choice(own or slots)
+        body = json.dumps({
+            "trainer_id": slot["trainer_id"],
+            "user_id": self.dataset.user_id(self.rng.randrange(self.dataset.trainers, self.dataset.users)),
+            "center_id": slot["center_id"],
+            "start_time": slot["start_time"],
+            "end_time": slot["end_time"],
+            "status": "scheduled",
+        }).encode()
+        headers = {"Content-Type": "application/json", "Idempotency-Key": str(uuid4())}
+        status, _ = await self.call("POST", "/trainings/", body, headers, allowed=(200, 409))
+        if status == 409:
+            raise Conflict()
+
+    async def notifications(self) -> None:
+        await self.call("GET", "/notifications/?limit=20")
+        await self.call("GET", "/notifications/unread_count")
+
+class Recorder:
+    """
+    Outcome of the scenarios run once the warmup is over.
+    """
+
+    def __init__(self, measure_from: float):
+        self.measure_from = measure_from
+        self.latencies: Dict[str, List[float]] = {}
+        self.request_charges: Dict[str, float] = {}
+        self.conflicts: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.error_causes: Counter = Counter()
+
+    def add(self, scenario: str, started: float, elapsed: float, request_charge: float, outcome: Optional[str] = None) -> None:
+        if started < self.measure_from:
+            return
+        self.latencies.setdefault(scenario, [])
+        self.request_charges[scenario] = self.request_charges.get(scenario, 0.0) + request_charge
+        if outcome is None:
+            self.latencies[scenario].append(elapsed)
+        elif outcome == "conflict":
+            self.conflicts[scenario] += 1
+        else:
+            self.errors[scenario] += 1
+            self.error_causes[(scenario, outcome)] += 1
+
+    def results(self, seconds: float) -> Dict[str, Dict[str, float]]:
+        results = {}
+        for scenario, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            done = len(latencies) + self.conflicts[scenario] + self.errors[scenario]
+            results[scenario] = {
+                "requests": done,
+                "errors": self.errors[scenario],
+                "conflicts": self.conflicts[scenario],
+                "rps": len(latencies) / seconds,
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "ru": self.request_charges[scenario] / done if done else 0.0,
+            }
+        return results
+
+def percentile(values: List[float], quantile: float) -> float:
+    # Nearest rank, in milliseconds
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(int(len(values) * quantile + 0.5) - 1, 0))] * 1000
+
+async def run_scenario(user: VirtualUser, scenario: str, recorder: Recorder) -> None:
+    user.request_charge = 0.0
+    outcome = None
+    started = time.monotonic()
+    try:
+        await getattr(user, scenario)()
+    except Conflict:
+        outcome = "conflict"
+    except ScenarioError as e:
+        outcome = str(e.status)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+        outcome = type(e).__name__
+    recorder.add(scenario, started, time.monotonic() - started, user.request_charge, outcome)
+
+async def virtual_user(user: VirtualUser, mix: Dict[str, float], stop_at: float, think: float, recorder: Recorder) -> None:
+    scenarios = [scenario for scenario in (TRAINER_SCENARIOS if user.trainer else MEMBER_SCENARIOS) if mix.get(scenario)]
+    weights = [mix[scenario] for scenario in scenarios]
+    while time.monotonic() < stop_at:
+        # Log in first, and again if the last login failed
+        scenario = "login" if user.token is None else user.rng.choices(scenarios, weights)[0]
+        await run_scenario(user, scenario, recorder)
+        if think:
+            await asyncio.sleep(user.rng.expovariate(1 / think))
+
+async def first_login(user: VirtualUser) -> None:
+    while True:
+        try:
+            return await user.login()
+        except ScenarioError as e:
+            # The password hasher is busy
+            if e.status != 503:
+                raise
+        await asyncio.sleep(1)
+
+async def load(client, dataset: SyntheticDataset, args) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(args.seed)
+    trainer_clients = round(args.clients * args.trainer_clients) if args.mix.get("booking") else 0
+    users = []
+    for number in range(args.clients):
+        index = rng.randrange(dataset.trainers) if number < trainer_clients else rng.randrange(dataset.trainers, dataset.users)
+        users.append(VirtualUser(client, dataset, index, random.Random(f"{args.seed}-{number}")))
+    # Logged in before the clock starts, so that the burst of first logins is not measured
+    await asyncio.gather(*(first_login(user) for user in users))
+    started = time.monotonic()
+    recorder = Recorder(started + args.warmup)
+    await asyncio.gather(*(virtual_user(user, args.mix, started + args.warmup + args.duration, args.think, recorder) for user in users))
+    for (scenario, cause), count in sorted(recorder.error_causes.items()):
+        print(f"  {scenario}: {count} errors ({cause})", file=sys.stderr)
+    return recorder.results(time.monotonic() - recorder.measure_from)
+
+async def run_in_process(dataset: SyntheticDataset, args) -> Dict[str, Dict[str, float]]:
+    # Imported here: the app reads its settings (STORAGE_BACKEND...) when it is imported
+    from app.config.storage import close_storage, open_storage
+    from app.main import app
+
+    if not args.dataset:
+        print(f"{'container':<22} {'documents':>10} {'seconds':>9} {'docs/s':>10} {'RU':>12}")
+        await open_storage()
+        try:
+            await generate(dataset, args.concurrency, print_stats)
+        finally:
+            await close_storage()
+    async with app.router.lifespan_context(app):
+        return await load(AsgiClient(app), dataset, args)
+
+async def run_over_http(dataset: SyntheticDataset, args) -> Dict[str, Dict[str, float]]:
+    connector = aiohttp.TCPConnector(limit=args.clients)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=args.timeout)) as session:
+        return await load(HttpClient(session, args.url), dataset, args)
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'scenario':<14} {'requests':>9} {'errors':>7} {'conflicts':>9} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RU':>8}")
+    for scenario, stats in results.items():
+        print(
+            f"{scenario:<14} {stats['requests']:>9} {stats['errors']:>7} {stats['conflicts']:>9} {stats['rps']:>9.1f} "
+            f"{stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['p99']:>9.1f} {stats['ru']:>8.2f}"
+        )
+
+def last_record(path: str, target: str) -> Optional[Dict[str, Any]]:
+    record = None
+    try:
+        with open(path) as records:
+            for line in records:
+                if line.strip() and json.loads(line).get("target") == target:
+                    record = json.loads(line)
+    except FileNotFoundError:
+        pass
+    return record
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """
+    Print the changes against the baseline run and return whether any scenario regressed.
+    """
+    print(f"\nCompared with {baseline['release']} ({baseline['date']}):")
+    print(f"{'scenario':<14} {'p95 ms':>17} {'rps':>17}")
+    regressed = False
+    for scenario, stats in results.items():
+        before = baseline["scenarios"].get(scenario)
+        if not before or not before["p95"] or not before["rps"]:
+            continue
+        p95_change = stats["p95"] / before["p95"] - 1
+        rps_change = stats["rps"] / before["rps"] - 1
+        regression = p95_change > tolerance or rps_change < -tolerance
+        regressed |= regression
+        print(f"{scenario:<14} {before['p95']:>8.1f} {p95_change:>+7.0%} {before['rps']:>8.1f} {rps_change:>+7.0%}{'  REGRESSION' if regression else ''}")
+    return regressed
+
+def parse_mix(values: List[str]) -> Dict[str, float]:
+    mix = dict(MIX)
+    for value in values:
+        scenario, _, weight = value.partition("=")
+        if scenario not in MIX:
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{scenario}', expected one of {', '.join(MIX)}")
+        mix[scenario] = float(weight)
+    return mix
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds measured")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds run before measuring")
+    parser.add_argument("--think", type=float, default=0, help="Mean seconds a client waits between scenarios")
+    parser.add_argument("--trainer-clients", type=float, default=0.1, help="Share of the clients logged in as trainers")
+    parser.add_argument("--mix", nargs="*", default=[], help="Weights of the scenarios, as scenario=weight")
+    parser.add_argument("--url", help="Server to load (default: the app in-process)")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds before a request to --url fails")
+    parser.add_argument("--dataset", help="Manifest written by benchmarks.synthetic_data for the data already loaded")
+    add_dataset_arguments(parser, users=2000, trainers=40, trainings=20000, notifications=50000)
+    parser.add_argument("--concurrency", type=int, default=200, help="Upserts in flight while generating the dataset")
+    parser.add_argument("--record", help="JSON lines file the results are appended to")
+    parser.add_argument("--compare", help="JSON lines file with the run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change of p95 or throughput taken as a regression")
+    args = parser.parse_args()
+    try:
+        args.mix = parse_mix(args.mix)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if args.url and not args.dataset:
+        parser.error("--dataset is required with --url")
+
+    if args.dataset:
+        with open(args.dataset) as manifest:
+            dataset = SyntheticDataset.from_manifest(json.load(manifest))
+    else:
+        dataset = SyntheticDataset(
+            args.users, args.trainers, args.centers, args.trainings, args.notifications, args.days,
+            seed=args.seed, prefix=args.prefix, password=args.password,
+        )
+    target = args.url or f"in-process/{os.environ['STORAGE_BACKEND']}"
+    results = asyncio.run(run_over_http(dataset, args) if args.url else run_in_process(dataset, args))
+    print_results(results)
+
+    regressed = False
+    if args.compare:
+        baseline = last_record(args.compare, target)
+        if baseline is None:
+            print(f"\nNo run against {target} recorded in {args.compare}")
+        else:
+            regressed = compare(results, baseline, args.tolerance)
+    if args.record:
+        record = {
+            "release": release(),
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "target": target,
+            "clients": args.clients,
+            "duration": args.duration,
+            "trainer_clients": args.trainer_clients,
+            "mix": args.mix,
+            "dataset": dataset.to_manifest(),
+            "scenarios": results,
+        }
+        with open(args.record, "a") as output:
+            output.write(json.dumps(record) + "\n")
+    if regressed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
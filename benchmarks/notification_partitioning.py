@@ -0,0 +1,109 @@
+"""
+Request charge and latency of per-user notification reads, comparing the previous
+cross-partition access (user_id filter fanning out to every physical partition, point
+reads on the wrong partition key followed by a query) with the single-partition access
+of NotificationService.
+
+The container is seeded with --notifications documents spread over --users users.
+Runs in-process on the memory storage backend unless STORAGE_BACKEND is set, with the
+RU model of app.repositories.base over EMULATED_PHYSICAL_PARTITIONS physical partitions.
+Use --skip-seed against a Cosmos container that is already populated.
+
+Usage: python -m benchmarks.notification_partitioning [--notifications 1000000] [--users 10000]
+                                                      [--samples 200] [--skip-seed]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("EMULATED_PHYSICAL_PARTITIONS", "10")
+
+from app.config.storage import close_storage, get_repository, open_storage
+from app.repositories.base import ItemNotFoundError
+from app.services.notification_service import NotificationService
+
+def notification_id(index: int) -> str:
+    return f"bench-notification-{index}"
+
+def user_id(index: int, users: int) -> str:
+    return f"bench-user-{index % users}"
+
+async def seed(repository, args) -> None:
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def create(index: int) -> None:
+        async with semaphore:
+            await repository.upsert({
+                "id": notification_id(index),
+                "user_id": user_id(index, args.users),
+                "message": f"Notification {index}",
+                "read": False,
+                "created_at": "2030-01-01T10:00:00Z",
+                "delivery_status": "sent",
+            })
+
+    for start in range(0, args.notifications, 10000):
+        await asyncio.gather(*(create(index) for index in range(start, min(start + 10000, args.notifications))))
+    print(f"seeded {args.notifications} notifications for {args.users} users in {time.perf_counter() - started:.1f}s")
+
+async def measure(label: str, repository, operation, samples) -> None:
+    charge_before = repository.total_request_charge
+    latencies = []
+    for sample in samples:
+        start = time.perf_counter()
+        await operation(sample)
+        latencies.append((time.perf_counter() - start) * 1000)
+    charge = (repository.total_request_charge - charge_before) / len(samples)
+    latencies.sort()
+    print(f"{label:<34} {charge:>9.2f} {statistics.median(latencies):>9.2f} {latencies[int(len(latencies) * 0.99) - 1]:>9.2f}")
+
+async def run(args) -> None:
+    await open_storage()
+    repository = get_repository("notifications")
+    if not args.skip_seed:
+        await seed(repository, args)
+    service = NotificationService()
+    rng = random.Random(42)
+    samples = [rng.randrange(args.notifications) for _ in range(args.samples)]
+
+    async def list_cross_partition(index: int) -> None:
+        [item async for item in repository.query([("user_id", "=", user_id(index, args.users))])]
+
+    async def list_single_partition(index: int) -> None:
+        await service.get_notifications(user_id(index, args.users))
+
+    async def read_by_id(index: int) -> None:
+        # What update/delete did before: a point read with the notification id as partition key
+        # misses, and locating the document then needs a cross-partition query
+        try:
+            await repository.read(notification_id(index), notification_id(index))
+        except ItemNotFoundError:
+            [item async for item in repository.query([("id", "=", notification_id(index))])]
+
+    async def read_in_partition(index: int) -> None:
+        await service.get_notification(notification_id(index), user_id(index, args.users))
+
+    print(f"{'operation':<34} {'RU/op':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    await measure("list, cross-partition", repository, list_cross_partition, samples)
+    await measure("list, single partition", repository, list_single_partition, samples)
+    await measure("point read, wrong partition key", repository, read_by_id, samples)
+    await measure("point read, user partition", repository, read_in_partition, samples)
+    await close_storage()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notifications", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
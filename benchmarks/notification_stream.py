@@ -0,0 +1,78 @@
+"""
+Fan-out benchmark of the notification streams: opens --connections idle Server-Sent
+Events streams on GET /notifications/stream of a running API, creates --notifications
+notifications for the streaming user and measures how long each one takes to reach
+every stream.
+
+All the streams belong to --username (an admin, so that it can create notifications),
+which is the worst case for the per-user fan-out. Raise the open file limit (ulimit -n)
+before opening thousands of connections.
+
+Usage: python -m benchmarks.notification_stream --url http://127.0.0.1:8000
+                                                [--connections 2000] [--notifications 20]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import aiohttp
+
+async def login(session: aiohttp.ClientSession, url: str, username: str, password: str) -> dict:
+    async with session.post(url + "/token", data={"username": username, "password": password}) as response:
+        response.raise_for_status()
+        body = await response.json()
+        return {"token": body["access_token"], "id": body.get("id")}
+
+async def listen(session: aiohttp.ClientSession, url: str, headers: dict, ready: asyncio.Event, received: dict, expected: int) -> None:
+    async with session.get(url + "/notifications/stream", headers=headers, timeout=aiohttp.ClientTimeout(total=None)) as response:
+        response.raise_for_status()
+        ready.set()
+        count = 0
+        async for line in response.content:
+            if line.startswith(b"data:"):
+                message = line.decode().split('"message":"', 1)[1].split('"', 1)[0]
+                received.setdefault(message, []).append(time.perf_counter())
+                count += 1
+                if count >= expected:
+                    return
+
+async def run(args) -> None:
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        user = await login(session, args.url, args.username, args.password)
+        headers = {"Authorization": f"Bearer {user['token']}"}
+        received: dict = {}
+        events = [asyncio.Event() for _ in range(args.connections)]
+        started = time.perf_counter()
+        listeners = [asyncio.create_task(listen(session, args.url, headers, event, received, args.notifications)) for event in events]
+        await asyncio.gather(*(event.wait() for event in events))
+        print(f"opened {args.connections} streams in {time.perf_counter() - started:.2f}s")
+
+        sent_at = {}
+        for index in range(args.notifications):
+            message = f"stream-bench-{index}"
+            sent_at[message] = time.perf_counter()
+            async with session.post(args.url + "/notifications/", json={"user_id": user["id"], "message": message}, headers=headers) as response:
+                response.raise_for_status()
+            await asyncio.sleep(args.interval)
+        await asyncio.wait_for(asyncio.gather(*listeners), timeout=60)
+
+    # Time for a notification to reach the last of the streams
+    fan_out = [(max(received[message]) - sent) * 1000 for message, sent in sent_at.items()]
+    delivered = sum(len(times) for times in received.values())
+    print(f"delivered {delivered}/{args.connections * args.notifications} events, "
+          f"fan-out p50={statistics.median(fan_out):.1f}ms max={max(fan_out):.1f}ms")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--notifications", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.2)
+    parser.add_argument("--username", default="admin1")
+    parser.add_argument("--password", default="password3")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+End-to-end notification throughput: time to create notifications through
+NotificationService and for the outbox dispatcher to deliver all their emails with
+the fake sender.
+
+Runs in-process on the memory storage backend unless STORAGE_BACKEND is set.
+
+Usage: python -m benchmarks.notification_throughput [--notifications 5000] [--concurrency 200]
+                                                     [--users 500] [--latency-ms 50] [--failure-rate 0.0]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from app.config.storage import close_storage, get_repository, open_storage
+from app.schemas.notification import NotificationCreate
+from app.services.email_dispatcher import EmailDispatcher, email_dispatcher
+from app.services.email_sender import FakeEmailSender
+from app.services.notification_service import NotificationService
+
+async def run(args) -> None:
+    await open_storage()
+    users = get_repository("users")
+    for index in range(args.users):
+        await users.upsert({"id": f"bench-user-{index}", "username": f"bench-user-{index}", "email": f"bench-user-{index}@example.com", "hashed_password": "", "roles": ["user"]})
+
+    sender = FakeEmailSender(latency_ms=args.latency_ms, failure_rate=args.failure_rate)
+    dispatcher = EmailDispatcher(sender=sender, batch_size=args.batch_size, max_attempts=args.max_attempts)
+    # NotificationService wakes up the shared dispatcher, route the wake-ups to ours
+    email_dispatcher.notify = dispatcher.notify
+    await dispatcher.start()
+
+    service = NotificationService()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def create(index: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await service.create_notification(NotificationCreate(user_id=f"bench-user-{index % args.users}", message=f"Notification {index}"))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(create(index) for index in range(args.notifications)))
+    created = time.perf_counter() - started
+    while dispatcher.sent + dispatcher.dead_lettered < args.notifications:
+        await asyncio.sleep(0.01)
+    delivered = time.perf_counter() - started
+    await dispatcher.stop()
+    await close_storage()
+
+    latencies.sort()
+    print(f"created   {args.notifications} notifications in {created:.2f}s ({args.notifications / created:.0f}/s), "
+          f"p50={statistics.median(latencies):.2f}ms p99={latencies[int(len(latencies) * 0.99) - 1]:.2f}ms")
+    print(f"delivered {dispatcher.sent} emails in {delivered:.2f}s ({dispatcher.sent / delivered:.0f}/s), "
+          f"retries={dispatcher.retried} dead-lettered={dispatcher.dead_lettered}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notifications", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
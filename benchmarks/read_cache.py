@@ -0,0 +1,99 @@
+"""
+A class release: bursts of --concurrency identical GET /trainings/ and GET /trainings/availability
+listings arriving together, served by TrainingService with and without the read cache of
+app.services.read_cache. Reports the queries that reached the repository, their request
+charge and the latency of the listings.
+
+The trainings and availabilities containers are seeded with --trainings and --availabilities
+documents. Runs in-process on the memory storage backend unless STORAGE_BACKEND is set.
+
+Usage: python -m benchmarks.read_cache [--trainings 5000] [--availabilities 500]
+                                       [--concurrency 200] [--bursts 20] [--interval 0.2]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from app.config.storage import close_storage, get_repository, open_storage
+from app.services.read_cache import ReadCache
+from app.services import training_service as training_module
+from app.services.training_service import TrainingService
+
+async def seed(args) -> None:
+    trainings, availabilities = get_repository("trainings"), get_repository("availabilities")
+    start = datetime(2030, 1, 1, 9, tzinfo=timezone.utc)
+    for index in range(args.trainings):
+        await trainings.upsert({
+            "id": f"bench-training-{index}",
+            "trainer_id": f"bench-trainer-{index % 50}",
+            "user_id": f"bench-member-{index}",
+            "center_id": "bench-center",
+            "start_time": start + timedelta(hours=index),
+            "end_time": start + timedelta(hours=index + 1),
+            "status": "scheduled",
+        })
+    for index in range(args.availabilities):
+        await availabilities.upsert({
+            "id": f"bench-availability-{index}",
+            "trainer_id": f"bench-trainer-{index % 50}",
+            "center_id": "bench-center",
+            "available_times": [start + timedelta(days=index, hours=hour) for hour in range(8)],
+        })
+
+async def measure(label: str, service: TrainingService, args) -> None:
+    repositories = [service.training_repository, service.availability_repository]
+    queries_before = sum(repository.stats.get("query", {}).get("count", 0) for repository in repositories)
+    charge_before = sum(repository.total_request_charge for repository in repositories)
+    latencies = []
+
+    async def listing(operation) -> None:
+        start = time.perf_counter()
+        await operation()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    for _ in range(args.bursts):
+        await asyncio.gather(*(
+            listing(service.get_trainings if index % 2 else service.get_availabilities) for index in range(args.concurrency)
+        ))
+        await asyncio.sleep(args.interval)
+    elapsed = time.perf_counter() - started - args.bursts * args.interval
+    queries = sum(repository.stats.get("query", {}).get("count", 0) for repository in repositories) - queries_before
+    charge = sum(repository.total_request_charge for repository in repositories) - charge_before
+    latencies.sort()
+    print(
+        f"{label:<10} {queries:>8} {charge:>10.0f} {len(latencies) / elapsed:>10.0f}"
+        f" {statistics.median(latencies):>8.1f} {latencies[int(len(latencies) * 0.99) - 1]:>8.1f}"
+    )
+
+async def run(args) -> None:
+    await open_storage()
+    await seed(args)
+    service = TrainingService()
+    print(f"{'cache':<10} {'queries':>8} {'RU':>10} {'lists/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, max_documents in (("off", 0), ("on", 10 * (args.trainings + args.availabilities))):
+        # The service reads the module singletons, replaced for each run
+        training_module.training_cache = ReadCache("trainings", max_documents=max_documents)
+        training_module.availability_cache = ReadCache("availabilities", max_documents=max_documents)
+        await measure(label, service, args)
+        if max_documents:
+            print(f"trainings cache: {training_module.training_cache.stats()}")
+    await close_storage()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trainings", type=int, default=5000)
+    parser.add_argument("--availabilities", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between bursts")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Request charge and latency of reading a week of schedule, comparing the query on the
+trainings container (trainer_id or user_id filter and start time window, fanning out to
+every partition since trainings are partitioned by id) with the 7 point reads of the
+materialized schedule views.
+
+The trainings container is seeded with --trainings trainings spread over --trainers
+trainers, --members members and --days days, then the views are built by draining the
+change feed. Runs in-process on the memory storage backend unless STORAGE_BACKEND is set,
+with the RU model of app.repositories.base over EMULATED_PHYSICAL_PARTITIONS physical partitions.
+
+Usage: python -m benchmarks.schedule_views [--trainings 50000] [--trainers 200] [--members 5000]
+                                           [--days 90] [--samples 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta, timezone
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("EMULATED_PHYSICAL_PARTITIONS", "10")
+# Measure the queries themselves, not the read cache in front of them
+os.environ.setdefault("READ_CACHE_MAX_DOCUMENTS", "0")
+
+from app.config.storage import close_storage, get_repository, open_storage
+from app.schemas.training import TrainingFilter
+from app.services.schedule_views import schedule_views
+from app.services.training_service import TrainingService
+
+FIRST_DAY = date(2030, 1, 1)
+
+async def seed(args) -> None:
+    repository = get_repository("trainings")
+    rng = random.Random(42)
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(200)
+
+    async def create(index: int) -> None:
+        start = datetime.combine(FIRST_DAY, datetime.min.time(), timezone.utc) + timedelta(days=rng.randrange(args.days), hours=rng.randrange(8, 20))
+        async with semaphore:
+            await repository.upsert({
+                "id": f"bench-training-{index}",
+                "trainer_id": f"bench-trainer-{index % args.trainers}",
+                "user_id": f"bench-member-{rng.randrange(args.members)}",
+                "center_id": "bench-center",
+                "start_time": start,
+                "end_time": start + timedelta(hours=1),
+                "status": "scheduled",
+            })
+
+    await asyncio.gather(*(create(index) for index in range(args.trainings)))
+    print(f"seeded {args.trainings} trainings in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    changes = await schedule_views.catch_up()
+    print(f"built the views from {changes} changes in {time.perf_counter() - started:.1f}s")
+
+async def measure(label: str, repositories, operation, samples) -> None:
+    charge_before = sum(repository.total_request_charge for repository in repositories)
+    latencies = []
+    for sample in samples:
+        start = time.perf_counter()
+        await operation(sample)
+        latencies.append((time.perf_counter() - start) * 1000)
+    charge = (sum(repository.total_request_charge for repository in repositories) - charge_before) / len(samples)
+    latencies.sort()
+    print(f"{label:<30} {charge:>9.2f} {statistics.median(latencies):>9.2f} {latencies[int(len(latencies) * 0.99) - 1]:>9.2f}")
+
+async def run(args) -> None:
+    await open_storage()
+    await seed(args)
+    service = TrainingService()
+    repositories = [get_repository(name) for name in ("trainings", "trainer_schedules", "member_schedules")]
+    rng = random.Random(7)
+    samples = [(rng.randrange(args.trainers), rng.randrange(args.members), FIRST_DAY + timedelta(days=rng.randrange(args.days - 7))) for _ in range(args.samples)]
+
+    def window(start: date) -> dict:
+        start_from = datetime.combine(start, datetime.min.time(), timezone.utc)
+        return {"start_from": start_from, "start_to": start_from + timedelta(days=7)}
+
+    async def trainer_query(sample) -> None:
+        await service.get_trainings(TrainingFilter(trainer_id=f"bench-trainer-{sample[0]}", **window(sample[2])))
+
+    async def trainer_views(sample) -> None:
+        await service.get_trainer_schedule(f"bench-trainer-{sample[0]}", sample[2])
+
+    async def member_query(sample) -> None:
+        await service.get_trainings(TrainingFilter(user_id=f"bench-member-{sample[1]}", **window(sample[2])))
+
+    async def member_views(sample) -> None:
+        await service.get_member_schedule(f"bench-member-{sample[1]}", sample[2])
+
+    print(f"{'week of schedule':<30} {'RU/op':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    await measure("trainer, trainings query", repositories, trainer_query, samples)
+    await measure("trainer, view point reads", repositories, trainer_views, samples)
+    await measure("member, trainings query", repositories, member_query, samples)
+    await measure("member, view point reads", repositories, member_views, samples)
+    await close_storage()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trainings", type=int, default=50000)
+    parser.add_argument("--trainers", type=int, default=200)
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
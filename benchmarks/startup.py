@@ -0,0 +1,103 @@
+"""
+Boot time of a worker: each run starts a fresh interpreter that imports app.main and runs
+the application lifespan (telemetry, storage clients, background processors), the work a
+uvicorn or gunicorn worker does before it accepts requests. With --uvicorn, a real server is
+started instead and timed until GET /health/ready answers 200.
+
+Runs on the storage backend and telemetry settings of the environment; set STORAGE_BACKEND=memory
+to leave Cosmos out. Track it per release by appending the results to a JSON lines file with
+--record (one line per run of the benchmark, tagged with `git describe`).
+
+Usage: python -m benchmarks.startup [--runs 5] [--uvicorn] [--record startup.jsonl]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+
+async def boot():
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+
+ready = asyncio.run(boot())
+print(json.dumps({"import": imported - started, "lifespan": ready - imported}))
+"""
+
+def boot_in_process() -> dict:
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD], capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - started
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["process"] = total
+    return timings
+
+def boot_uvicorn(port: int, timeout: float) -> dict:
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health/ready", timeout=1) as response:
+                    if response.status == 200:
+                        return {"ready": time.perf_counter() - started}
+            except OSError:
+                pass
+            time.sleep(0.02)
+        raise TimeoutError(f"The server was not ready after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+def release() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--tags", "--always", "--dirty"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--uvicorn", action="store_true", help="time a uvicorn server until it is ready")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--record", help="JSON lines file the results are appended to")
+    args = parser.parse_args()
+
+    runs = [boot_uvicorn(args.port, args.timeout) if args.uvicorn else boot_in_process() for _ in range(args.runs)]
+    summary = {}
+    print(f"{'seconds':<10} {'p50':>8} {'max':>8}")
+    for phase in runs[0]:
+        values = [run[phase] for run in runs]
+        summary[phase] = {"p50": statistics.median(values), "max": max(values)}
+        print(f"{phase:<10} {summary[phase]['p50']:>8.3f} {summary[phase]['max']:>8.3f}")
+
+    if args.record:
+        record = {
+            "release": release(),
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "storage_backend": os.getenv("STORAGE_BACKEND", "cosmos"),
+            "mode": "uvicorn" if args.uvicorn else "in_process",
+            "runs": args.runs,
+            "seconds": summary,
+        }
+        with open(args.record, "a") as output:
+            output.write(json.dumps(record) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Synthetic gym data for the load tests: members and trainers (with their username index
+entries), the weekly availability of the trainers, training sessions around today and the
+notifications of the members (with their unread counters), at realistic volumes.
+
+The documents are written with concurrent upserts (--concurrency in flight) to the
+configured STORAGE_BACKEND, so that a Cosmos account, the emulator or a sqlite file can be
+loaded once and then load-tested with benchmarks.load_test. The data is deterministic for a
+given --seed and the same volumes; --manifest saves what benchmarks.load_test needs to know
+about it (ids, usernames, password, centers, time window). Every synthetic user has the
+password --password, hashed once.
+
+- users: --trainers trainers (one center each) and the rest members;
+- availabilities: one document per trainer and day for the next --days days, hourly slots
+  from 07:00 to 21:00 UTC;
+- trainings: sessions of a random member with a random trainer, --days days back (completed)
+  and ahead (scheduled), some cancelled;
+- notifications: spread over the members in the last --days days, most of them read (they
+  then expire like the ones read through the API).
+
+Usage: python -m benchmarks.synthetic_data [--users 100000] [--trainers 1000] [--centers 20]
+                                           [--trainings 1000000] [--notifications 5000000]
+                                           [--days 90] [--concurrency 200] [--seed 1]
+                                           [--manifest synthetic.json]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+from app.config.storage import close_storage, get_repository, open_storage
+from app.repositories.instrumented import track_storage_usage
+from app.services.notification_service import NOTIFICATION_READ_TTL_SECONDS
+from app.services.password_hasher import pwd_context
+from app.services.user_service import username_index_id
+
+FIRST_HOUR = 7
+LAST_HOUR = 21
+CANCELLED_SHARE = 0.08
+READ_SHARE = 0.7
+MESSAGES = (
+    "Your session with {trainer} on {day} is confirmed",
+    "Your session of {day} was moved by {trainer}",
+    "Reminder: session with {trainer} tomorrow",
+    "{trainer} cancelled the session of {day}",
+    "New classes available at your center",
+)
+
+class SyntheticDataset:
+    """
+    Ids and documents of a synthetic dataset. Users 0 to `trainers` - 1 are the trainers,
+    the rest are members; trainer `i` works at center `i % centers`.
+    """
+
+    def __init__(
+        self,
+        users: int,
+        trainers: int,
+        centers: int,
+        trainings: int,
+        notifications: int,
+        days: int,
+        start: Optional[datetime] = None,
+        seed: int = 1,
+        prefix: str = "synthetic",
+        password: str = "synthetic-password",
+    ):
+        if not 0 < trainers < users:
+            raise ValueError("There must be at least one trainer and one member.")
+        self.users = users
+        self.trainers = trainers
+        self.centers = min(centers, trainers)
+        self.trainings = trainings
+        self.notifications = notifications
+        self.days = days
+        # Midnight UTC of the day the data was generated
+        self.start = (start or datetime.now(timezone.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.seed = seed
+        self.prefix = prefix
+        self.password = password
+
+    @property
+    def members(self) -> int:
+        return self.users - self.trainers
+
+    def user_id(self, index: int) -> str:
+        return f"{self.prefix}-user-{index}"
+
+    def username(self, index: int) -> str:
+        return f"{self.prefix}-trainer-{index}" if index < self.trainers else f"{self.prefix}-member-{index}"
+
+    def center_id(self, trainer: int) -> str:
+        return f"{self.prefix}-center-{trainer % self.centers}"
+
+    def training_id(self, index: int) -> str:
+        return f"{self.prefix}-training-{index}"
+
+    def _random(self, kind: str) -> random.Random:
+        return random.Random(f"{self.seed}-{kind}")
+
+    def user_documents(self) -> Iterator[Dict[str, Any]]:
+        hashed_password = pwd_context.hash(self.password)
+        for index in range(self.users):
+            yield {
+                "id": self.user_id(index),
+                "username": self.username(index),
+                "email": f"{self.username(index)}@example.com",
+                "hashed_password": hashed_password,
+                "roles": ["trainer"] if index < self.trainers else ["user"],
+            }
+
+    def username_documents(self) -> Iterator[Dict[str, Any]]:
+        for index in range(self.users):
+            yield {"id": username_index_id(self.username(index)), "username": self.username(index), "user_id": self.user_id(index)}
+
+    def availability_documents(self) -> Iterator[Dict[str, Any]]:
+        for trainer in range(self.trainers):
+            for day in range(self.days):
+                midnight = self.start + timedelta(days=day)
+                yield {
+                    "id": f"{self.prefix}-availability-{trainer}-{day}",
+                    "trainer_id": self.user_id(trainer),
+                    "center_id": self.center_id(trainer),
+                    "available_times": [midnight + timedelta(hours=hour) for hour in range(FIRST_HOUR, LAST_HOUR)],
+                }
+
+    def training_documents(self) -> Iterator[Dict[str, Any]]:
+        rng = self._random("trainings")
+        for index in range(self.trainings):
+            trainer = rng.randrange(self.trainers)
+            member = rng.randrange(self.trainers, self.users)
+            start_time = self.start + timedelta(days=rng.randrange(-self.days, self.days), hours=rng.randrange(FIRST_HOUR, LAST_HOUR))
+            if rng.random() < CANCELLED_SHARE:
+                status = "cancelled"
+            else:
+                status = "completed" if start_time < self.start else "scheduled"
+            yield {
+                "id": self.training_id(index),
+                "trainer_id": self.user_id(trainer),
+                "user_id": self.user_id(member),
+                "center_id": self.center_id(trainer),
+                "start_time": start_time,
+                "end_time": start_time + timedelta(hours=1),
+                "status": status,
+            }
+
+    def notification_documents(self, unread: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        :param unread: Filled with the number of unread notifications of each member.
+        """
+        rng = self._random("notifications")
+        for index in range(self.notifications):
+            user_id = self.user_id(rng.randrange(self.trainers, self.users))
+            created_at = self.start - timedelta(seconds=rng.randrange(self.days * 24 * 3600))
+            trainer = self.username(rng.randrange(self.trainers))
+            document = {
+                "id": f"{self.prefix}-notification-{index}",
+                "user_id": user_id,
+                "message": rng.choice(MESSAGES).format(trainer=trainer, day=created_at.date().isoformat()),
+                "read": rng.random() < READ_SHARE,
+                "created_at": created_at,
+                "delivery_status": "sent",
+                "delivered_at": created_at + timedelta(seconds=rng.randrange(1, 30)),
+            }
+            if document["read"] and NOTIFICATION_READ_TTL_SECONDS > 0:
+                document["ttl"] = NOTIFICATION_READ_TTL_SECONDS
+            elif unread is not None:
+                unread[user_id] = unread.get(user_id, 0) + 1
+            yield document
+
+    def to_manifest(self) -> Dict[str, Any]:
+        return {
+            "users": self.users, "trainers": self.trainers, "centers": self.centers, "trainings": self.trainings,
+            "notifications": self.notifications, "days": self.days, "start": self.start.isoformat(), "seed": self.seed,
+            "prefix": self.prefix, "password": self.password,
+        }
+
+    @classmethod
+    def from_manifest(cls, manifest: Dict[str, Any]) -> "SyntheticDataset":
+        return cls(**{**manifest, "start": datetime.fromisoformat(manifest["start"])})
+
+async def bulk_upsert(container: str, documents: Iterable[Dict[str, Any]], concurrency: int) -> Dict[str, float]:
+    """
+    Upsert the documents with at most `concurrency` upserts in flight. The documents are
+    consumed as they are written, so that millions of them never sit in memory.
+
+    :raises Exception: The first error of an upsert, once the upserts in flight are cancelled.
+    """
+    repository = get_repository(container)
+    request_charge = 0.0
+    written = 0
+    pending = set()
+
+    async def upsert(document: Dict[str, Any]) -> None:
+        nonlocal request_charge
+        with track_storage_usage() as usage:
+            await repository.upsert(document)
+        request_charge += usage.request_charge
+
+    start = time.perf_counter()
+    try:
+        for document in documents:
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            pending.add(asyncio.ensure_future(upsert(document)))
+            written += 1
+        if pending:
+            done, pending = await asyncio.wait(pending)
+            for task in done:
+                task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+    elapsed = time.perf_counter() - start
+    return {"documents": written, "seconds": elapsed, "ru": request_charge}
+
+async def generate(dataset: SyntheticDataset, concurrency: int, report: Callable[[str, Dict[str, float]], None] = lambda container, stats: None) -> None:
+    """
+    Write the whole dataset to the storage backend, container after container.
+    """
+    unread: Dict[str, int] = {}
+    loads = (
+        ("users", dataset.user_documents),
+        ("usernames", dataset.username_documents),
+        ("availabilities", dataset.availability_documents),
+        ("trainings", dataset.training_documents),
+        ("notifications", lambda: dataset.notification_documents(unread)),
+        ("notification_counters", lambda: ({"id": user_id, "unread": count} for user_id, count in unread.items())),
+    )
+    for container, documents in loads:
+        report(container, await bulk_upsert(container, documents(), concurrency))
+
+def print_stats(container: str, stats: Dict[str, float]) -> None:
+    rate = stats["documents"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"{container:<22} {int(stats['documents']):>10} {stats['seconds']:>9.1f} {rate:>10.0f} {stats['ru']:>12.0f}", flush=True)
+
+async def run(args) -> None:
+    dataset = SyntheticDataset(
+        args.users, args.trainers, args.centers, args.trainings, args.notifications, args.days,
+        seed=args.seed, prefix=args.prefix, password=args.password,
+    )
+    await open_storage()
+    try:
+        print(f"{'container':<22} {'documents':>10} {'seconds':>9} {'docs/s':>10} {'RU':>12}")
+        await generate(dataset, args.concurrency, print_stats)
+    finally:
+        await close_storage()
+    if args.manifest:
+        with open(args.manifest, "w") as output:
+            json.dump(dataset.to_manifest(), output, indent=2)
+
+def add_dataset_arguments(parser: argparse.ArgumentParser, users: int, trainers: int, trainings: int, notifications: int) -> None:
+    parser.add_argument("--users", type=int, default=users)
+    parser.add_argument("--trainers", type=int, default=trainers)
+    parser.add_argument("--centers", type=int, default=20)
+    parser.add_argument("--trainings", type=int, default=trainings)
+    parser.add_argument("--notifications", type=int, default=notifications)
+    parser.add_argument("--days", type=int, default=90, help="Days of trainings and availability ahead (and of history back)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--prefix", default="synthetic", help="Prefix of the ids and usernames")
+    parser.add_argument("--password", default="synthetic-password")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_dataset_arguments(parser, users=100000, trainers=1000, trainings=1000000, notifications=5000000)
+    parser.add_argument("--concurrency", type=int, default=200, help="Upserts in flight")
+    parser.add_argument("--manifest", help="JSON file describing the dataset, for benchmarks.load_test")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
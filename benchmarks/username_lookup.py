@@ -0,0 +1,59 @@
+"""
+Compare resolving a username with the cross-partition query used before the
+username index existed against the index point read + user point read.
+
+Runs against the Cosmos account configured in the environment (.env).
+
+Usage: python -m benchmarks.username_lookup [--iterations 200] [--username user1]
+"""
+import argparse
+import statistics
+import time
+from app.config.database import open_client
+from app.services.user_service import username_index_id
+
+def _request_charge(container) -> float:
+    return float(container.client_connection.last_response_headers.get("x-ms-request-charge", 0))
+
+def query_lookup(user_container, username: str) -> float:
+    query = "SELECT * FROM users u WHERE u.username = @username"
+    list(user_container.query_items(query, parameters=[{"name": "@username", "value": username}], enable_cross_partition_query=True))
+    return _request_charge(user_container)
+
+def index_lookup(user_container, username_container, username: str) -> float:
+    index_id = username_index_id(username)
+    index_item = username_container.read_item(item=index_id, partition_key=index_id)
+    charge = _request_charge(username_container)
+    user_container.read_item(item=index_item["user_id"], partition_key=index_item["user_id"])
+    return charge + _request_charge(user_container)
+
+def run(name: str, func, iterations: int) -> None:
+    latencies = []
+    charges = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        charges.append(func())
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<14} p50={statistics.median(latencies):7.2f}ms p95={p95:7.2f}ms RU/lookup={statistics.mean(charges):6.2f}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--username", default="user1")
+    args = parser.parse_args()
+
+    database = open_client()
+    user_container = database.get_container_client("users")
+    username_container = database.get_container_client("usernames")
+
+    # Warm up connections and query plans
+    query_lookup(user_container, args.username)
+    index_lookup(user_container, username_container, args.username)
+
+    run("query", lambda: query_lookup(user_container, args.username), args.iterations)
+    run("index", lambda: index_lookup(user_container, username_container, args.username), args.iterations)
+
+if __name__ == "__main__":
+    main()
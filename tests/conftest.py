@@ -0,0 +1,24 @@
+import os
+import pytest
+
+# The settings are read when the app modules are imported: run on the in-process backend
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("EMAIL_SENDER", "fake")
+
+def pytest_addoption(parser):
+    parser.addoption("--runslow", action="store_true", default=False, help="Also run the tests marked slow (they start uvicorn workers)")
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: starts several uvicorn workers, only run with --runslow")
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--runslow"):
+        return
+    skip_slow = pytest.mark.skip(reason="slow, run with --runslow")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,47 @@
+"""
+Concurrent bookings of the same trainer (see benchmarks.booking_stress for the large runs).
+"""
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+import pytest
+from app.config.storage import get_repository
+from app.schemas.training import TrainingCreate
+from app.services.slot_index import slot_index
+from app.services.training_service import BookingConflict, TrainingService
+from benchmarks.booking_stress import run_round
+
+pytestmark = pytest.mark.anyio
+
+BOOKINGS = 50
+
+async def test_concurrent_bookings_of_the_same_slot_book_it_once():
+    result = await run_round(TrainingService(), BOOKINGS, overlapping=False)
+    assert result["booked"] == 1
+    assert result["conflict"] == BOOKINGS - 1
+    assert result["stored"] == 1
+
+async def test_concurrent_overlapping_bookings_book_the_trainer_once():
+    result = await run_round(TrainingService(), BOOKINGS, overlapping=True)
+    assert result["booked"] == 1
+    assert result["stored"] == 1
+
+async def test_back_to_back_bookings_do_not_conflict():
+    service = TrainingService()
+    trainer_id = f"test-trainer-{uuid4()}"
+    start = datetime(2030, 1, 1, 10, tzinfo=timezone.utc)
+    await get_repository("availabilities").create({
+        "id": str(uuid4()), "trainer_id": trainer_id, "center_id": "test-center",
+        "available_times": [start, start + timedelta(hours=1)],
+    })
+    await slot_index.rebuild()
+
+    def booking(offset: int) -> TrainingCreate:
+        return TrainingCreate(
+            trainer_id=trainer_id, user_id=f"member-{uuid4()}", status="scheduled",
+            start_time=start + timedelta(hours=offset), end_time=start + timedelta(hours=offset + 1),
+        )
+
+    await service.create_training(booking(0))
+    await service.create_training(booking(1))
+    with pytest.raises(BookingConflict):
+        await service.create_training(booking(0))
@@ -0,0 +1,14 @@
+"""
+Writes served by one worker reach the caches of the others through the invalidation bus
+(see benchmarks.cache_staleness for the large runs).
+"""
+import pytest
+from benchmarks.cache_staleness import measure, parse_args
+
+@pytest.mark.slow
+def test_every_worker_serves_the_writes_of_the_others():
+    args = parse_args(["--workers", "2", "--rounds", "2", "--port", "8790"])
+    staleness = measure(args)
+    assert set(staleness) == {"training", "user", "availability", "booking"}
+    for cache, values in staleness.items():
+        assert max(values) <= args.max_staleness, f"{cache} served stale data for {max(values):.3f}s"
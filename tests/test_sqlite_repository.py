@@ -0,0 +1,38 @@
+"""
+Time-to-live emulation of the SQLite backend.
+"""
+import time
+from uuid import uuid4
+import pytest
+from app.repositories.base import ItemExistsError, ItemNotFoundError
+from app.repositories.sqlite import SQLiteRepository
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def repository():
+    return SQLiteRepository(f"test_{uuid4().hex}", "/user_id")
+
+def expire(monkeypatch, seconds: float) -> None:
+    now = time.time() + seconds
+    monkeypatch.setattr(time, "time", lambda: now)
+
+async def test_create_replaces_an_expired_document(repository, monkeypatch):
+    await repository.create({"id": "a", "user_id": "u", "version": 1, "ttl": 1})
+    expire(monkeypatch, 5)
+    with pytest.raises(ItemNotFoundError):
+        await repository.read("a", "u")
+    created = await repository.create({"id": "a", "user_id": "u", "version": 2})
+    assert (await repository.read("a", "u"))["_etag"] == created["_etag"]
+    assert (await repository.read("a", "u"))["version"] == 2
+
+async def test_create_batch_replaces_an_expired_document(repository, monkeypatch):
+    await repository.create({"id": "a", "user_id": "u", "ttl": 1})
+    expire(monkeypatch, 5)
+    await repository.create_batch([{"id": "a", "user_id": "u"}, {"id": "b", "user_id": "u"}])
+    assert [item["id"] async for item in repository.query(partition_key="u")] == ["a", "b"]
+
+async def test_create_of_a_live_document_still_conflicts(repository):
+    await repository.create({"id": "a", "user_id": "u", "ttl": 3600})
+    with pytest.raises(ItemExistsError):
+        await repository.create({"id": "a", "user_id": "u"})